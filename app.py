@@ -2,29 +2,122 @@
 """
 Flask backend for GeoJSON Pipeline Web App
 Handles file uploads and processes CSV files using the pipeline scripts
+
+The pipeline (pandas, geopandas, shapely, pyproj) is imported on first use,
+so the server starts listening at once. Unless GEOJSON_WARMUP=0, a background
+thread then imports it and loads the lookup indexes and county boundaries,
+so the first request doesn't wait for them either.
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
+import importlib
+import importlib.util
+import json
 import os
-import tempfile
 import shutil
-import subprocess
-import json
+import sys
+import threading
+import traceback
 from pathlib import Path
-import pandas as pd
+
+# Pipeline scripts live in scripts/ and are imported directly
+sys.path.insert(0, str(Path(__file__).parent / 'scripts'))
+
+from instrumentation import LatencyHistograms, add_sink, log_to_stream
+from jobs import JobQueue, QueueFull, FINISHED
+from result_cache import ResultCache, result_key
 
 app = Flask(__name__)
 CORS(app)
 
+# Uploads are processed in the background, a few at a time (GEOJSON_JOB_WORKERS)
+jobs = JobQueue()
+
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'outputs'
 ALLOWED_EXTENSIONS = {'csv'}
 
+# Output levels (create_geojson_levels.LEVELS), kept here so requests are
+# validated without importing the pipeline
+LEVELS = ('zip', 'county', 'chapter', 'region', 'division')
+
+# Content types of the generated files (GeoParquet / FlatGeobuf are optional formats)
+DOWNLOAD_MIMETYPES = {
+    '.geojson': 'application/geo+json',
+    '.topojson': 'application/json',
+    '.parquet': 'application/vnd.apache.parquet',
+    '.fgb': 'application/flatgeobuf'
+}
+
 # Create folders if they don't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Results are stored in OUTPUT_FOLDER by a hash of the CSV bytes and options
+results = ResultCache(OUTPUT_FOLDER)
+
+# Every build's stage records (see scripts/instrumentation.py) are logged to
+# stderr as JSON (unless GEOJSON_STAGE_LOG=0) and aggregated for /api/metrics;
+# GEOJSON_CPROFILE_DIR also profiles every stage into that directory
+metrics = LatencyHistograms()
+add_sink(metrics)
+if os.environ.get('GEOJSON_STAGE_LOG', '1') != '0':
+    log_to_stream()
+CPROFILE_DIR = os.environ.get('GEOJSON_CPROFILE_DIR') or None
+
+# Vector tiles need the optional mapbox-vector-tile (see scripts/vector_tiles.py);
+# without it the web page previews server builds as GeoJSON or TopoJSON
+TILES_AVAILABLE = importlib.util.find_spec('mapbox_vector_tile') is not None
+
+# Held while importing pipeline modules, so concurrent first uses import once
+_import_lock = threading.Lock()
+
+# Background warm-up: 'disabled', 'pending', 'running', 'ready' or 'failed'
+_warm_up_lock = threading.Lock()
+warm_up_state = {'status': 'pending' if os.environ.get('GEOJSON_WARMUP', '1') != '0' else 'disabled'}
+
+def pipeline(name='create_geojson_levels'):
+    """A pipeline module from scripts/, imported on first use"""
+    with _import_lock:
+        return importlib.import_module(name)
+
+def warm_up():
+    """Import the pipeline and load what every build needs, ahead of the first request"""
+    warm_up_state['status'] = 'running'
+    try:
+        pipeline()
+        pipeline('zip_index').load_index()
+        pipeline('enrich').load_lookup()
+        # Boundary files stay in memory once read (see boundary_store.read_stored):
+        # county boundaries as stored (dissolving) and as the county level uses them
+        store = pipeline('boundary_store')
+        for simplify in [None, 0.001]:
+            try:
+                store.load_boundaries(store.COUNTY_VINTAGE, simplify=simplify)
+            except store.BoundaryUnavailable:
+                pass
+    except Exception as e:
+        traceback.print_exc()
+        warm_up_state.update({'status': 'failed', 'error': str(e)})
+        return
+    warm_up_state['status'] = 'ready'
+
+def start_warm_up():
+    """Run warm_up() in a background thread, once (unless GEOJSON_WARMUP=0)"""
+    with _warm_up_lock:
+        if warm_up_state['status'] != 'pending':
+            return None
+        warm_up_state['status'] = 'running'
+    thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+@app.before_request
+def warm_up_on_first_request():
+    """Start the warm-up with the first request, under any server"""
+    start_warm_up()
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -33,23 +126,29 @@ def index():
     """Serve the main HTML page"""
     return send_file('index.html')
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
-    """Handle CSV file upload"""
+def save_upload():
+    """Save the request's CSV file to UPLOAD_FOLDER, returns (filename, error response)"""
     if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
+        return None, (jsonify({'error': 'No file provided'}), 400)
     
     file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+        return None, (jsonify({'error': 'No file selected'}), 400)
     
     if not allowed_file(file.filename):
-        return jsonify({'error': 'Only CSV files are allowed'}), 400
+        return None, (jsonify({'error': 'Only CSV files are allowed'}), 400)
     
-    # Save uploaded file
     filename = file.filename
+    file.save(os.path.join(UPLOAD_FOLDER, filename))
+    return filename, None
+
+@app.route('/api/upload', methods=['POST'])
+def upload_file():
+    """Handle CSV file upload"""
+    filename, error = save_upload()
+    if error is not None:
+        return error
     filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
     
     # Get file info
     file_size = os.path.getsize(filepath)
@@ -61,12 +160,77 @@ def upload_file():
         'message': 'File uploaded successfully'
     })
 
+def valid_key(key):
+    """True for a result key (64 hex digits), which is safe to use in paths"""
+    return isinstance(key, str) and len(key) == 64 and all(c in '0123456789abcdef' for c in key)
+
+def run_processing(filepath, key, output_dir, levels, topojson, progress=None, subset=None, base=None,
+                   formats=None, incremental=False):
+    """Job body: build the levels, describe the generated files and store the result"""
+    # Incremental builds keep their state (see scripts/incremental.py), so a
+    # later upload can name this result as its base (builds with other
+    # formats than GeoJSON always run in full)
+    if base is not None:
+        # Start from the base result's files: only what the new CSV changes is rebuilt
+        try:
+            shutil.copytree(os.path.join(results.result_dir(base), 'geojson_output'), output_dir,
+                            dirs_exist_ok=True)
+        except OSError:
+            # Evicted meanwhile: the build runs in full
+            pass
+    # Build all selected levels in one pass (CSV and boundaries load once)
+    level_files = pipeline().build_levels(filepath, levels=levels, output_dir=output_dir, topojson=topojson,
+                                          progress=progress, cprofile_dir=CPROFILE_DIR,
+                                          incremental=incremental and not formats, formats=formats,
+                                          **(subset or {}))
+
+    generated_files = []
+    for level in levels + ['topojson']:
+        # The level's GeoJSON (or the TopoJSON), then its other formats
+        level_formats = [(level, 'topojson' if level == 'topojson' else 'geojson')]
+        level_formats += [(f"{level}_{name}", name) for name in formats or []]
+        for file_key, file_format in level_formats:
+            if file_key not in level_files:
+                continue
+            level_path = str(level_files[file_key])
+            generated_files.append({
+                'level': level,
+                'format': file_format,
+                'filename': os.path.basename(level_path),
+                'size': os.path.getsize(level_path),
+                # Relative path from OUTPUT_FOLDER for download
+                'path': os.path.relpath(level_path, OUTPUT_FOLDER)
+            })
+
+    result = {
+        'files': generated_files,
+        'message': f'Successfully generated {len(generated_files)} files'
+    }
+    results.put(key, result)
+    results.evict(keep=jobs.active_keys())
+    return result
+
 @app.route('/api/process', methods=['POST'])
 def process_file():
-    """Process CSV file and generate GeoJSON files"""
+    """Queue processing of an uploaded CSV, returns the job ID to follow"""
     data = request.json
     filename = data.get('filename')
     levels = data.get('levels', [])
+    topojson = bool(data.get('topojson', False))
+    # Optional subset: only these rows are built, and only their boundaries read
+    subset = {name: data[name] for name in ('bbox', 'states', 'divisions') if data.get(name)}
+    if isinstance(subset.get('states'), str) and subset['states'] != 'auto':
+        subset['states'] = [subset['states']]
+    if isinstance(subset.get('divisions'), str):
+        subset['divisions'] = [subset['divisions']]
+    # Optional result key of an earlier upload of the same data, to rebuild incrementally from;
+    # "incremental": true keeps this build's state so a later upload can use it as its base
+    base = data.get('base')
+    incremental = bool(data.get('incremental', False)) or base is not None
+    # Optional formats written next to each level's GeoJSON ('geoparquet', 'flatgeobuf')
+    formats = data.get('formats') or []
+    if isinstance(formats, str):
+        formats = [formats]
     
     if not filename:
         return jsonify({'error': 'No filename provided'}), 400
@@ -74,196 +238,273 @@ def process_file():
     if not levels:
         return jsonify({'error': 'No levels selected'}), 400
     
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    unknown_levels = [level for level in levels if level not in LEVELS]
+    if unknown_levels:
+        return jsonify({'error': f"Unknown level(s): {', '.join(unknown_levels)}"}), 400
     
-    if not os.path.exists(filepath):
-        return jsonify({'error': 'File not found'}), 404
+    if 'bbox' in subset:
+        try:
+            pipeline().parse_bbox(subset['bbox'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
     
-    # Create temporary directory for this processing session
-    session_id = f"session_{hash(filename)}"
-    temp_dir = os.path.join(OUTPUT_FOLDER, session_id)
-    os.makedirs(temp_dir, exist_ok=True)
+    if subset.get('states') not in (None, 'auto'):
+        try:
+            pipeline().parse_states(subset['states'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
     
-    # Copy CSV to temp directory
-    temp_csv = os.path.join(temp_dir, filename)
-    shutil.copy(filepath, temp_csv)
+    if 'divisions' in subset and not (isinstance(subset['divisions'], list) and
+                                      all(isinstance(division, str) for division in subset['divisions'])):
+        return jsonify({'error': 'divisions must be a list of division names'}), 400
     
-    # Copy scripts to temp directory
-    scripts_dir = Path(__file__).parent / 'scripts'
-    for script in ['create_geojson_levels.py', 'create_zip_geojson.py']:
-        script_path = scripts_dir / script
-        if script_path.exists():
-            shutil.copy(script_path, temp_dir)
+    unknown_formats = [name for name in formats if name not in pipeline('geo_formats').FORMATS]
+    if unknown_formats:
+        return jsonify({'error': f"Unknown format(s): {', '.join(map(str, unknown_formats))}"}), 400
     
-    # Modify scripts to use temp CSV
-    modify_scripts_for_processing(temp_dir, filename)
+    if base is not None and (not valid_key(base) or results.get(base) is None):
+        return jsonify({'error': 'base must be the result key of a stored result'}), 400
     
-    generated_files = []
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
     
-    try:
-        # Process each selected level
-        for level in levels:
-            result = process_level(level, temp_dir, temp_csv)
-            if result:
-                generated_files.append(result)
-        
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'File not found'}), 404
+    
+    # Same CSV bytes and options → same result directory, served straight from the cache
+    key = result_key(filepath, levels, {'topojson': topojson, **subset, **({'formats': formats} if formats else {})})
+    cached = results.get(key)
+    if cached is not None:
         return jsonify({
             'success': True,
-            'files': generated_files,
-            'message': f'Successfully generated {len(generated_files)} GeoJSON files'
+            'cached': True,
+            'status': 'succeeded',
+            'result': cached,
+            'message': 'Already processed, returning the stored result'
         })
     
-    except Exception as e:
-        return jsonify({
-            'error': str(e),
-            'message': 'Error processing file'
-        }), 500
-
-def modify_scripts_for_processing(temp_dir, csv_filename):
-    """Modify Python scripts to use the uploaded CSV"""
-    scripts = ['create_geojson_levels.py', 'create_zip_geojson.py']
+    output_dir = os.path.join(results.result_dir(key), 'geojson_output')
+    os.makedirs(output_dir, exist_ok=True)
+    
+    try:
+        job = jobs.submit(run_processing, filepath, key, output_dir, levels, topojson, subset=subset, base=base,
+                          formats=formats, incremental=incremental, description={'filename': filename, 'levels': levels, **subset}, key=key)
+    except QueueFull as e:
+        return jsonify({'error': str(e), 'message': 'Server busy'}), 503
     
-    for script_name in scripts:
-        script_path = os.path.join(temp_dir, script_name)
-        if os.path.exists(script_path):
-            with open(script_path, 'r') as f:
-                content = f.read()
-            
-            # Replace CSV file path - handle both formats
-            old_patterns = [
-                'CSV_FILE = DATA_DIR / "Biomed by zip code_ENHANCED.csv"',
-                'CSV_FILE = DATA_DIR / "Biomed by zip code_ENHANCED.csv"',
-                f'CSV_FILE = DATA_DIR / "{csv_filename}"'
-            ]
-            
-            for pattern in old_patterns:
-                if pattern in content:
-                    content = content.replace(
-                        pattern,
-                        f'CSV_FILE = DATA_DIR / "{csv_filename}"'
-                    )
-                    break
-            
-            # If no pattern found, add it after DATA_DIR definition
-            if f'CSV_FILE = DATA_DIR / "{csv_filename}"' not in content:
-                content = content.replace(
-                    'DATA_DIR = Path(__file__).parent.parent',
-                    f'DATA_DIR = Path(__file__).parent.parent\nCSV_FILE = DATA_DIR / "{csv_filename}"'
-                )
-            
-            with open(script_path, 'w') as f:
-                f.write(content)
-
-def process_level(level, temp_dir, csv_path):
-    """Process a specific geographic level"""
-    # All levels use create_geojson_levels.py except zip which uses create_zip_geojson.py
-    if level == 'zip':
-        script_name = 'create_zip_geojson.py'
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/api/jobs/{job.id}',
+        'events_url': f'/api/jobs/{job.id}/events',
+        'message': 'Processing started'
+    }), 202
+
+@app.route('/api/enrich', methods=['POST'])
+def enrich_file():
+    """
+    Add County / FIPS and the chapter hierarchy to a CSV (see scripts/enrich.py)
+    Send an uploaded filename as JSON, or the CSV itself as multipart 'file'.
+    format 'csv' (default) returns the enriched CSV. format 'geojson' queues
+    a job building one level (level, default 'county') from it, like
+    /api/process: 202 with the job ID, or the stored result if already built.
+    """
+    if 'file' in request.files:
+        filename, error = save_upload()
+        if error is not None:
+            return error
+        data = request.form
     else:
-        script_name = 'create_geojson_levels.py'
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename')
+    output_format = data.get('format', 'csv')
+    level = data.get('level', 'county')
     
-    script_path = os.path.join(temp_dir, script_name)
-    output_dir = os.path.join(temp_dir, 'geojson_output')
-    os.makedirs(output_dir, exist_ok=True)
+    if not filename:
+        return jsonify({'error': 'No filename provided'}), 400
     
-    # Change to temp directory and run script
-    original_dir = os.getcwd()
-    try:
-        os.chdir(temp_dir)
-        
-        # Run the Python script
-        result = subprocess.run(
-            ['python3', script_name],
-            capture_output=True,
-            text=True,
-            timeout=600  # 10 minute timeout (ZIP processing can take time)
-        )
-        
-        if result.returncode != 0:
-            print(f"Script output: {result.stdout}")
-            print(f"Script error: {result.stderr}")
-            raise Exception(f"Script failed: {result.stderr[:500]}")
+    if output_format not in ('csv', 'geojson'):
+        return jsonify({'error': f"Unknown format: {output_format}"}), 400
+    
+    if output_format == 'geojson' and level not in LEVELS:
+        return jsonify({'error': f"Unknown level: {level}"}), 400
+    
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    
+    if not os.path.exists(filepath):
+        return jsonify({'error': 'File not found'}), 404
+    
+    levels = [level] if output_format == 'geojson' else []
+    key = result_key(filepath, levels, {'enrich': output_format})
+    result = results.get(key)
+    
+    if output_format == 'geojson':
+        if result is not None:
+            return jsonify({
+                'success': True,
+                'cached': True,
+                'status': 'succeeded',
+                'result': result,
+                'message': 'Already processed, returning the stored result'
+            })
         
-        # Find generated file based on level
-        expected_filenames = {
-            'zip': 'biomed_zip_codes.geojson',
-            'county': 'biomed_counties.geojson',
-            'chapter': 'biomed_chapters.geojson',
-            'region': 'biomed_regions.geojson',
-            'division': 'biomed_divisions.geojson'
-        }
+        # Enriching is quick and stays in the request; the level is built by a job
+        result_dir = results.result_dir(key)
+        os.makedirs(result_dir, exist_ok=True)
+        enriched_path = os.path.join(result_dir, f"{Path(filename).stem}_enriched.csv")
+        if key not in jobs.active_keys():
+            pipeline('enrich').enrich_csv(filepath, enriched_path)
         
-        expected_filename = expected_filenames.get(level)
-        filepath = os.path.join(output_dir, expected_filename)
+        try:
+            job = jobs.submit(run_processing, enriched_path, key, os.path.join(result_dir, 'geojson_output'),
+                              levels, False, description={'filename': filename, 'levels': levels, 'enrich': True},
+                              key=key)
+        except QueueFull as e:
+            return jsonify({'error': str(e), 'message': 'Server busy'}), 503
         
-        if os.path.exists(filepath):
-            file_size = os.path.getsize(filepath)
-            # Return relative path from OUTPUT_FOLDER for download
-            rel_path = os.path.relpath(filepath, OUTPUT_FOLDER)
-            return {
-                'level': level,
-                'filename': expected_filename,
-                'size': file_size,
-                'path': rel_path
-            }
-        else:
-            # Try to find any geojson file that was created
-            geojson_files = list(Path(output_dir).glob('*.geojson'))
-            if geojson_files:
-                # Find the one matching our level
-                for gf in geojson_files:
-                    if level in str(gf).lower():
-                        filepath = str(gf)
-                        file_size = os.path.getsize(filepath)
-                        rel_path = os.path.relpath(filepath, OUTPUT_FOLDER)
-                        return {
-                            'level': level,
-                            'filename': os.path.basename(filepath),
-                            'size': file_size,
-                            'path': rel_path
-                        }
-                # If no match, return first one
-                filepath = str(geojson_files[0])
-                file_size = os.path.getsize(filepath)
-                rel_path = os.path.relpath(filepath, OUTPUT_FOLDER)
-                return {
-                    'level': level,
-                    'filename': os.path.basename(filepath),
-                    'size': file_size,
-                    'path': rel_path
-                }
-            else:
-                raise Exception(f"No GeoJSON file was generated for {level}")
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f'/api/jobs/{job.id}',
+            'events_url': f'/api/jobs/{job.id}/events',
+            'message': 'Processing started'
+        }), 202
     
-    finally:
-        os.chdir(original_dir)
+    if result is None:
+        result_dir = results.result_dir(key)
+        os.makedirs(result_dir, exist_ok=True)
+        output_path = os.path.join(result_dir, f"{Path(filename).stem}_enriched.csv")
+        pipeline('enrich').enrich_csv(filepath, output_path)
+        result = {
+            'files': [{
+                'level': 'enriched',
+                'filename': os.path.basename(output_path),
+                'size': os.path.getsize(output_path),
+                'path': os.path.relpath(output_path, OUTPUT_FOLDER)
+            }],
+            'message': 'Successfully enriched the CSV'
+        }
+        results.put(key, result)
+        results.evict(keep=jobs.active_keys() | {key})
     
-    return None
+    output = result['files'][0]
+    return send_file(os.path.abspath(os.path.join(OUTPUT_FOLDER, output['path'])), mimetype='text/csv',
+                     as_attachment=True, download_name=output['filename'])
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status, stage progress and (when finished) result of a processing job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events: the job status on every change, until it finishes"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def events():
+        version = None
+        while True:
+            if version is not None:
+                new_version = jobs.wait(job, version, timeout=15)
+                if new_version == version:
+                    # Keep the connection alive through proxies
+                    yield ': keep-alive\n\n'
+                    continue
+            version = job.version
+            state = job.to_dict()
+            yield f"event: status\ndata: {json.dumps(state)}\n\n"
+            if state['status'] in FINISHED:
+                return
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a job (queued jobs stop at once, running jobs at their next stage)"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
 
 @app.route('/api/download/<path:filepath>')
 def download_file(filepath):
-    """Download generated GeoJSON file"""
-    # filepath comes as: session_id/filename or session_id/geojson_output/filename
+    """Download a generated file (GeoJSON, TopoJSON, GeoParquet or FlatGeobuf; range requests are supported)"""
+    # filepath comes as: result_key/geojson_output/filename
     full_path = os.path.join(OUTPUT_FOLDER, filepath)
     
     # Normalize path to prevent directory traversal
-    full_path = os.path.normpath(full_path)
-    if not full_path.startswith(os.path.abspath(OUTPUT_FOLDER)):
+    full_path = os.path.abspath(full_path)
+    if not full_path.startswith(os.path.abspath(OUTPUT_FOLDER) + os.sep):
         return jsonify({'error': 'Invalid path'}), 400
     
     if not os.path.exists(full_path):
         return jsonify({'error': 'File not found'}), 404
     
     filename = os.path.basename(full_path)
-    return send_file(full_path, as_attachment=True, download_name=filename)
+    return send_file(full_path, as_attachment=True, download_name=filename,
+                     mimetype=DOWNLOAD_MIMETYPES.get(Path(filename).suffix))
+
+@app.route('/api/tiles/<session>/<level>/<int:z>/<int:x>/<int:y>.pbf')
+def vector_tile(session, level, z, x, y):
+    """
+    Mapbox Vector Tile of a generated level (see scripts/vector_tiles.py)
+    session is the result key of a processed upload; tiles are rendered on
+    first request and kept in the result's tiles/<level>/ directory.
+    """
+    if not valid_key(session):
+        return jsonify({'error': 'Invalid session'}), 400
+
+    result = results.get(session)
+    if result is None:
+        return jsonify({'error': 'Result not found'}), 404
+
+    level_file = next((item for item in result.get('files', [])
+                       if item['level'] == level and item['filename'].endswith('.geojson')), None)
+    if level_file is None:
+        return jsonify({'error': f"No {level} level in this result"}), 404
+
+    vector_tiles = pipeline('vector_tiles')
+    if not vector_tiles.valid_tile(z, x, y):
+        return jsonify({'error': 'Invalid tile'}), 400
+
+    cache = vector_tiles.TileCache(os.path.join(results.result_dir(session), 'tiles', level),
+                                   os.path.join(OUTPUT_FOLDER, level_file['path']), layer=level)
+    try:
+        tile = cache.get(z, x, y)
+    except vector_tiles.TilesUnavailable as e:
+        return jsonify({'error': str(e)}), 501
+
+    if not tile:
+        return Response(status=204)
+    return Response(tile, mimetype='application/vnd.mapbox-vector-tile',
+                    headers={'Cache-Control': 'public, max-age=86400'})
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_summary():
+    """Latency histograms of every build stage (level_<level> / write_<level> per level) and whole builds since startup"""
+    summary = metrics.to_dict()
+    summary['active_jobs'] = len(jobs.active_keys())
+    return jsonify(summary)
 
 @app.route('/api/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
-    return jsonify({'status': 'ok', 'message': 'GeoJSON Pipeline API is running'})
+    """Health check endpoint (answers at once, whether or not the pipeline is loaded yet)"""
+    return jsonify({'status': 'ok', 'message': 'GeoJSON Pipeline API is running',
+                    'warm_up': dict(warm_up_state), 'vector_tiles': TILES_AVAILABLE})
 
 if __name__ == '__main__':
     print("Starting GeoJSON Pipeline Web App...")
     print("Open http://localhost:5000 in your browser")
+    # With the debug reloader, only the child process serves requests; start
+    # its warm-up right away instead of with the first request
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warm_up()
     app.run(debug=True, port=5000)
 
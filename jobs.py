@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Background job queue for the web app
+
+Processing an upload can take minutes, so /api/process only queues a job and
+returns its ID. Jobs run on a small, bounded pool of worker threads and report
+their progress stage by stage; clients poll /api/jobs/<id> or follow
+/api/jobs/<id>/events (server-sent events).
+
+Cancelling is cooperative: a queued job is dropped straight away, a running
+job stops at its next stage boundary (the progress callback raises
+JobCancelled inside the pipeline).
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Jobs running at once (GEOJSON_JOB_WORKERS), and jobs allowed to wait for a worker
+DEFAULT_WORKERS = 2
+MAX_PENDING = 20
+
+# Finished jobs are forgotten after this long
+JOB_TTL_SECONDS = 3600
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when it has been cancelled"""
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are already waiting"""
+
+
+class Job:
+    """State of one job, updated by its worker and read by the API"""
+
+    def __init__(self, job_id, description=None, key=None):
+        self.id = job_id
+        self.key = key
+        self.description = description or {}
+        self.status = QUEUED
+        self.stage = None
+        self.stages_done = 0
+        self.stages_total = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0
+        self.cancel_requested = threading.Event()
+        self.future = None
+
+    def to_dict(self):
+        progress = None
+        if self.status == SUCCEEDED:
+            progress = 1.0
+        elif self.stages_total:
+            progress = round(self.stages_done / self.stages_total, 3)
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'stages_done': self.stages_done,
+            'stages_total': self.stages_total,
+            'progress': progress,
+            'cancel_requested': self.cancel_requested.is_set(),
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'result': self.result,
+            'error': self.error,
+            **self.description
+        }
+
+
+class JobQueue:
+    """
+    Runs jobs on a bounded thread pool
+
+        queue = JobQueue()
+        job = queue.submit(work, arg, description={'filename': ...})
+
+    work is called as work(arg, progress=...); it calls progress(stage, done, total)
+    as it enters each stage, and its return value becomes the job's result.
+    """
+
+    def __init__(self, workers=None, max_pending=MAX_PENDING, ttl=JOB_TTL_SECONDS):
+        if workers is None:
+            workers = int(os.environ.get('GEOJSON_JOB_WORKERS', DEFAULT_WORKERS))
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='geojson-job')
+        self._jobs = {}
+        self._changed = threading.Condition()
+
+    def submit(self, work, *args, description=None, key=None, **kwargs):
+        """
+        Queue a job, returns its Job (raises QueueFull if too many are waiting)
+        If key is given and an unfinished job has the same key, that job is
+        returned instead of queuing the same work twice.
+        """
+        with self._changed:
+            self._prune()
+            if key is not None:
+                for job in self._jobs.values():
+                    if job.key == key and job.status not in FINISHED and not job.cancel_requested.is_set():
+                        return job
+            pending = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} jobs are already waiting, try again later")
+            job = Job(uuid.uuid4().hex, description, key)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job, work, args, kwargs)
+        return job
+
+    def active_keys(self):
+        """Keys of the jobs that are queued or running"""
+        with self._changed:
+            return {job.key for job in self._jobs.values() if job.key is not None and job.status not in FINISHED}
+
+    def get(self, job_id):
+        """The job with this ID, or None"""
+        with self._changed:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation, returns the job (None if unknown)"""
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return job
+        job.cancel_requested.set()
+        if job.future is not None and job.future.cancel():
+            # Never started
+            self._update(job, status=CANCELLED, finished=time.time())
+        else:
+            self._update(job)
+        return job
+
+    def wait(self, job, version, timeout=None):
+        """Block until the job changes past version (or timeout), returns its new version"""
+        with self._changed:
+            self._changed.wait_for(lambda: job.version != version, timeout=timeout)
+            return job.version
+
+    def _update(self, job, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.version += 1
+            self._changed.notify_all()
+
+    def _run(self, job, work, args, kwargs):
+        if job.cancel_requested.is_set():
+            self._update(job, status=CANCELLED, finished=time.time())
+            return
+
+        def progress(stage, done, total):
+            if job.cancel_requested.is_set():
+                raise JobCancelled(f"Job {job.id} was cancelled")
+            self._update(job, stage=stage, stages_done=done, stages_total=total)
+
+        self._update(job, status=RUNNING, started=time.time())
+        try:
+            result = work(*args, progress=progress, **kwargs)
+        except JobCancelled:
+            self._update(job, status=CANCELLED, finished=time.time())
+        except Exception as e:
+            self._update(job, status=FAILED, error=str(e), finished=time.time())
+        else:
+            self._update(job, status=SUCCEEDED, result=result, finished=time.time())
+
+    def _prune(self):
+        """Forget finished jobs older than the TTL (caller holds the lock)"""
+        cutoff = time.time() - self.ttl
+        for job_id in [job.id for job in self._jobs.values() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
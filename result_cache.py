@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of processing results
+
+Each result lives in outputs/<key>/, where key is a SHA-256 of the uploaded
+CSV's bytes plus the requested levels and options. The same upload with the
+same options, even after a restart or under another filename, maps to the
+same directory, and different files never share one.
+
+A result is complete once its manifest (result.json, written last) exists;
+reading it marks the result as recently used. evict() removes results older
+than a maximum age, then least recently used ones until outputs/ fits in a
+maximum size.
+
+Environment:
+    GEOJSON_RESULTS_MAX_MB        size limit of outputs/ (default 2048)
+    GEOJSON_RESULTS_MAX_AGE_DAYS  results unused this long are removed (default 7)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+# Bump when pipeline output changes, so old results are not served
+CACHE_VERSION = 1
+
+MANIFEST_NAME = 'result.json'
+DEFAULT_MAX_MB = 2048
+DEFAULT_MAX_AGE_DAYS = 7
+
+# Incomplete results (failed or cancelled jobs) are removed after this long
+INCOMPLETE_GRACE_SECONDS = 3600
+
+
+def result_key(csv_path, levels, options=None, chunk_size=1024 * 1024):
+    """SHA-256 of the CSV bytes, the levels (in any order) and the options"""
+    digest = hashlib.sha256()
+    with open(csv_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    settings = {'version': CACHE_VERSION, 'levels': sorted(levels), 'options': options or {}}
+    digest.update(json.dumps(settings, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Results in per-key directories under one folder, with size and age limits"""
+
+    def __init__(self, folder, max_bytes=None, max_age=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('GEOJSON_RESULTS_MAX_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+        if max_age is None:
+            max_age = float(os.environ.get('GEOJSON_RESULTS_MAX_AGE_DAYS', DEFAULT_MAX_AGE_DAYS)) * 86400
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def result_dir(self, key):
+        return self.folder / key
+
+    def get(self, key):
+        """The stored result for a key (marking it as used), or None"""
+        manifest = self.result_dir(key) / MANIFEST_NAME
+        try:
+            with open(manifest) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Artifacts may have been removed by hand
+        if not all((self.folder / item['path']).exists() for item in result.get('files', [])):
+            return None
+        os.utime(manifest)
+        return result
+
+    def put(self, key, result):
+        """Store a result's manifest, which marks the result complete"""
+        manifest = self.result_dir(key) / MANIFEST_NAME
+        manifest.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = manifest.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f, indent=2)
+        os.replace(tmp_path, manifest)
+
+    def evict(self, keep=()):
+        """
+        Remove expired results, then least recently used ones until the folder fits
+        Results whose key is in keep (e.g. jobs still running) are never removed.
+        Returns the number of results removed.
+        """
+        now = time.time()
+        entries = []
+        removed = 0
+        for result_dir in self.folder.iterdir() if self.folder.exists() else []:
+            if not result_dir.is_dir() or result_dir.name in keep:
+                continue
+            manifest = result_dir / MANIFEST_NAME
+            complete = manifest.exists()
+            last_used = (manifest if complete else result_dir).stat().st_mtime
+            expired = now - last_used > (self.max_age if complete else INCOMPLETE_GRACE_SECONDS)
+            if expired:
+                shutil.rmtree(result_dir, ignore_errors=True)
+                removed += 1
+            elif complete:
+                entries.append((last_used, _directory_size(result_dir), result_dir))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, result_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(result_dir, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+
+def _directory_size(path):
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
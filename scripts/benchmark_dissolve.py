@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Benchmark the topology dissolve (dissolve.py) against GeoDataFrame.dissolve()
+
+Runs on the full county boundary set from the boundary store. Counties are
+grouped into chapter / region / division sized groups, either from a Biomed
+CSV (the real memberships) or, without one, by a grid over the county
+centroids (~250, ~50 and ~6 contiguous groups).
+
+    python3 scripts/benchmark_dissolve.py
+    python3 scripts/benchmark_dissolve.py "Biomed by zip code_ENHANCED.csv" --output dissolve.json
+
+Reported per level:
+- current:  GeoDataFrame.dissolve() of the simplified counties (the old pipeline step)
+- topology: DissolveEngine.dissolve() with per-arc simplification
+- exact:    how far the unsimplified topology dissolve is from an unsimplified
+            GeoDataFrame.dissolve() (max relative symmetric difference area)
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+
+SCRIPTS_DIR = Path(__file__).parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from boundary_store import COUNTY_VINTAGE, load_boundaries
+from dissolve import DissolveEngine
+
+SIMPLIFY = 0.001
+
+# Grid sizes (columns, rows) giving roughly chapter, region and division sized groups
+GRID_LEVELS = {'chapter': (20, 13), 'region': (9, 6), 'division': (3, 2)}
+GROUP_COLUMNS = {'chapter': 'Chapter', 'region': 'Region', 'division': 'Division'}
+
+
+def grid_memberships(counties_gdf):
+    """Group counties by a grid over their centroids (contiguous, like real territories)"""
+    points = counties_gdf.geometry.representative_point()
+    x, y = points.x.values, points.y.values
+    memberships = {}
+    for level, (columns, rows) in GRID_LEVELS.items():
+        column = np.minimum(((x - x.min()) / (np.ptp(x) or 1) * columns).astype(int), columns - 1)
+        row = np.minimum(((y - y.min()) / (np.ptp(y) or 1) * rows).astype(int), rows - 1)
+        memberships[level] = pd.DataFrame({
+            'FIPS': counties_gdf['FIPS'].values,
+            GROUP_COLUMNS[level]: [f"{level}-{r:02d}-{c:02d}" for r, c in zip(row, column)]
+        })
+    return memberships
+
+
+def csv_memberships(csv_file):
+    """Real FIPS → chapter / region / division memberships from a Biomed CSV"""
+    from column_detector import format_code
+    from create_geojson_levels import load_csv
+    from rollup import default_specs, rollup_levels
+
+    df, year_cols, total_cols = load_csv(csv_file, all_columns=False)
+    _, memberships = rollup_levels(df, default_specs(year_cols, total_cols), list(GROUP_COLUMNS))
+    # The boundaries are keyed by FIPS strings, the rollup by FIPS code
+    return {level: membership.assign(FIPS=format_code(membership['FIPS']))
+            for level, membership in memberships.items()}
+
+
+def max_relative_difference(expected, actual, group_col):
+    """Largest symmetric difference area between matching groups, relative to the group's area"""
+    merged = expected.merge(actual, on=group_col, suffixes=('_expected', '_actual'))
+    a = np.asarray(merged['geometry_expected'].values, dtype=object)
+    b = np.asarray(merged['geometry_actual'].values, dtype=object)
+    difference = shapely.area(shapely.symmetric_difference(a, b)) / shapely.area(a)
+    return float(difference.max()) if len(difference) else 0.0
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def run(memberships, counties_gdf, simplified_gdf, exact=True):
+    """Time both dissolves for every level, returns the results as a dict"""
+    engine, build_seconds = timed(lambda: DissolveEngine(counties_gdf, simplify=SIMPLIFY))
+    exact_engine, exact_build_seconds = timed(lambda: DissolveEngine(counties_gdf)) if exact else (None, None)
+    print(f"   ✓ Topology built in {build_seconds:.2f}s ({len(engine.topology.arcs):,} arcs)")
+
+    print(f"\n   {'Level':<10} {'Groups':>6} {'Current (s)':>11} {'Topology (s)':>12} {'Speedup':>9} "
+          f"{'vs current':>11} {'Exact':>9}")
+
+    results = []
+    for level, membership in memberships.items():
+        group_col = GROUP_COLUMNS[level]
+
+        def current():
+            merged = simplified_gdf[['FIPS', 'geometry']].merge(membership, on='FIPS', how='inner')
+            return merged.dissolve(by=group_col).reset_index()
+
+        current_gdf, current_seconds = timed(current)
+        topology_gdf, topology_seconds = timed(lambda: engine.dissolve(membership, group_col))
+
+        result = {
+            'level': level,
+            'groups': len(topology_gdf),
+            'counties': int(membership['FIPS'].nunique()),
+            'current_seconds': current_seconds,
+            'topology_seconds': topology_seconds,
+            'speedup': current_seconds / topology_seconds if topology_seconds else None,
+            'vs_current': max_relative_difference(current_gdf, topology_gdf, group_col)
+        }
+        if exact:
+            unsimplified = counties_gdf[['FIPS', 'geometry']].merge(membership, on='FIPS', how='inner')
+            expected = unsimplified.dissolve(by=group_col).reset_index()
+            result['exact'] = max_relative_difference(expected, exact_engine.dissolve(membership, group_col), group_col)
+        results.append(result)
+
+        print(f"   {level:<10} {result['groups']:>6,} {current_seconds:>11.2f} {topology_seconds:>12.2f} "
+              f"{result['speedup']:>8.1f}x {result['vs_current']:>11.1e} {result.get('exact', float('nan')):>9.1e}")
+
+    return {'build_seconds': build_seconds, 'exact_build_seconds': exact_build_seconds, 'levels': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the topology dissolve against GeoDataFrame.dissolve()")
+    parser.add_argument('csv', nargs='?', default=None, help="Biomed CSV for real memberships (default: grid groups)")
+    parser.add_argument('--cache-dir', default=None, help="Boundary store directory (see boundary_store.py)")
+    parser.add_argument('--offline', action='store_true', default=None, help="Only use boundaries already in the store")
+    parser.add_argument('--no-exact', action='store_true', help="Skip the (slow) unsimplified exactness check")
+    parser.add_argument('--output', default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    print(f"Loading {COUNTY_VINTAGE}...")
+    counties_gdf = load_boundaries(COUNTY_VINTAGE, args.cache_dir, args.offline)
+    simplified_gdf = load_boundaries(COUNTY_VINTAGE, args.cache_dir, args.offline, simplify=SIMPLIFY)
+    vertices = int(counties_gdf.geometry.count_coordinates().sum())
+    print(f"   ✓ {len(counties_gdf):,} counties, {vertices:,} vertices")
+
+    memberships = csv_memberships(args.csv) if args.csv else grid_memberships(counties_gdf)
+
+    results = run(memberships, counties_gdf, simplified_gdf, exact=not args.no_exact)
+    results.update({'vintage': COUNTY_VINTAGE, 'counties': len(counties_gdf), 'vertices': vertices,
+                    'memberships': args.csv or 'grid'})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
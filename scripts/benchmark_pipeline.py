@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Benchmark the whole pipeline offline, on synthetic CSVs and fixture boundaries
+
+Synthetic Biomed-style CSVs are generated from the ZIP index and
+lookup_database.json: real ZIP → county pairs (skewed, so a few ZIPs are
+common and most are rare, like real donations), counties assigned to the
+real chapters in contiguous FIPS blocks, and year / total counts. Boundaries
+come from a fixture store of generated polygons (one Voronoi cell per county
+and per ZIP, densified to about the vertex count of the Census files), so no
+download is ever needed; --cache-dir uses a real boundary store instead.
+
+Each run is one build_levels() call, timed by the stage records it emits
+(see instrumentation.py): detect (column detection), load_csv,
+load_boundaries, aggregate, dissolve, merge (joining each level to its
+boundaries) and serialize (writing each level), with merge and serialize
+also reported per level. The numbers are
+the real pipeline's, whatever it does as it changes. Results are written as
+JSON, and --compare prints the change against an earlier results file:
+
+    python3 scripts/benchmark_pipeline.py --rows 10000 100000 1000000 --output bench.json
+    python3 scripts/benchmark_pipeline.py --rows 10000000 --levels county chapter
+    python3 scripts/benchmark_pipeline.py --output new.json --compare bench.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import shapely
+
+SCRIPTS_DIR = Path(__file__).parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from boundary_store import COUNTY_VINTAGE, add_key_column, store_path
+from column_detector import LOOKUP_DATABASE, format_code
+from create_geojson_levels import LEVELS, ZIP_VINTAGES, build_levels
+from geojson_writer import DEFAULT_PROFILE
+from instrumentation import add_sink, remove_sink
+from zip_index import load_index
+
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+CHUNK_ROWS = 1_000_000
+YEAR_COLUMNS = ['2022', '2023']
+
+# Fixture polygons: the area they cover (roughly the lower 48), and the
+# segment length they are densified to (~300 vertices per county, like cb_*_500k)
+FIXTURE_BOUNDS = (-124.0, 25.0, -67.0, 49.0)
+COUNTY_SEGMENT = 0.01
+ZIP_SEGMENT = 0.005
+
+
+def synthetic_universe():
+    """
+    The ZIPs rows are drawn from, with their county and chapter hierarchy
+
+    Real ZIP → FIPS pairs from the ZIP index and real county names; each
+    county goes to a real chapter, in contiguous blocks of sorted FIPS codes
+    (chapters ordered by division and region), so chapters, regions and
+    divisions are contiguous groups of counties of realistic counts.
+    """
+    with open(LOOKUP_DATABASE) as f:
+        database = json.load(f)
+    counties = pd.DataFrame(database['counties'])[['FIPS', 'County', 'State']].drop_duplicates('FIPS')
+    chapters = pd.DataFrame(database['chapters']).sort_values(['DCODE', 'RCODE', 'ECODE'], ignore_index=True)
+
+    index = load_index()
+    zips = pd.DataFrame({'Zip': format_code(pd.Series(np.asarray(index.zips))),
+                         'FIPS': format_code(pd.Series(np.asarray(index.fips)))})
+    zips = zips.merge(counties, on='FIPS', how='inner')
+
+    fips = np.sort(zips['FIPS'].unique())
+    block = np.arange(len(fips)) * len(chapters) // len(fips)
+    assignment = pd.DataFrame({'FIPS': fips}).join(chapters.iloc[block].reset_index(drop=True))
+    return zips.merge(assignment, on='FIPS', how='left').sort_values('Zip', ignore_index=True)
+
+
+def generate_csv(path, rows, universe=None, seed=0):
+    """
+    Write a synthetic Biomed CSV of rows rows, in chunks (memory stays flat at 10M rows)
+    Returns the path.
+    """
+    universe = synthetic_universe() if universe is None else universe
+    rng = np.random.default_rng(seed)
+    # Zipf-like popularity over a random order of ZIPs
+    weights = 1.0 / np.arange(1, len(universe) + 1) ** 0.8
+    weights = weights[rng.permutation(len(universe))]
+    weights /= weights.sum()
+    chapter_totals = pd.Series(rng.integers(100, 5000, len(universe)), index=universe.index)
+    chapter_totals = chapter_totals.groupby(universe['ECODE']).transform('first')
+
+    columns = ['Zip', 'FIPS', 'County', 'State', 'Chapter', 'ECODE', 'Region', 'RCODE', 'Division', 'DCODE']
+    schema = pa.schema([(col, pa.string()) for col in columns] +
+                       [(col, pa.int64()) for col in YEAR_COLUMNS + ['Chapter Total']])
+    path = Path(path)
+    with pacsv.CSVWriter(path, schema) as writer:
+        for start in range(0, rows, CHUNK_ROWS):
+            picks = rng.choice(len(universe), size=min(CHUNK_ROWS, rows - start), p=weights)
+            chunk = universe.iloc[picks][columns].reset_index(drop=True)
+            for col in YEAR_COLUMNS:
+                chunk[col] = rng.poisson(20, len(picks))
+            chunk['Chapter Total'] = chapter_totals.to_numpy()[picks]
+            writer.write_table(pa.Table.from_pandas(chunk, preserve_index=False, schema=schema))
+    return path
+
+
+def _voronoi_cells(points, bounds, segment):
+    """One Voronoi cell per point (in point order), clipped to bounds and densified"""
+    box = shapely.box(*bounds)
+    cells = shapely.get_parts(shapely.voronoi_polygons(shapely.multipoints(points), extend_to=box))
+    # voronoi_polygons doesn't keep the point order; match cells back to their points
+    point_index, cell_index = shapely.STRtree(cells).query(shapely.points(points), predicate='within')
+    order = np.empty(len(points), dtype=int)
+    order[point_index] = cell_index
+    return shapely.segmentize(shapely.intersection(cells[order], box), segment)
+
+
+def write_fixture_boundaries(cache_dir, universe=None, seed=0):
+    """
+    Write fixture county and ZCTA boundaries into a boundary store directory
+
+    Counties are laid out on a jittered grid in FIPS order (so a chapter's
+    counties are neighbours) and ZIPs scattered inside their county's cell.
+    Stored under the real vintage names, so the pipeline loads them as it
+    would the Census files. Returns the number of (counties, ZIPs).
+    """
+    universe = synthetic_universe() if universe is None else universe
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = FIXTURE_BOUNDS
+
+    fips = np.sort(universe['FIPS'].unique())
+    columns = int(np.ceil(np.sqrt(len(fips) * (maxx - minx) / (maxy - miny))))
+    rows = int(np.ceil(len(fips) / columns))
+    width, height = (maxx - minx) / columns, (maxy - miny) / rows
+    grid = np.arange(len(fips))
+    centers = np.column_stack([minx + (grid % columns + 0.5) * width, maxy - (grid // columns + 0.5) * height])
+    county_points = centers + rng.uniform(-0.3, 0.3, centers.shape) * [width, height]
+
+    counties = gpd.GeoDataFrame({'STATEFP': [code[:2] for code in fips], 'COUNTYFP': [code[2:] for code in fips],
+                                 'NAME': fips},
+                                geometry=_voronoi_cells(county_points, FIXTURE_BOUNDS, COUNTY_SEGMENT), crs='EPSG:4326')
+
+    zips = universe.drop_duplicates('Zip')
+    county_of = pd.Series(np.arange(len(fips)), index=fips)[zips['FIPS']].to_numpy()
+    zip_points = county_points[county_of] + rng.uniform(-0.45, 0.45, (len(zips), 2)) * [width, height]
+    zip_points = np.clip(zip_points, [minx, miny], [maxx, maxy])
+    zctas = gpd.GeoDataFrame({'ZCTA5CE20': zips['Zip'].to_numpy()},
+                             geometry=_voronoi_cells(zip_points, FIXTURE_BOUNDS, ZIP_SEGMENT), crs='EPSG:4326')
+
+    for vintage, gdf in [(COUNTY_VINTAGE, counties), (ZIP_VINTAGES[0], zctas)]:
+        path = store_path(vintage, cache_dir)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        add_key_column(gdf, vintage).to_parquet(path, index=False)
+    return len(counties), len(zctas)
+
+
+def run_pipeline(csv_file, levels, cache_dir, output_dir, profile=DEFAULT_PROFILE, workers=None):
+    """
+    Build levels from csv_file with build_levels() and time it from its stage records
+    Dissolved boundaries are never taken from the dissolve cache, so every
+    run dissolves. Returns the run's results.
+    """
+    records = []
+    sink = records.append
+    add_sink(sink)
+    try:
+        with redirect_stdout(io.StringIO()):
+            build_levels(csv_file, levels=levels, output_dir=output_dir, cache_dir=cache_dir, offline=True,
+                         profile=profile, dissolve_cache=False, workers=workers)
+    finally:
+        remove_sink(sink)
+
+    run = next(record for record in records if record['event'] == 'run')
+    # Joining each level to its boundaries (level_<level>) and writing it
+    # (write_<level>) are also summed over the levels as merge / serialize
+    stages = {}
+    level_results = {}
+    for record in records:
+        if record['event'] != 'stage' or record['run'] != run['run']:
+            continue
+        seconds = record['wall_seconds']
+        if 'level' in record:
+            result = level_results.setdefault(record['level'], {'features': 0, 'bytes': 0, 'merge_seconds': 0.0,
+                                                                'serialize_seconds': 0.0, 'seconds': 0.0})
+            step = 'merge' if record['stage'].startswith('level_') else 'serialize'
+            result[f"{step}_seconds"] += seconds
+            result['seconds'] += seconds
+            result['features'] = record.get('features', result['features'])
+            result['bytes'] = record.get('bytes', result['bytes'])
+            stages[step] = stages.get(step, 0.0) + seconds
+        elif record['stage'] == 'write_levels':
+            # With workers, levels are written together after they are all built
+            # (only their total write time is known)
+            stages['serialize'] = stages.get('serialize', 0.0) + seconds
+            for level, size in record['bytes'].items():
+                level_results[level].update(bytes=size, serialize_seconds=None)
+        else:
+            stages[record['stage']] = seconds
+            if record['stage'] == 'load_csv':
+                rows = record['rows']
+    stages = {stage: round(seconds, 4) for stage, seconds in stages.items()}
+
+    return {
+        'rows': rows,
+        'csv_bytes': os.path.getsize(csv_file),
+        'stages': stages,
+        'levels': level_results,
+        'total_seconds': run['wall_seconds'],
+        'peak_rss_mb': run['peak_rss_mb']
+    }
+
+
+def print_run(run):
+    print(f"\n   {run['rows']:,} rows ({run['csv_bytes'] / 1024 / 1024:.1f} MB), "
+          f"{run['total_seconds']:.2f}s total, peak RSS {run['peak_rss_mb']} MB")
+    print("   " + "  ".join(f"{stage} {seconds:.3f}s" for stage, seconds in run['stages'].items()))
+    print(f"   {'Level':<10} {'Features':>9} {'Merge s':>9} {'Write s':>9} {'MB':>8}")
+    for level, result in run['levels'].items():
+        written = '-' if result['serialize_seconds'] is None else f"{result['serialize_seconds']:.3f}"
+        print(f"   {level:<10} {result['features']:>9,} {result['merge_seconds']:>9.3f} "
+              f"{written:>9} {result['bytes'] / 1024 / 1024:>8.2f}")
+
+
+def print_comparison(results, previous):
+    """Ratio of every stage's time to the same stage in an earlier results file (by row count)"""
+    earlier = {run['rows']: run for run in previous.get('runs', [])}
+    print(f"\nCompared with {previous.get('created', 'earlier run')} (new / old time):")
+    for run in results['runs']:
+        old = earlier.get(run['rows'])
+        if old is None:
+            print(f"   {run['rows']:,} rows: not in the earlier results")
+            continue
+        pairs = [(stage, seconds, old['stages'].get(stage)) for stage, seconds in run['stages'].items()]
+        pairs += [(level, result['seconds'], old['levels'].get(level, {}).get('seconds'))
+                  for level, result in run['levels'].items()]
+        ratios = [f"{name} {new / old_seconds:.2f}x" for name, new, old_seconds in pairs if old_seconds]
+        print(f"   {run['rows']:,} rows: " + ", ".join(ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline offline on synthetic CSVs")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help="CSV sizes to run (rows)")
+    parser.add_argument('--levels', nargs='+', default=LEVELS, choices=LEVELS, help="Levels to build")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Boundary store to use instead of generated fixture boundaries")
+    parser.add_argument('--work-dir', default=None, help="Where CSVs and outputs go (default: a temporary directory)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for the CSVs and fixtures")
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, help="Output profile (see geojson_writer.PROFILES)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes for dissolving and writing levels (as in create_geojson_levels.py)")
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+    parser.add_argument('--compare', default=None, help="Earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = Path(args.work_dir or temp_dir)
+        work_dir.mkdir(parents=True, exist_ok=True)
+
+        print("Building the synthetic ZIP universe...")
+        universe = synthetic_universe()
+        print(f"   ✓ {len(universe):,} ZIPs in {universe['FIPS'].nunique():,} counties, "
+              f"{universe['Chapter'].nunique()} chapters")
+
+        cache_dir = args.cache_dir
+        if cache_dir is None:
+            cache_dir = work_dir / 'fixture_boundaries'
+            counties, zips = write_fixture_boundaries(cache_dir, universe, args.seed)
+            print(f"   ✓ Fixture boundaries: {counties:,} counties, {zips:,} ZIPs in {cache_dir}")
+
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'boundaries': 'fixture' if args.cache_dir is None else str(args.cache_dir),
+            'levels': args.levels,
+            'profile': args.profile,
+            'workers': args.workers,
+            'seed': args.seed,
+            'environment': {'python': platform.python_version(), 'pandas': pd.__version__,
+                            'geopandas': gpd.__version__, 'shapely': shapely.__version__,
+                            'machine': platform.machine(), 'cpus': os.cpu_count()},
+            'runs': []
+        }
+
+        for rows in args.rows:
+            csv_file = work_dir / f"synthetic_{rows}.csv"
+            if not csv_file.exists():
+                print(f"\nGenerating {csv_file.name}...")
+                generate_csv(csv_file, rows, universe, args.seed)
+            output_dir = work_dir / f"output_{rows}"
+            output_dir.mkdir(exist_ok=True)
+            run = run_pipeline(csv_file, args.levels, cache_dir, output_dir, args.profile, args.workers)
+            results['runs'].append(run)
+            print_run(run)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
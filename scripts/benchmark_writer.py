@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark the geometry-less GeoJSON writer against the iterrows loop it replaced
+
+Levels whose boundaries can't be loaded are written without geometry, the
+ZIP level with one feature per CSV row. The writer used to build each
+feature from iterrows(), a pandas Series per row;
+geojson_writer.write_geojson_without_geometry() now builds the feature text
+a column at a time. Both write the ZIP level of a synthetic CSV (see
+benchmark_pipeline.py), and the files are checked to be the same:
+
+    python3 scripts/benchmark_writer.py
+    python3 scripts/benchmark_writer.py --rows 100000 1000000 --profile web --output writer.json
+
+Reported per size: seconds and rows per second of both writers, the speedup
+and the file size.
+"""
+
+import argparse
+import filecmp
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from benchmark_pipeline import generate_csv, synthetic_universe
+from create_geojson_levels import build_zip_level, load_csv
+from geojson_writer import (DEFAULT_PROFILE, PROFILES, FeatureStreamWriter, clean_value, get_profile,
+                            write_geojson_without_geometry)
+
+DEFAULT_ROWS = [1_000_000]
+
+
+def write_with_iterrows(df, path, profile=DEFAULT_PROFILE):
+    """The previous write_geojson_without_geometry(): one Series per row"""
+    settings = get_profile(profile)
+    with FeatureStreamWriter(path, pretty=settings['pretty']) as writer:
+        for _, row in df.iterrows():
+            properties = {key: clean_value(value) for key, value in row.dropna().to_dict().items()}
+            writer.write_feature(properties)
+    return writer.count
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def run(rows, profile, work_dir, universe):
+    """Write one synthetic CSV's ZIP level with both writers, returns the result as a dict"""
+    csv_file = generate_csv(work_dir / f"synthetic_{rows}.csv", rows, universe)
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        df, _, _ = load_csv(csv_file)
+        output = build_zip_level(df, None)
+
+    current_path, previous_path = work_dir / 'current.geojson', work_dir / 'iterrows.geojson'
+    _, current_seconds = timed(lambda: write_geojson_without_geometry(output, current_path, profile=profile))
+    _, previous_seconds = timed(lambda: write_with_iterrows(output, previous_path, profile=profile))
+    result = {
+        'rows': rows,
+        'columns': len(output.columns),
+        'bytes': current_path.stat().st_size,
+        'iterrows_seconds': previous_seconds,
+        'current_seconds': current_seconds,
+        'speedup': previous_seconds / current_seconds if current_seconds else None,
+        'identical': filecmp.cmp(current_path, previous_path, shallow=False)
+    }
+    for path in [csv_file, current_path, previous_path]:
+        path.unlink()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the geometry-less GeoJSON writer against iterrows")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help="Synthetic CSV sizes (rows)")
+    parser.add_argument('--profile', default=DEFAULT_PROFILE, choices=list(PROFILES), help="Output profile")
+    parser.add_argument('--work-dir', default=None, help="Directory for the CSVs and files (default: a temp dir)")
+    parser.add_argument('--output', default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    universe = synthetic_universe()
+    print(f"   {'Rows':>10} {'iterrows (s)':>12} {'Current (s)':>11} {'Speedup':>8} {'Rows/s':>11} "
+          f"{'MB':>8} {'Same':>5}")
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        for rows in args.rows:
+            result = run(rows, args.profile, Path(work_dir), universe)
+            results.append(result)
+            print(f"   {rows:>10,} {result['iterrows_seconds']:>12.2f} {result['current_seconds']:>11.2f} "
+                  f"{result['speedup']:>7.1f}x {rows / result['current_seconds']:>11,.0f} "
+                  f"{result['bytes'] / 1e6:>8.1f} {'yes' if result['identical'] else 'NO':>5}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'profile': args.profile, 'runs': results}, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Local store for Census boundary files
+
+Boundaries are downloaded once per vintage (e.g. cb_2023_us_county_500k),
+reprojected to EPSG:4326 and saved as GeoParquet, so later runs load them
+from disk instead of downloading and extracting the shapefile again.
+
+Fill the store ahead of time (e.g. before going offline):
+
+    python3 scripts/boundary_store.py prefetch
+    python3 scripts/boundary_store.py list
+
+Files read from the store are kept in memory for the life of the process
+(until the file changes), so a long-running server reads each one once.
+
+Stored files are sorted by their key (FIPS / ZIP code, so by state and area)
+and carry GeoParquet covering bbox columns, in small row groups. Reads for a
+bbox or a list of states (load_boundaries(..., bbox=..., states=...)) are
+pushed down into the Parquet read: row groups outside them are skipped and
+only the matching rows are turned into geometries. Files stored before
+this have no bbox columns; `boundary_store.py index` adds them.
+
+Environment:
+    GEOJSON_BOUNDARY_CACHE  store directory (default: <repo>/boundary_cache)
+    GEOJSON_OFFLINE=1       never download, only use what is in the store
+"""
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+import os
+import argparse
+import tempfile
+import threading
+import zipfile
+from io import BytesIO
+from pathlib import Path
+
+DATA_DIR = Path(__file__).parent.parent
+DEFAULT_CACHE_DIR = DATA_DIR / "boundary_cache"
+
+CENSUS_URL = "https://www2.census.gov/geo/tiger/GENZ{year}/shp/{vintage}.zip"
+
+# Known vintages, and the kind of boundary each one holds
+VINTAGES = {
+    'cb_2023_us_county_500k': 'county',
+    'cb_2023_us_zcta520_500k': 'zip',
+    'cb_2022_us_zcta520_500k': 'zip',
+    'cb_2021_us_zcta520_500k': 'zip',
+    'cb_2020_us_zcta520_500k': 'zip',
+    'cb_2019_us_zcta510_500k': 'zip',
+    'cb_2018_us_zcta510_500k': 'zip'
+}
+COUNTY_VINTAGE = 'cb_2023_us_county_500k'
+
+# Column names that hold the ZIP code in the different ZCTA vintages
+ZIP_CODE_COLUMNS = ['ZCTA5CE20', 'ZCTA5CE10', 'ZCTA5', 'GEOID20', 'GEOID10', 'GEOID', 'ZCTA5CE00']
+
+
+# Rows per Parquet row group (each group's bbox statistics let subset reads skip it)
+ROW_GROUP_ROWS = 256
+
+# Stored files already read by this process: path → ((mtime, size), GeoDataFrame)
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+class BoundaryUnavailable(Exception):
+    """Raised when a vintage is not in the store and cannot be downloaded"""
+
+
+def get_cache_dir(cache_dir=None):
+    """Resolve the store directory (argument, then environment, then default)"""
+    if cache_dir is None:
+        cache_dir = os.environ.get('GEOJSON_BOUNDARY_CACHE', DEFAULT_CACHE_DIR)
+    return Path(cache_dir)
+
+
+def is_offline(offline=None):
+    """Resolve offline mode (argument, then GEOJSON_OFFLINE environment variable)"""
+    if offline is None:
+        offline = os.environ.get('GEOJSON_OFFLINE', '').lower() in ('1', 'true', 'yes')
+    return bool(offline)
+
+
+def store_path(vintage, cache_dir=None, simplify=None):
+    """Path of the stored GeoParquet file for a vintage (optionally simplified)"""
+    name = vintage if simplify is None else f"{vintage}.simplified-{simplify:g}"
+    return get_cache_dir(cache_dir) / f"{name}.parquet"
+
+
+def add_key_column(gdf, vintage):
+    """Add the standard join key (FIPS for counties, ZIP_CODE for ZCTAs)"""
+    if VINTAGES.get(vintage) == 'county':
+        gdf['FIPS'] = gdf['STATEFP'] + gdf['COUNTYFP']
+    else:
+        zip_col = next((col for col in ZIP_CODE_COLUMNS if col in gdf.columns), None)
+        if zip_col is None:
+            raise BoundaryUnavailable(f"Could not find ZIP code column in {vintage}. Available: {list(gdf.columns)}")
+        gdf['ZIP_CODE'] = gdf[zip_col].astype(str).str.zfill(5)
+    return gdf
+
+
+def read_stored(path, bbox=None, states=None):
+    """
+    Read a stored GeoParquet file, once per process while it is unchanged
+    Returns a copy, so callers can add or replace columns freely.
+
+    With bbox (minx, miny, maxx, maxy, EPSG:4326) only the features whose
+    bounds overlap it are returned, and with states (two-digit state FIPS
+    codes; county vintages) only those states' features. Subsets are read
+    with the filters pushed down into Parquet, unless the whole file is
+    already in memory; they are not kept in memory themselves.
+    """
+    stat = path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _loaded_lock:
+        loaded = _loaded.get(path)
+        if loaded is not None and loaded[0] != version:
+            loaded = None
+        if loaded is None and bbox is None and states is None:
+            loaded = (version, gpd.read_parquet(path))
+            _loaded[path] = loaded
+    if loaded is not None:
+        return select_features(loaded[1], bbox, states)
+
+    if not has_covering_bbox(path):
+        # Stored before bbox columns were written: read it whole, then select
+        return select_features(read_stored(path), bbox, states)
+    filters = [('STATEFP', 'in', sorted(states))] if states is not None else None
+    return gpd.read_parquet(path, bbox=tuple(bbox) if bbox is not None else None, filters=filters)
+
+
+def _in_memory(path):
+    """The whole stored file if read_stored() has it in memory (and it is unchanged), else None"""
+    stat = path.stat()
+    with _loaded_lock:
+        loaded = _loaded.get(path)
+    if loaded is None or loaded[0] != (stat.st_mtime_ns, stat.st_size):
+        return None
+    return loaded[1]
+
+
+def read_keys(path, key_col):
+    """A stored file's key column, in file order, read without any geometry"""
+    gdf = _in_memory(path)
+    if gdf is not None:
+        return gdf[key_col].reset_index(drop=True)
+    return pq.read_table(path, columns=[key_col]).column(key_col).to_pandas()
+
+
+def read_keyed(path, key_col, keys):
+    """The features of a stored file whose key_col is in keys (pushed down into the read unless in memory)"""
+    keys = sorted(set(keys))
+    gdf = _in_memory(path)
+    if gdf is not None:
+        return gdf[gdf[key_col].isin(keys).to_numpy()].reset_index(drop=True)
+    return gpd.read_parquet(path, columns=[key_col, 'geometry'], filters=[(key_col, 'in', keys)])
+
+
+def select_features(gdf, bbox=None, states=None):
+    """The features of gdf overlapping bbox and in states (as the pushed-down read selects them)"""
+    mask = None
+    if bbox is not None:
+        bounds = gdf.geometry.bounds
+        mask = ((bounds['minx'] <= bbox[2]) & (bounds['maxx'] >= bbox[0]) &
+                (bounds['miny'] <= bbox[3]) & (bounds['maxy'] >= bbox[1]))
+    if states is not None:
+        in_states = gdf['STATEFP'].isin(list(states))
+        mask = in_states if mask is None else mask & in_states
+    return gdf.copy() if mask is None else gdf[mask.to_numpy()].reset_index(drop=True)
+
+
+def has_covering_bbox(path):
+    """True if a stored file has the GeoParquet covering bbox column (see _write_parquet())"""
+    return 'bbox' in pq.read_schema(path).names
+
+
+def _write_parquet(gdf, path):
+    """
+    Write GeoParquet atomically so a partial file is never read
+    With covering bbox columns and small row groups, for subset reads.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.parquet.tmp')
+    gdf.to_parquet(tmp_path, index=False, write_covering_bbox=True, row_group_size=ROW_GROUP_ROWS)
+    os.replace(tmp_path, path)
+
+
+def key_column(vintage):
+    return 'FIPS' if VINTAGES.get(vintage) == 'county' else 'ZIP_CODE'
+
+
+def download_vintage(vintage, cache_dir=None, timeout=60):
+    """Download a vintage from Census, reproject it and save it in the store"""
+    import requests
+
+    year = vintage.split('_')[1]
+    url = CENSUS_URL.format(year=year, vintage=vintage)
+    print(f"   Downloading from: {url}")
+
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with zipfile.ZipFile(BytesIO(response.content)) as z:
+            z.extractall(temp_dir)
+            shp_files = [f for f in z.namelist() if f.endswith('.shp')]
+        if not shp_files:
+            raise BoundaryUnavailable(f"No shapefile found in {url}")
+        gdf = gpd.read_file(Path(temp_dir) / shp_files[0])
+
+    gdf = add_key_column(gdf.to_crs('EPSG:4326'), vintage)
+    # Sorted by key, so each row group covers a compact area (a subset read skips the rest)
+    gdf = gdf.sort_values(key_column(vintage), kind='stable').reset_index(drop=True)
+    _write_parquet(gdf, store_path(vintage, cache_dir))
+
+    # Simplified copies of an older download are now stale
+    for stale in get_cache_dir(cache_dir).glob(f"{vintage}.simplified-*.parquet"):
+        stale.unlink()
+    return gdf
+
+
+def load_boundaries(vintage, cache_dir=None, offline=None, simplify=None, bbox=None, states=None):
+    """
+    Load a vintage from the store, downloading it first if needed
+
+    With simplify, the simplified geometry is stored alongside the original
+    so it is only computed once. bbox / states load only a subset (see
+    read_stored()). Raises BoundaryUnavailable if the vintage is missing and
+    cannot be downloaded (always the case in offline mode).
+    """
+    if simplify is not None:
+        path = store_path(vintage, cache_dir, simplify)
+        if path.exists():
+            return read_stored(path, bbox, states)
+        gdf = load_boundaries(vintage, cache_dir, offline)
+        gdf['geometry'] = gdf['geometry'].simplify(simplify, preserve_topology=True)
+        _write_parquet(gdf, path)
+        return select_features(gdf, bbox, states)
+
+    path = store_path(vintage, cache_dir)
+    if path.exists():
+        return read_stored(path, bbox, states)
+
+    if is_offline(offline):
+        raise BoundaryUnavailable(
+            f"{vintage} is not in the boundary store ({get_cache_dir(cache_dir)}) and offline mode is on. "
+            f"Run: python3 scripts/boundary_store.py prefetch {vintage}"
+        )
+
+    try:
+        return select_features(download_vintage(vintage, cache_dir), bbox, states)
+    except BoundaryUnavailable:
+        raise
+    except Exception as e:
+        raise BoundaryUnavailable(f"Could not download {vintage}: {e}") from e
+
+
+def load_first_available(vintages, cache_dir=None, offline=None, simplify=None, bbox=None):
+    """
+    Load the first vintage that can be loaded
+    Vintages already in the store are tried before any download.
+    Returns (vintage, gdf), raises BoundaryUnavailable if none can be loaded.
+    """
+    stored = [v for v in vintages if store_path(v, cache_dir).exists()]
+    ordered = stored + [v for v in vintages if v not in stored]
+
+    for vintage in ordered:
+        try:
+            return vintage, load_boundaries(vintage, cache_dir, offline, simplify, bbox=bbox)
+        except BoundaryUnavailable as e:
+            print(f"   ⚠ {e}")
+    raise BoundaryUnavailable(f"None of {', '.join(vintages)} could be loaded")
+
+
+def prefetch(vintages=None, cache_dir=None, force=False):
+    """Fill the store with the given vintages (default: all known vintages)"""
+    vintages = list(VINTAGES) if not vintages else vintages
+    for vintage in vintages:
+        path = store_path(vintage, cache_dir)
+        if path.exists() and not force:
+            print(f"   ✓ {vintage} already stored")
+            continue
+        try:
+            gdf = download_vintage(vintage, cache_dir)
+            print(f"   ✓ Stored {vintage} ({len(gdf):,} features, {path.stat().st_size / 1024 / 1024:.1f} MB)")
+        except Exception as e:
+            print(f"   ⚠ Failed to store {vintage}: {e}")
+
+
+def add_covering_bbox(cache_dir=None):
+    """
+    Rewrite stored files without bbox columns (stored before they were added)
+    sorted by key and with covering bbox columns. Returns the files rewritten.
+    """
+    rewritten = []
+    for path in sorted(get_cache_dir(cache_dir).glob('*.parquet')):
+        vintage = path.name.split('.')[0]
+        if vintage not in VINTAGES or has_covering_bbox(path):
+            continue
+        gdf = gpd.read_parquet(path)
+        _write_parquet(gdf.sort_values(key_column(vintage), kind='stable').reset_index(drop=True), path)
+        rewritten.append(path)
+    return rewritten
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local Census boundary store")
+    parser.add_argument('--cache-dir', default=None, help="Store directory (default: $GEOJSON_BOUNDARY_CACHE or boundary_cache/)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    prefetch_parser = subparsers.add_parser('prefetch', help="Download vintages into the store")
+    prefetch_parser.add_argument('vintages', nargs='*', help=f"Vintages to fetch (default: all of {', '.join(VINTAGES)})")
+    prefetch_parser.add_argument('--force', action='store_true', help="Download again even if already stored")
+
+    subparsers.add_parser('list', help="Show which vintages are stored")
+    subparsers.add_parser('index', help="Add bbox columns to files stored without them (for subset reads)")
+
+    args = parser.parse_args()
+    cache_dir = get_cache_dir(args.cache_dir)
+
+    if args.command == 'prefetch':
+        unknown = [v for v in args.vintages if v not in VINTAGES]
+        if unknown:
+            parser.error(f"unknown vintage(s): {', '.join(unknown)}")
+        print(f"Prefetching boundaries into {cache_dir}")
+        prefetch(args.vintages, cache_dir, force=args.force)
+    elif args.command == 'index':
+        rewritten = add_covering_bbox(cache_dir)
+        for path in rewritten:
+            print(f"   ✓ Added bbox columns to {path.name}")
+        print(f"   ✓ {len(rewritten)} file(s) rewritten" if rewritten else "   ✓ All stored files have bbox columns")
+    else:
+        print(f"Boundary store: {cache_dir}")
+        for vintage, kind in VINTAGES.items():
+            path = store_path(vintage, cache_dir)
+            if path.exists():
+                print(f"   ✓ {vintage} ({kind}, {path.stat().st_size / 1024 / 1024:.1f} MB)")
+            else:
+                print(f"   - {vintage} ({kind}, not stored)")
+
+
+if __name__ == '__main__':
+    main()
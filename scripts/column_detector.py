@@ -4,6 +4,17 @@ Column name detection utility for flexible CSV header recognition
 Handles variations in column names (case, spaces, underscores, etc.)
 """
 
+import json
+from functools import lru_cache
+from pathlib import Path
+
+# ZIP / FIPS are stored as UInt32 codes, five digits when written out
+CODE_COLUMNS = ['Zip', 'FIPS']
+MAX_CODE = 99999
+
+# Hierarchy names and codes, stored as categoricals
+CATEGORY_COLUMNS = ['County', 'State', 'Chapter', 'ECODE', 'Region', 'RCODE', 'Division', 'DCODE']
+
 def normalize_column_name(col_name):
     """Normalize column name for matching"""
     import pandas as pd
@@ -11,115 +22,254 @@ def normalize_column_name(col_name):
         return None
     return str(col_name).strip().lower().replace('_', ' ').replace('-', ' ')
 
-def detect_columns(df):
+# Header names recognized for each standard column, in order of preference
+HEADER_PATTERNS = {
+    'Zip': ['zip', 'zip code', 'zipcode', 'zcta', 'zcta5', 'postal code', 'postalcode'],
+    'FIPS': ['fips', 'fips code', 'fipscode', 'geoid', 'county fips', 'countyfips'],
+    # Handle xCounty, County, etc.
+    'County': ['county', 'county name', 'countyname', 'county_name', 'xcounty'],
+    'Chapter': ['chapter', 'chapter name', 'chaptername', 'chapter_name'],
+    'Region': ['region', 'region name', 'regionname', 'region_name'],
+    'Division': ['division', 'division name', 'divisionname', 'division_name'],
+    'ECODE': ['ecode', 'e code', 'e_code', 'chapter code', 'chaptercode', 'chapter_code'],
+    'RCODE': ['rcode', 'r code', 'r_code', 'region code', 'regioncode', 'region_code'],
+    'DCODE': ['dcode', 'd code', 'd_code', 'division code', 'divisioncode', 'division_code'],
+    'State': ['state', 'state name', 'statename', 'state_name', 'st', 'state code', 'statecode'],
+    # Point coordinates (located in ZCTAs / counties by geocode.py); by header only
+    'Latitude': ['latitude', 'lat', 'y coordinate', 'point y'],
+    'Longitude': ['longitude', 'lon', 'lng', 'long', 'x coordinate', 'point x']
+}
+
+# Rows sampled to score columns by their values, and the score a column needs
+SAMPLE_ROWS = 1000
+MIN_CONFIDENCE = 0.6
+
+# State FIPS codes (the first two digits of a county FIPS code)
+STATE_FIPS = {
+    '01', '02', '04', '05', '06', '08', '09', '10', '11', '12', '13', '15', '16', '17', '18', '19', '20',
+    '21', '22', '23', '24', '25', '26', '27', '28', '29', '30', '31', '32', '33', '34', '35', '36', '37',
+    '38', '39', '40', '41', '42', '44', '45', '46', '47', '48', '49', '50', '51', '53', '54', '55', '56',
+    '60', '66', '69', '72', '78'
+}
+
+# State FIPS codes by postal abbreviation
+STATE_CODES = {
+    'AL': '01', 'AK': '02', 'AZ': '04', 'AR': '05', 'CA': '06', 'CO': '08', 'CT': '09', 'DE': '10',
+    'DC': '11', 'FL': '12', 'GA': '13', 'HI': '15', 'ID': '16', 'IL': '17', 'IN': '18', 'IA': '19',
+    'KS': '20', 'KY': '21', 'LA': '22', 'ME': '23', 'MD': '24', 'MA': '25', 'MI': '26', 'MN': '27',
+    'MS': '28', 'MO': '29', 'MT': '30', 'NE': '31', 'NV': '32', 'NH': '33', 'NJ': '34', 'NM': '35',
+    'NY': '36', 'NC': '37', 'ND': '38', 'OH': '39', 'OK': '40', 'OR': '41', 'PA': '42', 'RI': '44',
+    'SC': '45', 'SD': '46', 'TN': '47', 'TX': '48', 'UT': '49', 'VT': '50', 'VA': '51', 'WA': '53',
+    'WV': '54', 'WI': '55', 'WY': '56', 'AS': '60', 'GU': '66', 'MP': '69', 'PR': '72', 'VI': '78'
+}
+
+DATA_DIR = Path(__file__).parent.parent
+LOOKUP_DATABASE = DATA_DIR / "lookup_database.json"
+
+def detect_columns(df, sample_rows=SAMPLE_ROWS):
     """
     Auto-detect column names with flexible matching
     Returns a dictionary mapping standard names to actual column names
+    (see score_columns() for how columns are matched)
+    """
+    return {name: match['column'] for name, match in score_columns(df, sample_rows).items()}
+
+def score_columns(df, sample_rows=SAMPLE_ROWS):
+    """
+    Match the standard columns to df's columns, with a confidence score
+
+    Header names are matched first (confidence 1.0). Standard columns the
+    header doesn't name are then looked for in the values of the remaining
+    columns, using at most sample_rows rows (so the cost doesn't grow with the
+    file): ZIPs in the ZIP index (zip_index.py), FIPS codes with a valid state prefix,
+    names and codes from lookup_database.json. A column is matched by its
+    values only if at least MIN_CONFIDENCE of its sampled values fit.
+    Returns {standard name: {'column', 'confidence', 'matched_by'}}.
     """
     normalized_cols = {normalize_column_name(col): col for col in df.columns}
-    
+
     detected = {}
-    
-    # ZIP code variations
-    zip_patterns = ['zip', 'zip code', 'zipcode', 'zcta', 'zcta5', 'postal code', 'postalcode']
-    for pattern in zip_patterns:
-        if pattern in normalized_cols:
-            detected['Zip'] = normalized_cols[pattern]
-            break
-    
-    # FIPS code variations
-    fips_patterns = ['fips', 'fips code', 'fipscode', 'geoid', 'county fips', 'countyfips']
-    for pattern in fips_patterns:
-        if pattern in normalized_cols:
-            detected['FIPS'] = normalized_cols[pattern]
-            break
-    
-    # County variations (handle xCounty, County, etc.)
-    county_patterns = ['county', 'county name', 'countyname', 'county_name', 'xcounty']
-    for pattern in county_patterns:
-        if pattern in normalized_cols:
-            detected['County'] = normalized_cols[pattern]
-            break
-    
-    # Chapter variations
-    chapter_patterns = ['chapter', 'chapter name', 'chaptername', 'chapter_name']
-    for pattern in chapter_patterns:
-        if pattern in normalized_cols:
-            detected['Chapter'] = normalized_cols[pattern]
-            break
-    
-    # Region variations
-    region_patterns = ['region', 'region name', 'regionname', 'region_name']
-    for pattern in region_patterns:
-        if pattern in normalized_cols:
-            detected['Region'] = normalized_cols[pattern]
-            break
-    
-    # Division variations
-    division_patterns = ['division', 'division name', 'divisionname', 'division_name']
-    for pattern in division_patterns:
-        if pattern in normalized_cols:
-            detected['Division'] = normalized_cols[pattern]
-            break
-    
-    # ECODE variations
-    ecode_patterns = ['ecode', 'e code', 'e_code', 'chapter code', 'chaptercode', 'chapter_code']
-    for pattern in ecode_patterns:
-        if pattern in normalized_cols:
-            detected['ECODE'] = normalized_cols[pattern]
-            break
-    
-    # RCODE variations
-    rcode_patterns = ['rcode', 'r code', 'r_code', 'region code', 'regioncode', 'region_code']
-    for pattern in rcode_patterns:
-        if pattern in normalized_cols:
-            detected['RCODE'] = normalized_cols[pattern]
-            break
-    
-    # DCODE variations
-    dcode_patterns = ['dcode', 'd code', 'd_code', 'division code', 'divisioncode', 'division_code']
-    for pattern in dcode_patterns:
-        if pattern in normalized_cols:
-            detected['DCODE'] = normalized_cols[pattern]
-            break
-    
-    # State variations
-    state_patterns = ['state', 'state name', 'statename', 'state_name', 'st', 'state code', 'statecode']
-    for pattern in state_patterns:
-        if pattern in normalized_cols:
-            detected['State'] = normalized_cols[pattern]
-            break
-    
+    for name, patterns in HEADER_PATTERNS.items():
+        column = next((normalized_cols[pattern] for pattern in patterns if pattern in normalized_cols), None)
+        if column is not None:
+            detected[name] = {'column': column, 'confidence': 1.0, 'matched_by': 'header'}
+
+    missing = [name for name in VALUE_SCORERS if name not in detected]
+    used = {match['column'] for match in detected.values()}
+    # Year (e.g. 2022) and total columns hold counts, never keys
+    candidates = [col for col in df.columns
+                  if col not in used and not str(col).isdigit() and 'Total' not in str(col)]
+    if not missing or not candidates or len(df) == 0:
+        return detected
+
+    sample = df[candidates].head(sample_rows)
+    scores = []
+    for col in candidates:
+        values = _sample_values(sample[col])
+        if len(values) == 0:
+            continue
+        for name in missing:
+            score = VALUE_SCORERS[name](values)
+            if score >= MIN_CONFIDENCE:
+                scores.append((score, name, col))
+
+    # Best scores first; each column and each standard name is matched once
+    for score, name, col in sorted(scores, key=lambda item: -item[0]):
+        if name in detected or col in used:
+            continue
+        detected[name] = {'column': col, 'confidence': round(score, 3), 'matched_by': 'values'}
+        used.add(col)
+
     return detected
 
-def standardize_dataframe(df, detected_cols):
+def print_detection(detection):
+    """List the detected columns, noting those matched by their values rather than their name"""
+    for std_name, match in detection.items():
+        note = '' if match['matched_by'] == 'header' else f" (by values, confidence {match['confidence']:.0%})"
+        print(f"      {std_name} → {match['column']}{note}")
+
+def _sample_values(values):
+    """Non-empty sampled values as stripped strings ('1420.0' → '1420')"""
+    values = values.dropna().astype(str).str.strip()
+    values = values[values != '']
+    return values.str.replace(r'\.0$', '', regex=True)
+
+def _five_digit_codes(values):
+    """Values that are 5-digit codes (4 digits if read as a number), zero-padded (others NaN)"""
+    return values.where(values.str.fullmatch(r'\d{4,5}')).str.zfill(5)
+
+def _known(values, key):
+    """Which values are in a lookup set (a plain set lookup per sampled value)"""
+    import pandas as pd
+
+    known = _lookup_sets()[key]
+    return pd.Series([value in known for value in values.tolist()], index=values.index, dtype=bool)
+
+def _known_zips(codes):
+    """Which 5-digit codes are in the ZIP index (none if the index can't be loaded)"""
+    import pandas as pd
+    from zip_index import load_index
+
+    try:
+        index = load_index()
+    except (OSError, ValueError):
+        return pd.Series(False, index=codes.index)
+    return index.contains(to_code(codes))
+
+def _score_zip(values):
+    # Known ZIPs score fully, other 5-digit codes just enough (the ZIP index isn't complete)
+    codes = _five_digit_codes(values)
+    known = _known_zips(codes)
+    return float((known + (codes.notna() & ~known) * MIN_CONFIDENCE).mean())
+
+def _score_fips(values):
+    # Known counties score fully, other codes with a valid state prefix just enough
+    codes = _five_digit_codes(values)
+    known = _known(codes, 'fips')
+    valid_state = codes.str[:2].isin(STATE_FIPS)
+    score = (known + (valid_state & ~known) * MIN_CONFIDENCE).mean()
+    # ZIP columns also look like FIPS codes; prefer whichever fits better
+    return float(score) if score > _score_zip(values) else 0.0
+
+def _member_scorer(key):
+    def score(values):
+        return float(_known(values.str.lower(), key).mean())
+    return score
+
+VALUE_SCORERS = {
+    'Zip': _score_zip,
+    'FIPS': _score_fips,
+    'County': _member_scorer('county'),
+    'Chapter': _member_scorer('chapter'),
+    'Region': _member_scorer('region'),
+    'Division': _member_scorer('division'),
+    'ECODE': _member_scorer('ecode'),
+    'RCODE': _member_scorer('rcode'),
+    'DCODE': _member_scorer('dcode'),
+    'State': _member_scorer('state')
+}
+
+@lru_cache(maxsize=None)
+def _lookup_sets():
+    """Known values per kind, from lookup_database.json (loaded once)"""
+    sets = {key: set() for key in ['fips', 'county', 'chapter', 'region', 'division',
+                                   'ecode', 'rcode', 'dcode', 'state']}
+    try:
+        with open(LOOKUP_DATABASE) as f:
+            database = json.load(f)
+    except (OSError, ValueError):
+        database = {}
+    for chapter in database.get('chapters', []):
+        for key, field in [('chapter', 'Chapter'), ('region', 'Region'), ('division', 'Division'),
+                           ('ecode', 'ECODE'), ('rcode', 'RCODE'), ('dcode', 'DCODE')]:
+            if chapter.get(field):
+                sets[key].add(str(chapter[field]).strip().lower())
+    for county in database.get('counties', []):
+        if county.get('FIPS'):
+            sets['fips'].add(str(county['FIPS']).zfill(5))
+        if county.get('County'):
+            sets['county'].add(str(county['County']).strip().lower())
+        if county.get('State'):
+            sets['state'].add(str(county['State']).strip().lower())
+
+    return sets
+
+def to_code(values):
     """
-    Create a standardized dataframe with consistent column names
+    ZIP / FIPS values (strings like '01420', or numbers) as UInt32 codes
+    Values that are not a whole number from 0 to 99999 become NA.
     """
+    import numpy as np
     import pandas as pd
-    
-    # Create a copy
-    df_std = df.copy()
-    
-    # Rename columns to standard names
+
+    # Parse each distinct value once (a national file repeats ~40k ZIPs);
+    # missing values get position -1, which picks the NA entry appended last
+    positions, uniques = pd.factorize(pd.Series(values))
+    numbers = pd.to_numeric(pd.Series(np.asarray(uniques, dtype=object)), errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    with np.errstate(invalid='ignore'):
+        valid = (numbers >= 0) & (numbers <= MAX_CODE) & (numbers == np.floor(numbers))
+    codes = np.append(np.where(valid, numbers, 0).astype(np.uint32), np.uint32(0))
+    valid = np.append(valid, False)
+    return pd.Series(pd.arrays.IntegerArray(codes[positions], ~valid[positions]),
+                     index=getattr(values, 'index', None))
+
+def format_code(codes, width=5):
+    """UInt32 codes back to zero-padded strings ('01420'), missing codes stay missing"""
+    import pandas as pd
+
+    codes = pd.Series(codes)
+    positions, uniques = pd.factorize(codes)
+    text = pd.Series(uniques.astype('int64')).astype(str).str.zfill(width).tolist() + [None]
+    return pd.Series(pd.array(text, dtype=object)[positions], index=codes.index, dtype=object)
+
+def standardize_dataframe(df, detected_cols):
+    """
+    Standardize a dataframe in place: consistent column names and compact keys
+
+    Zip / FIPS become UInt32 codes (see to_code(); format_code() turns them
+    back into strings for output), and the hierarchy names and codes become
+    categoricals, so grouping and joining never compares strings row by row.
+    """
+    # Rename columns to standard names (in place, the frame is not copied)
     rename_map = {v: k for k, v in detected_cols.items()}
-    df_std = df_std.rename(columns=rename_map)
-    
+    df.columns = [rename_map.get(col, col) for col in df.columns]
+
     # Ensure required columns exist (create empty if missing, but don't overwrite existing)
     required_cols = ['Zip', 'FIPS', 'County', 'Chapter', 'Region', 'Division']
     for col in required_cols:
-        if col not in df_std.columns:
-            df_std[col] = None
-    
+        if col not in df.columns:
+            df[col] = None
+
     # Keep all original columns that weren't renamed
     # This preserves all data fields
-    
-    # Normalize ZIP and FIPS codes
-    if 'Zip' in df_std.columns:
-        df_std['Zip'] = df_std['Zip'].astype(str).str.replace('.0', '', regex=False).str.zfill(5)
-    
-    if 'FIPS' in df_std.columns:
-        df_std['FIPS'] = df_std['FIPS'].astype(str).str.zfill(5)
-    
-    return df_std, detected_cols
 
+    for col in CODE_COLUMNS:
+        df[col] = to_code(df[col])
+
+    # Categories in sorted order, so grouping by them sorts like the strings did
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            values = df[col].astype('category')
+            df[col] = values.cat.reorder_categories(values.cat.categories.sort_values())
+
+    return df, detected_cols
@@ -6,22 +6,46 @@ Create GeoJSON files for Biomed data at multiple geographic levels:
 - Chapters (aggregated from counties, includes chapter/region/division data)
 - Regions (aggregated from chapters, includes region/division data)
 - Divisions (aggregated from regions, includes division data)
+
+Can be run as a script, or imported and driven through build_levels():
+
+    from create_geojson_levels import build_levels
+    files = build_levels("data.csv", levels=["county", "chapter"])
+
+With incremental=True (--incremental), a rebuild into the same output
+directory only redoes the groups whose rows changed (see incremental.py).
 """
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-import json
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
-import requests
-from io import BytesIO
-import zipfile
+import argparse
+import math
+import numbers
+import os
 import sys
 
 # Add scripts directory to path for imports
 SCRIPTS_DIR = Path(__file__).parent
 sys.path.insert(0, str(SCRIPTS_DIR))
 
-from column_detector import detect_columns, standardize_dataframe
+from column_detector import CODE_COLUMNS, STATE_CODES, format_code, print_detection, to_code
+from csv_ingest import detect_csv, load_typed_csv
+from zip_index import fill_fips
+from geocode import geocode_points
+from geojson_writer import DEFAULT_PROFILE, PROFILES, compare_profiles, get_profile, write_geojson, write_geojson_without_geometry
+from boundary_store import (BoundaryUnavailable, COUNTY_VINTAGE, get_cache_dir, load_boundaries, load_first_available,
+                            read_keyed, read_keys, store_path)
+from topology import write_topojson
+from rollup import HIERARCHY, default_specs, parse_spec, rollup_levels, spec_columns
+from incremental import (IncrementalState, changed_keys, feature_table, file_id, group_hashes, key_mask, key_text,
+                         occurrence_keys, patch_frame, patch_geojson, row_hashes)
+from dissolve import DissolveCache, DissolveEngine
+from geo_formats import FORMATS, check_formats, format_path, write_formats
+from instrumentation import StageTimer, log_to_stream
 
 # Configuration
 DATA_DIR = Path(__file__).parent.parent
@@ -29,427 +53,1099 @@ CSV_FILE = DATA_DIR / "Biomed by zip code_ENHANCED.csv"
 CHAPTERS_SHP = DATA_DIR / "Biomed by zip code_with_redcross_by_chapter" / "chapters.shp"
 
 OUTPUT_DIR = DATA_DIR / "geojson_output"
-OUTPUT_DIR.mkdir(exist_ok=True)
 
-print("=" * 70)
-print("Creating GeoJSON files for Biomed data at multiple levels")
-print("=" * 70)
+# Census boundary vintages (see boundary_store.py), ZIP vintages in order of preference
+ZIP_VINTAGES = ['cb_2023_us_zcta520_500k', 'cb_2022_us_zcta520_500k', 'cb_2021_us_zcta520_500k']
+
+# Levels in hierarchy order, and the file each one is written to
+LEVELS = ['zip', 'county', 'chapter', 'region', 'division']
+OUTPUT_FILENAMES = {
+    'zip': 'biomed_zip_codes.geojson',
+    'county': 'biomed_counties.geojson',
+    'chapter': 'biomed_chapters.geojson',
+    'region': 'biomed_regions.geojson',
+    'division': 'biomed_divisions.geojson'
+}
+TOPOJSON_FILENAME = 'biomed_levels.topojson'
+
+# Levels built by dissolving counties, and the column each one groups by
+DISSOLVE_COLUMNS = {'chapter': 'Chapter', 'region': 'Region', 'division': 'Division'}
+DISSOLVE_SIMPLIFY = 0.001
+
+# Simplification of the stored boundaries each level is built from
+COUNTY_SIMPLIFY = 0.001
+ZIP_SIMPLIFY = 0.0005
+
+
+def load_csv(csv_file, all_columns=True, detected=None, columns=()):
+    """
+    Load the CSV, detect its columns and standardize it
+    With all_columns=False only the columns the rollup needs (and columns)
+    are read; detected is passed on to load_typed_csv().
+    Returns (df, year_cols, total_cols)
+    """
+    print("\n1. Loading CSV data...")
+    df, detection, year_cols, total_cols = load_typed_csv(csv_file, all_columns=all_columns, detected=detected,
+                                                          columns=columns)
+
+    print(f"   ✓ Loaded {len(df):,} rows")
+    print(f"   ✓ Columns: {len(df.columns)}{'' if all_columns else ' (only those the rollup needs)'}")
+    print(f"   ✓ Column names: {list(df.columns)[:10]}...")
+
+    print(f"   ✓ Detected columns:")
+    print_detection(detection)
+
+    print(f"   ✓ Standardized dataframe with {len(df.columns)} columns")
+
+    # Rows with a ZIP but no FIPS (or CSVs with only ZIPs) get their county from the ZIP index
+    if df['FIPS'].isna().any():
+        try:
+            filled = fill_fips(df)
+            print(f"   ✓ Filled {filled:,} missing FIPS codes from ZIP codes")
+        except (OSError, ValueError) as e:
+            print(f"   ⚠ Could not fill missing FIPS codes from ZIP codes: {e}")
 
-# Step 1: Load CSV data and detect columns
-print("\n1. Loading CSV data...")
-df = pd.read_csv(CSV_FILE, low_memory=False)
+    return df, year_cols, total_cols
 
-print(f"   ✓ Loaded {len(df):,} rows")
-print(f"   ✓ Columns: {len(df.columns)}")
-print(f"   ✓ Column names: {list(df.columns)[:10]}...")
 
-# Auto-detect column names
-print("\n   Detecting column names...")
-detected_cols = detect_columns(df)
-print(f"   ✓ Detected columns:")
-for std_name, actual_name in detected_cols.items():
-    print(f"      {std_name} → {actual_name}")
+def load_chapter_boundaries(chapters_shp=CHAPTERS_SHP):
+    """Load chapter boundaries from a local shapefile, if one exists"""
+    print("\n2. Checking for chapter boundaries...")
+    chapters_gdf = None
+    if chapters_shp.exists():
+        try:
+            temp_chapters = gpd.read_file(chapters_shp)
+            if len(temp_chapters) > 0:
+                chapters_gdf = temp_chapters.to_crs('EPSG:4326')
+                chapters_gdf['geometry'] = chapters_gdf['geometry'].simplify(0.001, preserve_topology=True)
+                print(f"   ✓ Loaded {len(chapters_gdf)} chapters from shapefile")
+            else:
+                print("   ⚠ Chapter shapefile exists but is empty")
+        except Exception as e:
+            print(f"   ⚠ Error reading chapter shapefile: {e}")
 
-# Standardize dataframe
-df, detected_cols = standardize_dataframe(df, detected_cols)
+    if chapters_gdf is None:
+        print("   ℹ Will create chapter boundaries by dissolving counties")
 
-print(f"   ✓ Standardized dataframe with {len(df.columns)} columns")
+    return chapters_gdf
 
-# Identify numeric columns (years and totals)
-year_cols = [col for col in df.columns if col.isdigit()]
-total_cols = [col for col in df.columns if 'Total' in col]
-numeric_cols = year_cols + total_cols
 
-# Step 2: Load chapter boundaries (if available)
-print("\n2. Checking for chapter boundaries...")
-chapters_gdf = None
-if CHAPTERS_SHP.exists():
+def load_county_boundaries(cache_dir=None, offline=None, bbox=None, states=None):
+    """Load county boundaries from the boundary store (None if unavailable), optionally a subset"""
+    print("\n3. Loading county boundaries...")
     try:
-        temp_chapters = gpd.read_file(CHAPTERS_SHP)
-        if len(temp_chapters) > 0:
-            chapters_gdf = temp_chapters.to_crs('EPSG:4326')
-            chapters_gdf['geometry'] = chapters_gdf['geometry'].simplify(0.001, preserve_topology=True)
-            print(f"   ✓ Loaded {len(chapters_gdf)} chapters from shapefile")
-        else:
-            print("   ⚠ Chapter shapefile exists but is empty")
-    except Exception as e:
-        print(f"   ⚠ Error reading chapter shapefile: {e}")
-
-if chapters_gdf is None:
-    print("   ℹ Will create chapter boundaries by dissolving counties")
-
-# Step 3: Download county boundaries from Census
-print("\n3. Downloading county boundaries from Census...")
-try:
-    # Download US Counties shapefile
-    counties_url = "https://www2.census.gov/geo/tiger/GENZ2023/shp/cb_2023_us_county_500k.zip"
-    print(f"   Downloading from: {counties_url}")
-    
-    response = requests.get(counties_url, timeout=30)
-    response.raise_for_status()
-    
-    with zipfile.ZipFile(BytesIO(response.content)) as z:
-        z.extractall(OUTPUT_DIR / "temp_counties")
-    
-    counties_gdf = gpd.read_file(OUTPUT_DIR / "temp_counties" / "cb_2023_us_county_500k.shp")
-    counties_gdf = counties_gdf.to_crs('EPSG:4326')
-    counties_gdf['FIPS'] = counties_gdf['STATEFP'] + counties_gdf['COUNTYFP']
-    counties_gdf['geometry'] = counties_gdf['geometry'].simplify(0.001, preserve_topology=True)
-    
-    print(f"   ✓ Loaded {len(counties_gdf)} counties")
-except Exception as e:
-    print(f"   ⚠ Error downloading counties: {e}")
-    print("   Will create county GeoJSON from data only (no geometry)")
-    counties_gdf = None
-
-# Step 4: Download ZIP code boundaries from Census
-print("\n4. Downloading ZIP code boundaries from Census...")
-try:
-    # Try multiple possible URLs for ZIP codes
-    zip_urls = [
-        "https://www2.census.gov/geo/tiger/GENZ2023/shp/cb_2023_us_zcta520_500k.zip",
-        "https://www2.census.gov/geo/tiger/GENZ2022/shp/cb_2022_us_zcta520_500k.zip",
-        "https://www2.census.gov/geo/tiger/GENZ2021/shp/cb_2021_us_zcta520_500k.zip"
-    ]
-    
+        counties_gdf = load_boundaries(COUNTY_VINTAGE, cache_dir, offline, simplify=COUNTY_SIMPLIFY, bbox=bbox,
+                                       states=states)
+        print(f"   ✓ Loaded {len(counties_gdf)} counties ({COUNTY_VINTAGE})")
+    except BoundaryUnavailable as e:
+        print(f"   ⚠ Error loading counties: {e}")
+        print("   Will create county GeoJSON from data only (no geometry)")
+        counties_gdf = None
+
+    return counties_gdf
+
+
+def load_point_boundaries(cache_dir=None, offline=None, zips=True):
+    """
+    County (and ZCTA) boundaries to locate points in (see geocode.py)
+
+    Counties are the unsimplified ones the dissolve stage uses; ZCTAs the
+    simplified ones the ZIP level uses, so geocoding reads nothing the build
+    wouldn't. Returns (counties_gdf, zips_gdf), None for a layer that is
+    unavailable.
+    """
+    try:
+        counties_gdf = load_boundaries(COUNTY_VINTAGE, cache_dir, offline)
+    except BoundaryUnavailable as e:
+        print(f"   ⚠ Counties unavailable for geocoding: {e}")
+        counties_gdf = None
     zips_gdf = None
-    for zips_url in zip_urls:
+    if zips:
         try:
-            print(f"   Trying: {zips_url}")
-            response = requests.get(zips_url, timeout=60)
-            response.raise_for_status()
-            
-            with zipfile.ZipFile(BytesIO(response.content)) as z:
-                z.extractall(OUTPUT_DIR / "temp_zips")
-            
-            # Find the shapefile name
-            shp_files = [f for f in z.namelist() if f.endswith('.shp')]
-            if shp_files:
-                zips_gdf = gpd.read_file(OUTPUT_DIR / "temp_zips" / shp_files[0])
-                zips_gdf = zips_gdf.to_crs('EPSG:4326')
-                
-                # Try different column names for ZIP code
-                zip_col = None
-                for col in ['ZCTA5CE20', 'ZCTA5CE10', 'ZCTA5', 'GEOID20', 'GEOID10', 'GEOID']:
-                    if col in zips_gdf.columns:
-                        zip_col = col
-                        break
-                
-                if zip_col:
-                    zips_gdf['ZIP_CODE'] = zips_gdf[zip_col].astype(str).str.zfill(5)
-                else:
-                    print(f"   ⚠ Could not find ZIP code column. Available: {list(zips_gdf.columns)}")
-                    zips_gdf = None
-                
-                if zips_gdf is not None:
-                    zips_gdf['geometry'] = zips_gdf['geometry'].simplify(0.0005, preserve_topology=True)
-                    print(f"   ✓ Loaded {len(zips_gdf)} ZIP codes")
-                    break
-        except Exception as e:
-            print(f"   ⚠ Failed: {e}")
-            continue
-    
-    if zips_gdf is None:
-        print("   ⚠ Could not download ZIP codes from any URL")
+            _, zips_gdf = load_first_available(ZIP_VINTAGES, cache_dir, offline, simplify=ZIP_SIMPLIFY)
+        except BoundaryUnavailable as e:
+            print(f"   ⚠ ZIP codes unavailable for geocoding: {e}")
+    return counties_gdf, zips_gdf
+
+
+def geocode_rows(df, levels, cache_dir=None, offline=None):
+    """
+    Fill the ZIP / FIPS codes rows are missing from their latitude / longitude, in place
+    ZCTAs are only used when the ZIP level is requested.
+    Returns the counts from geocode.geocode_points() (None if nothing to do).
+    """
+    if 'Latitude' not in df.columns or 'Longitude' not in df.columns:
+        return None
+    wants_zip = 'zip' in levels and df['Zip'].isna().any()
+    if not (wants_zip or df['FIPS'].isna().any()):
+        return None
+
+    print("\n📍 Geocoding latitude / longitude rows...")
+    counties_gdf, zips_gdf = load_point_boundaries(cache_dir, offline, zips=wants_zip)
+    counts = geocode_points(df, counties_gdf, zips_gdf)
+    print(f"   ✓ {counts['points']:,} rows with coordinates: {counts['FIPS']:,} counties"
+          + (f", {counts['Zip']:,} ZIP codes" if wants_zip else "") + " assigned")
+    return counts
+
+
+def load_zip_boundaries(cache_dir=None, offline=None, bbox=None):
+    """Load ZIP code (ZCTA) boundaries from the boundary store (None if unavailable), optionally in a bbox"""
+    print("\n4. Loading ZIP code boundaries...")
+    try:
+        vintage, zips_gdf = load_first_available(ZIP_VINTAGES, cache_dir, offline, simplify=ZIP_SIMPLIFY, bbox=bbox)
+        print(f"   ✓ Loaded {len(zips_gdf)} ZIP codes ({vintage})")
+    except BoundaryUnavailable as e:
+        print(f"   ⚠ {e}")
         print("   Will create ZIP GeoJSON from data only (no geometry)")
-        
-except Exception as e:
-    print(f"   ⚠ Error downloading ZIP codes: {e}")
-    print("   Will create ZIP GeoJSON from data only (no geometry)")
-    zips_gdf = None
+        zips_gdf = None
+
+    return zips_gdf
+
+
+def load_dissolve_engine(memberships, cache_dir=None, offline=None, states=None):
+    """
+    Build the topology dissolve engine over the counties the memberships use
+
+    The engine works from the unsimplified county boundaries and simplifies
+    each shared border once (0.001 degrees, like the county level), so
+    dissolved groups fit together without slivers. With states, only those
+    states' counties are read. Returns None if the boundaries are unavailable.
+    """
+    try:
+        counties_gdf = load_boundaries(COUNTY_VINTAGE, cache_dir, offline, states=states)
+    except BoundaryUnavailable as e:
+        print(f"   ⚠ Error loading counties for dissolving: {e}")
+        return None
+
+    # Memberships hold FIPS codes (see column_detector.to_code), so key the engine by code too
+    counties_gdf = counties_gdf.assign(FIPS=to_code(counties_gdf['FIPS']))
+    fips = set()
+    for membership in memberships.values():
+        fips.update(membership['FIPS'])
+    return DissolveEngine(counties_gdf[counties_gdf['FIPS'].isin(fips)], simplify=DISSOLVE_SIMPLIFY)
+
+
+def county_boundary_id(cache_dir=None):
+    """Identify the stored county boundaries (vintage and file version), None if not stored"""
+    path = store_path(COUNTY_VINTAGE, cache_dir)
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return f"{COUNTY_VINTAGE}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def resolve_workers(workers=None):
+    """Number of worker processes to use (None = 1, no pool; 0 = one per CPU)"""
+    if workers is None:
+        return 1
+    if workers == 0:
+        return os.cpu_count() or 1
+    if workers < 0:
+        raise ValueError(f"Invalid worker count: {workers}")
+    return workers
+
+
+def dissolve_levels(memberships, levels, cache_dir=None, offline=None, use_cache=True, workers=1, states=None):
+    """
+    Dissolve county boundaries into one geometry per group for each level
+
+    memberships holds each level's (FIPS, group) pairs from the rollup.
+    Geometries are looked up in the dissolve cache (in the boundary store)
+    first; the county topology is only built for the levels that miss.
+    With workers > 1 the groups are dissolved across a process pool. states
+    limits the counties read to those states (subset mode).
+    Returns a dict mapping each level to a GeoDataFrame (None if unavailable).
+    """
+    print("\n5. Dissolving county boundaries...")
+    cache = DissolveCache(get_cache_dir(cache_dir) / 'dissolved') if use_cache else None
+
+    def cache_key(level):
+        boundary_id = county_boundary_id(cache_dir)
+        if cache is None or boundary_id is None:
+            return None
+        return cache.make_key(memberships[level], DISSOLVE_COLUMNS[level], boundary_id, DISSOLVE_SIMPLIFY)
+
+    dissolved = {}
+    missing = []
+    for level in levels:
+        key = cache_key(level)
+        cached = cache.get(key) if key is not None else None
+        if cached is not None:
+            print(f"   ✓ {DISSOLVE_COLUMNS[level]} boundaries from dissolve cache ({len(cached)} groups)")
+            dissolved[level] = cached
+        else:
+            missing.append(level)
+
+    if missing:
+        engine = load_dissolve_engine({level: memberships[level] for level in missing}, cache_dir, offline, states)
+        use_pool = engine is not None and workers > 1
+        with engine.executor(workers) if use_pool else nullcontext() as executor:
+            for level in missing:
+                group_col = DISSOLVE_COLUMNS[level]
+                dissolved[level] = engine.dissolve(memberships[level], group_col, executor) if engine is not None else None
+                if dissolved[level] is None:
+                    continue
+                print(f"   ✓ Dissolved {len(dissolved[level])} {group_col.lower()} boundaries")
+                key = cache_key(level)
+                if key is not None:
+                    cache.put(key, dissolved[level])
+
+    return dissolved
+
+
+def format_keys(output):
+    """Turn the ZIP / FIPS codes of a level output back into zero-padded strings"""
+    return output.assign(**{col: format_code(output[col]) for col in CODE_COLUMNS if col in output.columns})
 
-print("\n" + "=" * 70)
-print("Creating GeoJSON files...")
-print("=" * 70)
 
 # ============================================================================
 # LEVEL 1: ZIP CODES (most granular - all fields from CSV)
 # ============================================================================
-print("\n📦 Creating ZIP code GeoJSON...")
-if zips_gdf is not None and 'ZIP_CODE' in zips_gdf.columns:
-    # Join CSV data to ZIP boundaries
-    zip_merged = zips_gdf.merge(
+def build_zip_level(df, zips_gdf):
+    """Build the ZIP code output (GeoDataFrame, or the plain CSV rows if no boundaries)"""
+    print("\n📦 Creating ZIP code GeoJSON...")
+
+    if zips_gdf is None or 'ZIP_CODE' not in zips_gdf.columns:
+        # Create without geometry (can be joined later in ArcGIS)
+        return format_keys(df)
+
+    # Join CSV data to ZIP boundaries (on the integer ZIP codes)
+    zip_merged = zips_gdf.assign(ZIP_CODE=to_code(zips_gdf['ZIP_CODE'])).merge(
         df,
         left_on='ZIP_CODE',
         right_on='Zip',
         how='inner'
     )
-    
+
     # Keep all columns from CSV
-    zip_output = zip_merged[['geometry'] + [col for col in df.columns if col in zip_merged.columns]]
-    
-    zip_geojson = zip_output.to_json()
-    zip_file = OUTPUT_DIR / "biomed_zip_codes.geojson"
-    with open(zip_file, 'w') as f:
-        json.dump(json.loads(zip_geojson), f, indent=2)
-    
-    print(f"   ✓ Created {zip_file}")
-    print(f"   ✓ Features: {len(zip_output):,}")
-else:
-    print("   ⚠ Skipped (no ZIP boundaries available)")
+    return format_keys(zip_merged[['geometry'] + [col for col in df.columns if col in zip_merged.columns]])
+
 
 # ============================================================================
 # LEVEL 2: COUNTIES (aggregate ZIPs, include county/chapter/region/division)
 # ============================================================================
-print("\n🏛️  Creating County GeoJSON...")
-
-# Aggregate data by county
-county_agg = df.groupby('FIPS').agg({
-    **{col: 'first' for col in ['County', 'State', 'Chapter', 'Region', 'Division', 
-                                 'ECODE', 'RCODE', 'DCODE']},
-    **{col: 'sum' for col in year_cols},
-    **{col: 'first' for col in total_cols}  # Totals are already aggregated
-}).reset_index()
-
-if counties_gdf is not None:
-    # Join aggregated data to county boundaries
-    county_merged = counties_gdf.merge(
+def build_county_level(county_agg, counties_gdf):
+    """Build the county output (GeoDataFrame, or the aggregated DataFrame if no boundaries)"""
+    print("\n🏛️  Creating County GeoJSON...")
+
+    if counties_gdf is None:
+        # Create without geometry
+        return format_keys(county_agg)
+
+    # Join aggregated data to county boundaries (on the integer FIPS codes)
+    county_merged = counties_gdf.assign(FIPS=to_code(counties_gdf['FIPS'])).merge(
         county_agg,
         left_on='FIPS',
         right_on='FIPS',
         how='inner'
     )
-    
-    county_output = county_merged[['geometry'] + [col for col in county_agg.columns if col in county_merged.columns]]
-    
-    county_geojson = county_output.to_json()
-    county_file = OUTPUT_DIR / "biomed_counties.geojson"
-    with open(county_file, 'w') as f:
-        json.dump(json.loads(county_geojson), f, indent=2)
-    
-    print(f"   ✓ Created {county_file}")
-    print(f"   ✓ Features: {len(county_output):,}")
-else:
-    # Create without geometry
-    county_geojson = {
-        "type": "FeatureCollection",
-        "features": []
-    }
-    for _, row in county_agg.iterrows():
-        feature = {
-            "type": "Feature",
-            "properties": row.dropna().to_dict(),
-            "geometry": None
-        }
-        county_geojson["features"].append(feature)
-    
-    county_file = OUTPUT_DIR / "biomed_counties.geojson"
-    with open(county_file, 'w') as f:
-        json.dump(county_geojson, f, indent=2)
-    
-    print(f"   ✓ Created {county_file} (no geometry)")
-    print(f"   ✓ Features: {len(county_agg):,}")
+
+    return format_keys(county_merged[['geometry'] + [col for col in county_agg.columns if col in county_merged.columns]])
+
 
 # ============================================================================
 # LEVEL 3: CHAPTERS (aggregate counties, include chapter/region/division)
 # ============================================================================
-print("\n📚 Creating Chapter GeoJSON...")
-
-# Aggregate data by chapter
-chapter_agg = df.groupby('Chapter').agg({
-    **{col: 'first' for col in ['Region', 'Division', 'RCODE', 'DCODE']},
-    **{col: 'sum' for col in year_cols},
-    **{col: 'first' for col in [c for c in total_cols if 'Chapter' in c or 'Region' in c or 'Division' in c]}
-}).reset_index()
-
-chapter_has_geometry = False
-
-# Try to get geometry from shapefile first
-if chapters_gdf is not None and len(chapters_gdf) > 0:
-    chapter_name_col = None
-    for col in chapters_gdf.columns:
-        if col.lower() in ['chapter', 'name', 'chapter_name', 'chapter_nam']:
-            chapter_name_col = col
-            break
-    
-    if chapter_name_col:
-        chapters_gdf['chapter_match'] = chapters_gdf[chapter_name_col].astype(str).str.strip().str.upper()
-        chapter_agg['chapter_match'] = chapter_agg['Chapter'].astype(str).str.strip().str.upper()
-        
-        chapter_merged = chapters_gdf.merge(
-            chapter_agg,
-            left_on='chapter_match',
-            right_on='chapter_match',
-            how='inner'
-        )
-        
-        if len(chapter_merged) > 0:
-            chapter_output = chapter_merged[['geometry'] + [col for col in chapter_agg.columns if col in chapter_merged.columns and col != 'chapter_match']]
-            chapter_has_geometry = True
-
-# If no shapefile geometry, create by dissolving counties
-if not chapter_has_geometry and counties_gdf is not None:
-    print("   Creating chapter boundaries by dissolving counties...")
-    # Join counties with chapter data
-    county_chapter_lookup = df[['FIPS', 'Chapter']].drop_duplicates()
-    counties_with_chapter = counties_gdf.merge(county_chapter_lookup, on='FIPS', how='inner')
-    
-    if 'Chapter' in counties_with_chapter.columns and len(counties_with_chapter) > 0:
-        # Dissolve counties by chapter
-        chapter_gdf = counties_with_chapter.dissolve(by='Chapter', aggfunc='first')
-        chapter_gdf = chapter_gdf.reset_index()
-        
+def build_chapter_level(chapter_agg, chapter_gdf, chapters_gdf):
+    """Build the chapter output (GeoDataFrame, or the aggregated DataFrame if no boundaries)"""
+    print("\n📚 Creating Chapter GeoJSON...")
+
+    # Try to get geometry from shapefile first
+    if chapters_gdf is not None and len(chapters_gdf) > 0:
+        chapter_name_col = None
+        for col in chapters_gdf.columns:
+            if col.lower() in ['chapter', 'name', 'chapter_name', 'chapter_nam']:
+                chapter_name_col = col
+                break
+
+        if chapter_name_col:
+            chapters_gdf = chapters_gdf.copy()
+            chapters_gdf['chapter_match'] = chapters_gdf[chapter_name_col].astype(str).str.strip().str.upper()
+            chapter_agg = chapter_agg.copy()
+            chapter_agg['chapter_match'] = chapter_agg['Chapter'].astype(str).str.strip().str.upper()
+
+            chapter_merged = chapters_gdf.merge(
+                chapter_agg,
+                left_on='chapter_match',
+                right_on='chapter_match',
+                how='inner'
+            )
+
+            if len(chapter_merged) > 0:
+                return chapter_merged[['geometry'] + [col for col in chapter_agg.columns if col in chapter_merged.columns and col != 'chapter_match']]
+
+            chapter_agg = chapter_agg.drop(columns='chapter_match')
+
+    # If no shapefile geometry, use the boundaries dissolved from counties
+    if chapter_gdf is not None:
         # Merge with aggregated data
         chapter_merged = chapter_gdf.merge(chapter_agg, on='Chapter', how='inner')
         chapter_output = chapter_merged[['geometry'] + [col for col in chapter_agg.columns if col in chapter_merged.columns]]
-        chapter_has_geometry = True
-
-# Save chapter GeoJSON
-if chapter_has_geometry:
-    chapter_geojson = chapter_output.to_json()
-    chapter_file = OUTPUT_DIR / "biomed_chapters.geojson"
-    with open(chapter_file, 'w') as f:
-        json.dump(json.loads(chapter_geojson), f, indent=2)
-    print(f"   ✓ Created {chapter_file}")
-    print(f"   ✓ Features: {len(chapter_output):,}")
-else:
+        chapter_output.attrs['dissolved_by'] = 'Chapter'
+        return chapter_output
+
     # Create without geometry
-    chapter_geojson = {
-        "type": "FeatureCollection",
-        "features": []
-    }
-    for _, row in chapter_agg.iterrows():
-        feature = {
-            "type": "Feature",
-            "properties": row.dropna().to_dict(),
-            "geometry": None
-        }
-        chapter_geojson["features"].append(feature)
-    
-    chapter_file = OUTPUT_DIR / "biomed_chapters.geojson"
-    with open(chapter_file, 'w') as f:
-        json.dump(chapter_geojson, f, indent=2)
-    print(f"   ✓ Created {chapter_file} (no geometry)")
-    print(f"   ✓ Features: {len(chapter_agg):,}")
+    return chapter_agg
+
 
 # ============================================================================
 # LEVEL 4: REGIONS (aggregate chapters, include region/division)
 # ============================================================================
-print("\n🌍 Creating Region GeoJSON...")
-
-# Aggregate data by region
-region_agg = df.groupby('Region').agg({
-    **{col: 'first' for col in ['Division', 'RCODE', 'DCODE']},
-    **{col: 'sum' for col in year_cols},
-    **{col: 'first' for col in [c for c in total_cols if 'Region' in c or 'Division' in c]}
-}).reset_index()
-
-# Create region boundaries by dissolving counties or chapters
-region_has_geometry = False
-
-# Try dissolving counties by region first (most reliable)
-if counties_gdf is not None:
-    print("   Creating region boundaries by dissolving counties...")
-    region_lookup = df[['FIPS', 'Region']].drop_duplicates()
-    counties_with_region = counties_gdf.merge(region_lookup, on='FIPS', how='inner')
-    
-    if 'Region' in counties_with_region.columns and len(counties_with_region) > 0:
-        region_gdf = counties_with_region.dissolve(by='Region', aggfunc='first')
-        region_gdf = region_gdf.reset_index()
-        
+def build_region_level(region_agg, region_gdf):
+    """Build the region output (GeoDataFrame, or the aggregated DataFrame if no boundaries)"""
+    print("\n🌍 Creating Region GeoJSON...")
+
+    # Region boundaries are dissolved from counties (most reliable)
+    if region_gdf is not None:
         region_merged = region_gdf.merge(region_agg, on='Region', how='inner')
         region_output = region_merged[['geometry'] + [col for col in region_agg.columns if col in region_merged.columns]]
-        region_has_geometry = True
-
-# Save region GeoJSON
-if region_has_geometry:
-    region_geojson = region_output.to_json()
-    region_file = OUTPUT_DIR / "biomed_regions.geojson"
-    with open(region_file, 'w') as f:
-        json.dump(json.loads(region_geojson), f, indent=2)
-    print(f"   ✓ Created {region_file}")
-    print(f"   ✓ Features: {len(region_output):,}")
-elif not region_has_geometry:
+        region_output.attrs['dissolved_by'] = 'Region'
+        return region_output
+
     # Create without geometry
-    region_geojson = {
-        "type": "FeatureCollection",
-        "features": []
-    }
-    for _, row in region_agg.iterrows():
-        feature = {
-            "type": "Feature",
-            "properties": row.dropna().to_dict(),
-            "geometry": None
-        }
-        region_geojson["features"].append(feature)
-    
-    region_file = OUTPUT_DIR / "biomed_regions.geojson"
-    with open(region_file, 'w') as f:
-        json.dump(region_geojson, f, indent=2)
-    
-    print(f"   ✓ Created {region_file} (no geometry)")
-    print(f"   ✓ Features: {len(region_agg):,}")
+    return region_agg
+
 
 # ============================================================================
 # LEVEL 5: DIVISIONS (aggregate regions, include division only)
 # ============================================================================
-print("\n🌎 Creating Division GeoJSON...")
-
-# Aggregate data by division
-division_agg = df.groupby('Division').agg({
-    **{col: 'first' for col in ['DCODE']},
-    **{col: 'sum' for col in year_cols},
-    **{col: 'first' for col in [c for c in total_cols if 'Division' in c]}
-}).reset_index()
-
-# Create division boundaries by dissolving counties
-division_has_geometry = False
-
-# Dissolve counties by division
-if counties_gdf is not None:
-    print("   Creating division boundaries by dissolving counties...")
-    division_lookup = df[['FIPS', 'Division']].drop_duplicates()
-    counties_with_division = counties_gdf.merge(division_lookup, on='FIPS', how='inner')
-    
-    if 'Division' in counties_with_division.columns and len(counties_with_division) > 0:
-        division_gdf = counties_with_division.dissolve(by='Division', aggfunc='first')
-        division_gdf = division_gdf.reset_index()
-        
+def build_division_level(division_agg, division_gdf):
+    """Build the division output (GeoDataFrame, or the aggregated DataFrame if no boundaries)"""
+    print("\n🌎 Creating Division GeoJSON...")
+
+    # Division boundaries are dissolved from counties
+    if division_gdf is not None:
         division_merged = division_gdf.merge(division_agg, on='Division', how='inner')
         division_output = division_merged[['geometry'] + [col for col in division_agg.columns if col in division_merged.columns]]
-        division_has_geometry = True
-
-# Save division GeoJSON
-if division_has_geometry:
-    division_geojson = division_output.to_json()
-    division_file = OUTPUT_DIR / "biomed_divisions.geojson"
-    with open(division_file, 'w') as f:
-        json.dump(json.loads(division_geojson), f, indent=2)
-    print(f"   ✓ Created {division_file}")
-    print(f"   ✓ Features: {len(division_output):,}")
-elif not division_has_geometry:
+        division_output.attrs['dissolved_by'] = 'Division'
+        return division_output
+
     # Create without geometry
-    division_geojson = {
-        "type": "FeatureCollection",
-        "features": []
-    }
-    for _, row in division_agg.iterrows():
-        feature = {
-            "type": "Feature",
-            "properties": row.dropna().to_dict(),
-            "geometry": None
-        }
-        division_geojson["features"].append(feature)
-    
-    division_file = OUTPUT_DIR / "biomed_divisions.geojson"
-    with open(division_file, 'w') as f:
-        json.dump(division_geojson, f, indent=2)
-    
-    print(f"   ✓ Created {division_file} (no geometry)")
-    print(f"   ✓ Features: {len(division_agg):,}")
+    return division_agg
+
+
+def has_geometry(output):
+    """True if a level output carries boundaries (is a GeoDataFrame)"""
+    return isinstance(output, gpd.GeoDataFrame)
+
+
+def write_level_file(level, output, output_dir, profile=DEFAULT_PROFILE, spans=None, formats=()):
+    """
+    Write a level output to its GeoJSON file without reporting, returns the output path
+    spans, if a list, receives each feature's position in the file (see geojson_writer.FeatureStreamWriter).
+    formats are also written next to it (see geo_formats.py).
+    """
+    level_file = output_dir / OUTPUT_FILENAMES[level]
+    if has_geometry(output):
+        write_geojson(output, level_file, profile=profile, spans=spans)
+    else:
+        write_geojson_without_geometry(output, level_file, profile=profile)
+    write_formats(output, level_file, formats)
+    return level_file
+
+
+def format_files(level, level_file, formats):
+    """A level's files in other formats, keyed '<level>_<format>' (levels without geometry have none)"""
+    paths = {f"{level}_{name}": format_path(level_file, name) for name in formats}
+    return {key: path for key, path in paths.items() if path.exists()}
+
+
+def report_level(level_file, output, formats=()):
+    """Print what was written for a level"""
+    print(f"   ✓ Created {level_file}" + ("" if has_geometry(output) else " (no geometry)"))
+    for path in [format_path(level_file, name) for name in formats] if has_geometry(output) else []:
+        print(f"   ✓ Created {path}")
+    print(f"   ✓ Features: {len(output):,}")
+
+
+def write_level(level, output, output_dir, profile=DEFAULT_PROFILE, spans=None, formats=()):
+    """Write a level output to its GeoJSON file (and formats), returns the GeoJSON path"""
+    level_file = write_level_file(level, output, output_dir, profile, spans, formats)
+    report_level(level_file, output, formats)
+    return level_file
+
+
+def write_levels_parallel(outputs, output_dir, profile=DEFAULT_PROFILE, workers=2, formats=()):
+    """
+    Write level outputs across a process pool
+    Each task receives only its own level's output. Reports and returns
+    the output paths in level order, whatever order the writes finish in.
+    """
+    print(f"\n✍️  Writing {len(outputs)} levels with {workers} workers...")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {level: executor.submit(write_level_file, level, output, output_dir, profile, None, formats)
+                   for level, output in outputs.items()}
+        files = {}
+        for level, future in futures.items():
+            files[level] = future.result()
+            report_level(files[level], outputs[level], formats)
+    return files
+
+
+def print_profile_comparison(output):
+    """Print the size and write time of a level output under every profile"""
+    if not has_geometry(output):
+        return
+    print(f"   {'Profile':<10} {'Size (MB)':>10} {'Write (s)':>10}")
+    for result in compare_profiles(output):
+        print(f"   {result['profile']:<10} {result['size'] / 1024 / 1024:>10.2f} {result['seconds']:>10.2f}")
+
+
+def write_levels_topojson(outputs, memberships, output_dir, cache_dir=None, offline=None, states=None):
+    """
+    Write the county-based levels as one TopoJSON topology with shared arcs
+
+    Counties and every level dissolved from counties are encoded from the
+    unsimplified county boundaries, so each border is stored once; arcs are
+    simplified to the same 0.001 degree tolerance as the GeoJSON outputs.
+    The ZIP level is not included (ZCTAs don't share borders with counties).
+    Returns the output path (None if no county-based level has geometry).
+    """
+    print("\n🗺️  Creating TopoJSON (all levels, shared arcs)...")
+
+    layers = {}
+    for level, output in outputs.items():
+        if not has_geometry(output):
+            continue
+        properties = output.drop(columns='geometry')
+        if level == 'county':
+            layers[level] = (properties, 'FIPS', None)
+        elif 'dissolved_by' in output.attrs:
+            group_col = output.attrs['dissolved_by']
+            membership = memberships[level]
+            layers[level] = (properties, group_col, membership.assign(FIPS=format_code(membership['FIPS'])))
+
+    if not layers:
+        print("   ⚠ Skipped (no county-based level with geometry)")
+        return None
+
+    counties_gdf = load_boundaries(COUNTY_VINTAGE, cache_dir, offline, states=states)
+    fips = set(outputs['county']['FIPS']) if 'county' in layers else set()
+    for membership in memberships.values():
+        fips.update(format_code(membership['FIPS']).dropna())
+    counties_gdf = counties_gdf[counties_gdf['FIPS'].isin(fips)]
+
+    topojson_file = output_dir / TOPOJSON_FILENAME
+    arc_count = write_topojson(topojson_file, counties_gdf, 'FIPS', layers, simplify=0.001)
+
+    print(f"   ✓ Created {topojson_file}")
+    print(f"   ✓ Objects: {', '.join(layers)} ({arc_count:,} shared arcs)")
+    print(f"   ✓ File size: {topojson_file.stat().st_size / 1024 / 1024:.1f} MB")
+    return topojson_file
+
 
 # ============================================================================
-# SUMMARY
+# INCREMENTAL BUILDS (see incremental.py)
 # ============================================================================
-print("\n" + "=" * 70)
-print("✅ COMPLETE!")
-print("=" * 70)
-print(f"\nGeoJSON files created in: {OUTPUT_DIR}")
-print("\nFiles created:")
-print("  📦 biomed_zip_codes.geojson     - ZIP code level (all fields)")
-print("  🏛️  biomed_counties.geojson      - County level (county/chapter/region/division)")
-print("  📚 biomed_chapters.geojson      - Chapter level (chapter/region/division)")
-print("  🌍 biomed_regions.geojson        - Region level (region/division)")
-print("  🌎 biomed_divisions.geojson     - Division level (division)")
-print("\nYou can now upload these GeoJSON files directly to ArcGIS Online!")
+def zip_store_path(cache_dir=None):
+    """The simplified ZIP boundaries the ZIP level is built from (None if no vintage is stored)"""
+    vintage = next((v for v in ZIP_VINTAGES if store_path(v, cache_dir).exists()), None)
+    return store_path(vintage, cache_dir, ZIP_SIMPLIFY) if vintage is not None else None
+
+
+def incremental_settings(df, levels, profile, topojson, cache_dir=None, specs=None):
+    """Everything but the CSV rows that the outputs depend on (a state is only reused if these match)"""
+    zip_store = zip_store_path(cache_dir) if 'zip' in levels else None
+    return {
+        'levels': [level for level in LEVELS if level in levels],
+        'profile': profile,
+        'topojson': topojson,
+        'specs': [[col, spec if isinstance(spec, str) else list(spec)] for col, spec in (specs or {}).items()],
+        'columns': [[col, str(dtype)] for col, dtype in df.dtypes.items()],
+        'counties': file_id(store_path(COUNTY_VINTAGE, cache_dir, COUNTY_SIMPLIFY)),
+        'dissolve': county_boundary_id(cache_dir),
+        'zips': [zip_store.name, *file_id(zip_store)] if zip_store is not None else None
+    }
+
+
+def group_signatures(df, levels):
+    """Each aggregated level's group signatures: a hash of every group's rows, in order"""
+    hashes = row_hashes(df)
+    return {level: group_hashes(df[key], hashes) for level, key, _ in HIERARCHY if level in levels and key in df.columns}
+
+
+def membership_hashes(memberships):
+    """
+    Hash of each dissolved group's counties (per level), and of all the
+    counties the levels use (the dissolve topology is built over those)
+    A group's counties are hashed as a set: the dissolve doesn't depend on
+    the order they come in. The topology does shape every group's outline
+    (its arcs are split and simplified between the counties it holds), so
+    each group's hash includes all the counties too.
+    """
+    counties = set()
+    for membership in memberships.values():
+        counties.update(membership['FIPS'])
+    fips = pd.util.hash_array(np.array(sorted(counties), dtype='uint64'))
+    topology = np.bitwise_xor.reduce(fips) if len(fips) else np.uint64(0)
+
+    members = {}
+    for level, membership in memberships.items():
+        fips = pd.util.hash_array(membership['FIPS'].to_numpy(dtype='uint64'))
+        members[level] = group_hashes(membership[DISSOLVE_COLUMNS[level]], fips, ordered=False) ^ topology
+    return members, str(topology) if len(counties) else None
+
+
+def level_features(level, properties, members):
+    """Keys and geometry tokens of a level's features (tokens tell dissolved geometries apart)"""
+    if level == 'zip':
+        return occurrence_keys(properties['Zip']), np.zeros(len(properties), dtype='uint64')
+    if level == 'county':
+        return properties['FIPS'], np.zeros(len(properties), dtype='uint64')
+    keys = key_text(properties[DISSOLVE_COLUMNS[level]])
+    hashes = members[level]
+    return keys, hashes.to_numpy()[hashes.index.get_indexer(keys.astype(object))]
+
+
+def save_incremental_state(state, settings, signatures, aggregates, memberships, dissolved, features, files):
+    """Record a build's aggregates, dissolved geometries and feature tables for the next incremental build"""
+    members, counties = membership_hashes(memberships)
+    tables = {}
+    tables.update({f"aggregate_{level}": aggregate for level, aggregate in aggregates.items()})
+    tables.update({f"signature_{level}": signature for level, signature in signatures.items()})
+    tables.update({f"members_{level}": hashes for level, hashes in members.items()})
+    tables.update({f"dissolved_{level}": gdf for level, gdf in dissolved.items() if gdf is not None})
+    tables.update({f"features_{level}": table for level, table in features.items()})
+    state.save(settings, tables, {level: files[level] for level in features}, extra={'counties': counties})
+
+
+def update_dissolved(memberships, levels, state, members, cache_dir=None, offline=None, dtypes=None):
+    """
+    Dissolve only the groups whose counties changed since the state was saved
+    Every other group keeps its stored geometry (the topology is the same, as
+    the state's counties are). Returns a dict like dissolve_levels().
+    """
+    print("\n5. Dissolving changed county groups...")
+    previous = {level: state.table(f"dissolved_{level}") for level in levels}
+    changed = {level: changed_keys(state.hashes(f"members_{level}"), members[level]) for level in levels}
+
+    pending = [level for level in levels if changed[level]]
+    engine = load_dissolve_engine({level: memberships[level] for level in levels}, cache_dir, offline) if pending else None
+
+    dissolved = {}
+    for level in levels:
+        group_col = DISSOLVE_COLUMNS[level]
+        fresh = None
+        if changed[level] and engine is not None:
+            membership = memberships[level]
+            fresh = engine.dissolve(membership[key_mask(membership[group_col], changed[level])], group_col)
+        dissolved[level] = patch_frame(previous[level], fresh, group_col, changed[level], dtypes)
+        print(f"   ✓ {group_col}: {0 if fresh is None else len(fresh)} dissolved, "
+              f"{len(dissolved[level]) - (0 if fresh is None else len(fresh))} reused")
+    return dissolved
+
+
+def boundary_rows(path, key_col, table, on):
+    """
+    table's rows joined to a stored boundary file's keys, in boundary order
+    (as the level builders join them), without reading any geometry
+    """
+    keys = pd.DataFrame({on: to_code(read_keys(path, key_col))})
+    return keys.merge(table, on=on, how='inner')
+
+
+def update_level(level, output_dir, state, profile, df, aggregates, dissolved, members, settings, cache_dir=None):
+    """
+    Patch a level file from the previous build (see incremental.patch_geojson())
+    Returns (path, feature table); levels without geometry are rewritten
+    in full and have no feature table.
+    """
+    level_file = output_dir / OUTPUT_FILENAMES[level]
+    if level == 'zip' and settings['zips'] is not None:
+        path = zip_store_path(cache_dir)
+        merged = boundary_rows(path, 'ZIP_CODE', df.rename(columns={'Zip': 'ZIP_CODE'}), 'ZIP_CODE')
+        properties = format_keys(merged.rename(columns={'ZIP_CODE': 'Zip'})[list(df.columns)])
+        key_col = 'ZIP_CODE'
+    elif level == 'county' and settings['counties']:
+        path = store_path(COUNTY_VINTAGE, cache_dir, COUNTY_SIMPLIFY)
+        properties = format_keys(boundary_rows(path, 'FIPS', aggregates['county'], 'FIPS'))
+        key_col = 'FIPS'
+    elif level in DISSOLVE_COLUMNS and dissolved.get(level) is not None:
+        merged = dissolved[level].merge(aggregates[level], on=DISSOLVE_COLUMNS[level], how='inner')
+        properties = merged.drop(columns='geometry')
+        path = None
+    else:
+        output = format_keys(df) if level == 'zip' else format_keys(aggregates[level])
+        return write_level(level, output, output_dir, profile), None
+
+    keys, geometry = level_features(level, properties, members)
+
+    def encode(positions):
+        if path is None:
+            return merged.geometry.values[positions].to_numpy()
+        wanted = properties['Zip' if level == 'zip' else 'FIPS'].iloc[positions]
+        found = read_keyed(path, key_col, wanted).drop_duplicates(key_col).set_index(key_col)
+        return found.geometry.reindex(wanted).values.to_numpy()
+
+    table, counts = patch_geojson(level_file, state.features(level), keys, properties, geometry, encode, profile)
+    if counts is None:
+        print(f"   ✓ Unchanged {level_file} ({len(table):,} features)")
+    else:
+        print(f"   ✓ Updated {level_file}: {counts['copied']:,} features copied, "
+              f"{counts['properties']:,} with new properties, {counts['encoded']:,} new geometries")
+    return level_file, table
+
+
+def _update_levels(df, year_cols, total_cols, levels, output_dir, cache_dir, offline, profile, topojson,
+                   dissolve_cache, state, settings, enter, timer, specs=None):
+    """_build_levels() from a saved state: only what the CSV changes is recomputed (see incremental.py)"""
+    print("\n♻️  Incremental build: diffing against the previous run...")
+
+    # Only the boundary keys are read below, and geometry only for new features
+    enter('load_boundaries')
+
+    enter('aggregate')
+    specs = {**default_specs(year_cols, total_cols), **(specs or {})}
+    signatures = group_signatures(df, levels)
+    aggregates = {}
+    changed = {}
+    for level, key, _ in HIERARCHY:
+        if level not in signatures:
+            continue
+        changed[level] = changed_keys(state.hashes(f"signature_{level}"), signatures[level])
+        fresh = None
+        if changed[level]:
+            rows = df[key_mask(df[key], changed[level])]
+            fresh = rollup_levels(rows, specs, [level])[0].get(level)
+        aggregates[level] = patch_frame(state.table(f"aggregate_{level}"), fresh, key, changed[level], df.dtypes)
+        print(f"   ✓ {level}: {len(changed[level]):,} of {len(aggregates[level]):,} groups changed")
+    memberships = {level: df[['FIPS', key]].dropna().drop_duplicates() for level, key in DISSOLVE_COLUMNS.items()
+                   if level in aggregates and 'FIPS' in df.columns}
+    timer.note(groups={level: len(aggregate) for level, aggregate in aggregates.items()},
+               changed_groups={level: len(keys) for level, keys in changed.items()})
+
+    enter('dissolve')
+    members, counties = membership_hashes(memberships)
+    to_dissolve = list(memberships) if settings['counties'] else []
+    dissolved = {}
+    if to_dissolve:
+        if counties == state.info.get('counties') and all(state.table(f"dissolved_{level}") is not None
+                                                          for level in to_dissolve):
+            dissolved = update_dissolved(memberships, to_dissolve, state, members, cache_dir, offline, df.dtypes)
+        else:
+            # Other counties, other topology: every group is dissolved again
+            dissolved = dissolve_levels(memberships, to_dissolve, cache_dir, offline, use_cache=dissolve_cache)
+
+    print("\n" + "=" * 70)
+    print("Updating GeoJSON files...")
+    print("=" * 70)
+
+    files = {}
+    features = {}
+    for level in LEVELS:
+        if level in levels:
+            enter(f"level_{level}")
+            files[level], table = update_level(level, output_dir, state, profile, df, aggregates, dissolved,
+                                               members, settings, cache_dir)
+            if table is not None:
+                features[level] = table
+            timer.note(bytes=files[level].stat().st_size, **({'features': len(table)} if table is not None else {}))
+
+    if topojson:
+        enter('topojson')
+        topojson_file = output_dir / TOPOJSON_FILENAME
+        unchanged = all(file_id(path) == state.info['files'].get(level, {}).get('id')
+                        for level, path in files.items() if level != 'zip')
+        if not (unchanged and topojson_file.exists()):
+            # Encoded from the complete county-based outputs
+            builders = {
+                'county': lambda: build_county_level(aggregates['county'], load_county_boundaries(cache_dir, offline)),
+                'chapter': lambda: build_chapter_level(aggregates['chapter'], dissolved.get('chapter'), None),
+                'region': lambda: build_region_level(aggregates['region'], dissolved.get('region')),
+                'division': lambda: build_division_level(aggregates['division'], dissolved.get('division'))
+            }
+            outputs = {level: build() for level, build in builders.items() if level in levels}
+            topojson_file = write_levels_topojson(outputs, memberships, output_dir, cache_dir, offline)
+        if topojson_file is not None and topojson_file.exists():
+            files['topojson'] = topojson_file
+            timer.note(bytes=topojson_file.stat().st_size)
+
+    save_incremental_state(state, settings, signatures, aggregates, memberships, dissolved, features, files)
+    enter('done')
+    return files
+
+
+def parse_states(states):
+    """Two-digit state FIPS codes from postal abbreviations or FIPS codes ('FL', 'al', '12', 1)"""
+    codes = []
+    for state in states:
+        state = str(state).strip().upper()
+        code = STATE_CODES.get(state, state.zfill(2) if state.isdigit() else None)
+        if code not in STATE_CODES.values():
+            raise ValueError(f"Unknown state: {state}")
+        codes.append(code)
+    return sorted(set(codes))
+
+
+def parse_bbox(bbox):
+    """
+    A bounding box (minx, miny, maxx, maxy, degrees) as a tuple of floats
+    Raises ValueError unless it is four finite numbers with minx < maxx and miny < maxy.
+    """
+    if (not isinstance(bbox, (list, tuple)) or len(bbox) != 4 or
+            not all(isinstance(value, numbers.Real) and not isinstance(value, bool) for value in bbox)):
+        raise ValueError("bbox must be [minx, miny, maxx, maxy] (four numbers)")
+    minx, miny, maxx, maxy = bbox = tuple(float(value) for value in bbox)
+    if not all(math.isfinite(value) for value in bbox):
+        raise ValueError("bbox values must be finite")
+    if not (minx < maxx and miny < maxy):
+        raise ValueError("bbox must have minx < maxx and miny < maxy")
+    return bbox
+
+
+def states_of(fips):
+    """Two-digit state FIPS codes of county FIPS codes (UInt32 codes, see to_code())"""
+    states = (pd.Series(fips).dropna().astype('int64') // 1000).unique()
+    return sorted(format_code(pd.Series(states), width=2))
+
+
+def select_subset(df, bbox=None, states=None, divisions=None):
+    """
+    Keep only the rows of a subset, and describe the boundaries it needs
+
+    divisions keeps the rows of those divisions. states keeps the rows in
+    those states: postal abbreviations or FIPS codes, or 'auto' for the states
+    the rows' counties are in (a CSV covering one division then reads only
+    that division's states). bbox (minx, miny, maxx, maxy, degrees) is applied
+    once the counties in it are known (see subset_to_counties()).
+    Returns (df, subset): subset is None without any option, else
+    {'bbox': bbox, 'states': state FIPS codes, or None for a bbox alone}.
+    """
+    if bbox is None and states is None and not divisions:
+        return df, None
+
+    print("\n🔎 Selecting subset...")
+    if divisions:
+        df = df[df['Division'].isin(divisions)].reset_index(drop=True)
+        print(f"   ✓ Divisions: {', '.join(divisions)} ({len(df):,} rows)")
+    if states == 'auto' or (states is None and divisions):
+        states = states_of(df['FIPS'])
+    elif states is not None:
+        states = parse_states(states)
+    if states is not None:
+        df = df[(df['FIPS'] // 1000).isin([int(state) for state in states]).to_numpy(dtype=bool, na_value=False)]
+        df = df.reset_index(drop=True)
+        print(f"   ✓ States: {', '.join(states)} ({len(df):,} rows)")
+    if bbox is not None:
+        bbox = parse_bbox(bbox)
+        print(f"   ✓ Bounding box: {', '.join(f'{value:g}' for value in bbox)}")
+    return df, {'bbox': bbox, 'states': states}
+
+
+def subset_to_counties(df, subset, counties_gdf):
+    """
+    Keep only the rows whose county was loaded for a bbox subset, and fill in
+    the subset's states (so later reads push a state filter down too)
+    Returns df.
+    """
+    if subset is None or subset['bbox'] is None or counties_gdf is None:
+        return df
+    df = df[df['FIPS'].isin(to_code(counties_gdf['FIPS'])).to_numpy(dtype=bool, na_value=False)]
+    df = df.reset_index(drop=True)
+    subset['states'] = states_of(df['FIPS'])
+    print(f"   ✓ {len(df):,} rows in the {len(counties_gdf):,} counties within the bounding box")
+    return df
+
+
+def build_stages(levels, topojson=False):
+    """The stages build_levels() goes through, in order (as reported to progress)"""
+    stages = ['detect', 'load_csv', 'load_boundaries', 'aggregate', 'dissolve']
+    stages += [f"level_{level}" for level in LEVELS if level in levels]
+    return stages + (['topojson'] if topojson else [])
+
+
+def build_levels(csv_file, levels=None, output_dir=None, cache_dir=None, offline=None,
+                 profile=DEFAULT_PROFILE, compare=False, topojson=False, dissolve_cache=True, workers=None,
+                 progress=None, cprofile_dir=None, bbox=None, states=None, divisions=None, incremental=False,
+                 formats=None, specs=None):
+    """
+    Build the requested levels in a single pass
+
+    The CSV is loaded once, and only the boundaries the requested levels need
+    are loaded from the boundary store (cache_dir / offline are passed through
+    to it). profile is one of the geojson_writer.PROFILES; with compare=True
+    the size and write time of every profile is also reported per level.
+    With topojson=True the county-based levels are also written together as
+    one TopoJSON file (returned under the 'topojson' key). Dissolved
+    boundaries are reused from the dissolve cache unless dissolve_cache=False.
+    With workers > 1 (0 = one per CPU), dissolve groups and level writes are
+    spread across that many processes; outputs are the same either way.
+
+    bbox, states and divisions build only a subset (see select_subset()):
+    only those rows are aggregated, and only the boundaries they need are
+    read from the boundary store (the filters are pushed down into the read).
+
+    With incremental=True, the build keeps its aggregates, dissolved groups
+    and feature positions in output_dir/.incremental/, and a later incremental
+    build into the same directory recomputes, dissolves and rewrites only the
+    groups whose rows changed (see incremental.py). The files are the same as
+    a full build's; without a matching previous run the build runs in full.
+
+    formats ('geoparquet', 'flatgeobuf'; see geo_formats.py) are also written
+    for every level with geometry, next to its GeoJSON file, and returned
+    under '<level>_<format>' keys.
+
+    specs ({column: aggregation}, see rollup.py) set how those columns are
+    aggregated at every level, over default_specs() (years summed, totals
+    kept), e.g. {'Rate': 'mean', 'Deferral %': ('weighted', 'Donors')}.
+
+    progress, if given, is called as progress(stage, done, total) when each
+    stage starts (see build_stages()) and with stage 'done' at the end. It may
+    raise to stop the build between stages (used to cancel web jobs).
+
+    Every stage is timed (wall, CPU, RSS, row / feature counts) and emitted
+    as a record (see instrumentation.py): column detection, CSV loading,
+    boundary loading, aggregation, dissolving, then per level the join to
+    its boundaries (level_<level>) and its write (write_<level>; write_levels
+    for all levels with workers). With cprofile_dir each stage is also
+    profiled into that directory.
+    Returns a dict mapping each level to the GeoJSON file written (and the files above).
+    """
+    levels = LEVELS if levels is None else levels
+    unknown = [level for level in levels if level not in LEVELS]
+    if unknown:
+        raise ValueError(f"Unknown level(s): {', '.join(unknown)}")
+    get_profile(profile)
+    formats = check_formats(formats)
+    workers = resolve_workers(workers)
+    specs = dict(specs or {})
+    spec_columns(specs)  # Raises ValueError for unknown aggregations
+
+    stages = build_stages(levels, topojson)
+    timer = StageTimer(cprofile_dir=cprofile_dir)
+
+    def enter(stage):
+        if stage == 'done':
+            timer.summary(levels=list(levels), topojson=topojson)
+        else:
+            timer.start(stage, **({'level': stage[len('level_'):]} if stage.startswith('level_') else {}))
+        if progress is not None:
+            progress(stage, stages.index(stage) if stage in stages else len(stages), len(stages))
+
+    try:
+        return _build_levels(csv_file, levels, output_dir, cache_dir, offline, profile, compare, topojson,
+                             dissolve_cache, workers, enter, timer, (bbox, states, divisions), incremental, formats,
+                             specs)
+    except BaseException as e:
+        # Record how far a failed or cancelled build got
+        timer.note(error=type(e).__name__)
+        timer.end()
+        raise
+
+
+def _build_levels(csv_file, levels, output_dir, cache_dir, offline, profile, compare, topojson,
+                  dissolve_cache, workers, enter, timer, subset_options=(None, None, None), incremental=False,
+                  formats=(), specs=None):
+    output_dir = Path(output_dir) if output_dir is not None else OUTPUT_DIR
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Columns are detected from a sample of rows, before the CSV is read
+    enter('detect')
+    detected = detect_csv(csv_file)
+    timer.note(columns=len(detected[0]), detected=len(detected[1]))
+
+    # The ZIP level keeps every CSV column, the other levels only need the rollup's
+    enter('load_csv')
+    specs = specs or {}
+    df, year_cols, total_cols = load_csv(csv_file, all_columns='zip' in levels, detected=detected,
+                                         columns=spec_columns(specs))
+    timer.note(rows=len(df), columns=len(df.columns))
+    missing = [col for col in spec_columns(specs) if col not in df.columns]
+    if missing:
+        raise ValueError(f"Aggregated column(s) not in the CSV: {', '.join(missing)}")
+
+    # Rows with only coordinates are located in the county / ZCTA boundaries
+    if 'Latitude' in df.columns:
+        timer.start('geocode')
+        counts = geocode_rows(df, levels, cache_dir, offline)
+        if counts is not None:
+            timer.note(points=counts['points'], located_fips=counts['FIPS'], located_zips=counts['Zip'])
+
+    df, subset = select_subset(df, *subset_options)
+    if subset is not None:
+        timer.note(subset_rows=len(df))
+    bbox = subset['bbox'] if subset is not None else None
+
+    state = None
+    if incremental:
+        unsupported = [reason for reason, applies in [('a subset', subset is not None), ('--compare-profiles', compare),
+                                                      ('a chapter shapefile', 'chapter' in levels and CHAPTERS_SHP.exists()),
+                                                      ('GeoParquet / FlatGeobuf output', bool(formats))]
+                       if applies]
+        if unsupported:
+            print(f"\n⚠ Incremental builds don't support {', '.join(unsupported)}: building in full")
+        else:
+            state = IncrementalState(output_dir)
+            if state.matches(incremental_settings(df, levels, profile, topojson, cache_dir, specs)):
+                return _update_levels(df, year_cols, total_cols, levels, output_dir, cache_dir, offline, profile,
+                                      topojson, dissolve_cache, state, state.info['settings'], enter, timer, specs)
+            print("\n♻️  Incremental build: no matching previous run, building in full")
+
+    enter('load_boundaries')
+    chapters_gdf = load_chapter_boundaries() if 'chapter' in levels else None
+    needs_counties = any(level in levels for level in ['county', 'chapter', 'region', 'division'])
+    # A subset needs its counties even for the ZIP level alone (to find its rows and extent)
+    counties_gdf = (load_county_boundaries(cache_dir, offline, bbox, subset['states'] if subset else None)
+                    if needs_counties or subset is not None else None)
+    df = subset_to_counties(df, subset, counties_gdf)
+    # A subset's ZIP read is limited to the extent of its counties, whichever
+    # option chose them (a bbox alone would miss their ZIPs outside it)
+    if subset is not None and counties_gdf is not None and len(counties_gdf):
+        bbox = tuple(float(value) for value in counties_gdf.total_bounds)
+    zips_gdf = load_zip_boundaries(cache_dir, offline, bbox) if 'zip' in levels else None
+    timer.note(**{name: len(gdf) for name, gdf in [('chapter_boundaries', chapters_gdf), ('counties', counties_gdf),
+                                                   ('zips', zips_gdf)] if gdf is not None})
+
+    # Aggregate every requested level in one rollup, each from the level below
+    enter('aggregate')
+    aggregates, memberships = rollup_levels(df, {**default_specs(year_cols, total_cols), **specs}, levels)
+    timer.note(groups={level: len(aggregate) for level, aggregate in aggregates.items()})
+
+    # Chapters are only dissolved when there is no chapter shapefile
+    to_dissolve = [level for level in DISSOLVE_COLUMNS
+                   if level in memberships and (level != 'chapter' or chapters_gdf is None)]
+    dissolved = {}
+    enter('dissolve')
+    if counties_gdf is not None and to_dissolve:
+        dissolved = dissolve_levels(memberships, to_dissolve, cache_dir, offline, use_cache=dissolve_cache,
+                                    workers=workers, states=subset['states'] if subset else None)
+        timer.note(groups={level: len(gdf) for level, gdf in dissolved.items() if gdf is not None})
+
+    print("\n" + "=" * 70)
+    print("Creating GeoJSON files...")
+    print("=" * 70)
+
+    builders = {
+        'zip': lambda: build_zip_level(df, zips_gdf),
+        'county': lambda: build_county_level(aggregates['county'], counties_gdf),
+        'chapter': lambda: build_chapter_level(aggregates['chapter'], dissolved.get('chapter'), chapters_gdf),
+        'region': lambda: build_region_level(aggregates['region'], dissolved.get('region')),
+        'division': lambda: build_division_level(aggregates['division'], dissolved.get('division'))
+    }
+
+    files = {}
+    outputs = {}
+    # Where each feature was written, kept for the next incremental build
+    features = {}
+    if workers > 1 and state is None:
+        # Build every level, then write them in parallel
+        built = {}
+        for level in LEVELS:
+            if level in levels:
+                enter(f"level_{level}")
+                built[level] = builders[level]()
+                timer.note(features=len(built[level]))
+        timer.start('write_levels')
+        files = write_levels_parallel(built, output_dir, profile, workers, formats)
+        timer.note(bytes={level: path.stat().st_size for level, path in files.items()})
+        for level, level_file in list(files.items()):
+            files.update(format_files(level, level_file, formats))
+        for level, output in built.items():
+            if compare:
+                print(f"\n   {level}:")
+                print_profile_comparison(output)
+            if topojson and level != 'zip':
+                outputs[level] = output
+    else:
+        for level in LEVELS:
+            if level in levels:
+                # level_<level> joins the level's data to its boundaries, write_<level> writes it
+                enter(f"level_{level}")
+                output = builders[level]()
+                timer.note(features=len(output))
+                timer.start(f"write_{level}", level=level)
+                spans = [] if state is not None and has_geometry(output) else None
+                files[level] = write_level(level, output, output_dir, profile, spans, formats)
+                timer.note(bytes=files[level].stat().st_size)
+                files.update(format_files(level, files[level], formats))
+                if spans is not None:
+                    features[level] = (output.drop(columns='geometry'), spans)
+                if compare:
+                    print_profile_comparison(output)
+                if topojson and level != 'zip':
+                    outputs[level] = output
+
+    if topojson:
+        enter('topojson')
+        topojson_file = write_levels_topojson(outputs, memberships, output_dir, cache_dir, offline,
+                                              states=subset['states'] if subset else None)
+        if topojson_file is not None:
+            files['topojson'] = topojson_file
+            timer.note(bytes=topojson_file.stat().st_size)
+
+    if state is not None:
+        members, _ = membership_hashes(memberships)
+        for level, (properties, spans) in features.items():
+            keys, geometry = level_features(level, properties, members)
+            features[level] = feature_table(keys, properties, geometry, spans)
+        save_incremental_state(state, incremental_settings(df, levels, profile, topojson, cache_dir, specs),
+                               group_signatures(df, aggregates), aggregates, memberships, dissolved, features, files)
+
+    enter('done')
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create GeoJSON files at multiple geographic levels")
+    parser.add_argument('csv', nargs='?', default=CSV_FILE, help="CSV file to process")
+    parser.add_argument('--levels', nargs='+', choices=LEVELS, default=LEVELS, help="Levels to create")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="Directory for the GeoJSON files")
+    parser.add_argument('--cache-dir', default=None, help="Boundary store directory (see boundary_store.py)")
+    parser.add_argument('--offline', action='store_true', default=None, help="Only use boundaries already in the store")
+    parser.add_argument('--profile', choices=list(PROFILES), default=DEFAULT_PROFILE,
+                        help="Output profile (coordinate precision, whitespace, nulls, bbox)")
+    parser.add_argument('--compare-profiles', action='store_true', help="Report size and write time of every profile")
+    parser.add_argument('--topojson', action='store_true', help="Also write the county-based levels as one TopoJSON file")
+    parser.add_argument('--no-dissolve-cache', action='store_true', help="Always dissolve boundaries, ignoring the dissolve cache")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes for dissolving and writing levels (0 = one per CPU, default: no pool)")
+    parser.add_argument('--log-stages', action='store_true',
+                        help="Write each stage's timing and memory record to stderr as JSON")
+    parser.add_argument('--cprofile', default=None, metavar='DIR', help="Profile every stage into DIR (.prof files)")
+    parser.add_argument('--bbox', nargs=4, type=float, default=None, metavar=('MINX', 'MINY', 'MAXX', 'MAXY'),
+                        help="Only build the counties overlapping this box (degrees)")
+    parser.add_argument('--states', nargs='+', default=None,
+                        help="Only build these states (abbreviations or FIPS codes, or 'auto': those in the CSV)")
+    parser.add_argument('--divisions', nargs='+', default=None,
+                        help="Only build these divisions (and read only their states' boundaries)")
+    parser.add_argument('--formats', nargs='+', choices=list(FORMATS), default=[],
+                        help="Also write levels with geometry in these formats (GeoParquet, FlatGeobuf)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Reuse the previous run in --output-dir, redoing only the groups whose rows changed")
+    parser.add_argument('--aggregate', nargs='+', type=parse_spec, default=[], metavar='COLUMN=HOW',
+                        help="Aggregate these columns at every level: sum, first, mean or weighted:WEIGHT_COLUMN")
+    args = parser.parse_args()
+
+    if args.log_stages:
+        log_to_stream()
+
+    print("=" * 70)
+    print("Creating GeoJSON files for Biomed data at multiple levels")
+    print("=" * 70)
+
+    build_levels(args.csv, levels=args.levels, output_dir=args.output_dir,
+                 cache_dir=args.cache_dir, offline=args.offline,
+                 profile=args.profile, compare=args.compare_profiles, topojson=args.topojson,
+                 dissolve_cache=not args.no_dissolve_cache, workers=args.workers, cprofile_dir=args.cprofile,
+                 bbox=args.bbox, states='auto' if args.states == ['auto'] else args.states,
+                 divisions=args.divisions, incremental=args.incremental, formats=args.formats,
+                 specs=dict(args.aggregate))
+
+    # ============================================================================
+    # SUMMARY
+    # ============================================================================
+    print("\n" + "=" * 70)
+    print("✅ COMPLETE!")
+    print("=" * 70)
+    print(f"\nGeoJSON files created in: {args.output_dir}")
+    print("\nFiles created:")
+    print("  📦 biomed_zip_codes.geojson     - ZIP code level (all fields)")
+    print("  🏛️  biomed_counties.geojson      - County level (county/chapter/region/division)")
+    print("  📚 biomed_chapters.geojson      - Chapter level (chapter/region/division)")
+    print("  🌍 biomed_regions.geojson        - Region level (region/division)")
+    print("  🌎 biomed_divisions.geojson     - Division level (division)")
+    print("\nYou can now upload these GeoJSON files directly to ArcGIS Online!")
+
 
+if __name__ == '__main__':
+    main()
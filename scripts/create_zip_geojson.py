@@ -5,19 +5,18 @@ Uses Esri Living Atlas service to get ZIP boundaries
 """
 
 import geopandas as gpd
-import pandas as pd
-import json
 from pathlib import Path
-import requests
-from io import BytesIO
-import zipfile
 import sys
 
 # Add scripts directory to path for imports
 SCRIPTS_DIR = Path(__file__).parent
 sys.path.insert(0, str(SCRIPTS_DIR))
 
-from column_detector import detect_columns, standardize_dataframe
+from column_detector import format_code, print_detection, to_code
+from csv_ingest import load_typed_csv
+from zip_index import fill_fips
+from geojson_writer import write_geojson, write_geojson_without_geometry
+from boundary_store import BoundaryUnavailable, is_offline, load_first_available
 
 # Configuration
 DATA_DIR = Path(__file__).parent.parent
@@ -31,23 +30,24 @@ print("=" * 70)
 
 # Step 1: Load CSV data and detect columns
 print("\n1. Loading CSV data...")
-df = pd.read_csv(CSV_FILE, low_memory=False)
+df, detection, _, _ = load_typed_csv(CSV_FILE)
 
 print(f"   ✓ Loaded {len(df):,} rows")
 print(f"   ✓ Columns: {len(df.columns)}")
 print(f"   ✓ Column names: {list(df.columns)[:10]}...")
 
-# Auto-detect column names
-print("\n   Detecting column names...")
-detected_cols = detect_columns(df)
 print(f"   ✓ Detected columns:")
-for std_name, actual_name in detected_cols.items():
-    print(f"      {std_name} → {actual_name}")
-
-# Standardize dataframe
-df, detected_cols = standardize_dataframe(df, detected_cols)
+print_detection(detection)
 
 print(f"   ✓ Standardized dataframe")
+
+# Rows with a ZIP but no FIPS get their county from the ZIP index
+if df['FIPS'].isna().any():
+    try:
+        filled = fill_fips(df)
+        print(f"   ✓ Filled {filled:,} missing FIPS codes from ZIP codes")
+    except (OSError, ValueError) as e:
+        print(f"   ⚠ Could not fill missing FIPS codes from ZIP codes: {e}")
 print(f"   ✓ Unique ZIP codes: {df['Zip'].nunique():,}")
 
 # Show what CODE columns we have
@@ -55,58 +55,27 @@ code_cols = [c for c in df.columns if c in ['ECODE', 'RCODE', 'DCODE']]
 if code_cols:
     print(f"   ✓ CODE columns detected: {code_cols}")
 
-# Step 2: Try to get ZIP boundaries from Census (try different URL formats)
-print("\n2. Downloading ZIP code boundaries...")
+# Step 2: Load ZIP boundaries from the boundary store (downloads from Census if not stored)
+print("\n2. Loading ZIP code boundaries...")
 
 zips_gdf = None
-zip_urls = [
-    # Try 2020 format (ZCTA5)
-    "https://www2.census.gov/geo/tiger/GENZ2020/shp/cb_2020_us_zcta520_500k.zip",
-    # Try 2019 format
-    "https://www2.census.gov/geo/tiger/GENZ2019/shp/cb_2019_us_zcta510_500k.zip",
-    # Try 2018 format  
-    "https://www2.census.gov/geo/tiger/GENZ2018/shp/cb_2018_us_zcta510_500k.zip",
+zip_vintages = [
+    # 2020 format (ZCTA5)
+    'cb_2020_us_zcta520_500k',
+    # 2019 format
+    'cb_2019_us_zcta510_500k',
+    # 2018 format
+    'cb_2018_us_zcta510_500k',
 ]
 
-for zips_url in zip_urls:
-    try:
-        print(f"   Trying: {zips_url.split('/')[-1]}")
-        response = requests.get(zips_url, timeout=60)
-        response.raise_for_status()
-        
-        with zipfile.ZipFile(BytesIO(response.content)) as z:
-            # Extract to temp directory
-            temp_dir = OUTPUT_DIR / "temp_zips"
-            temp_dir.mkdir(exist_ok=True)
-            z.extractall(temp_dir)
-            
-            # Find the shapefile
-            shp_files = [f for f in z.namelist() if f.endswith('.shp')]
-            if shp_files:
-                zips_gdf = gpd.read_file(temp_dir / shp_files[0])
-                zips_gdf = zips_gdf.to_crs('EPSG:4326')
-                
-                # Find ZIP code column
-                zip_col = None
-                for col in ['ZCTA5CE20', 'ZCTA5CE10', 'ZCTA5', 'GEOID20', 'GEOID10', 'GEOID', 'ZCTA5CE00']:
-                    if col in zips_gdf.columns:
-                        zip_col = col
-                        break
-                
-                if zip_col:
-                    zips_gdf['ZIP_CODE'] = zips_gdf[zip_col].astype(str).str.zfill(5)
-                    zips_gdf['geometry'] = zips_gdf['geometry'].simplify(0.0005, preserve_topology=True)
-                    print(f"   ✓ Loaded {len(zips_gdf):,} ZIP codes from Census")
-                    break
-                else:
-                    print(f"   ⚠ Could not find ZIP column. Available: {list(zips_gdf.columns)[:10]}")
-                    zips_gdf = None
-    except Exception as e:
-        print(f"   ⚠ Failed: {str(e)[:80]}")
-        continue
+try:
+    vintage, zips_gdf = load_first_available(zip_vintages, simplify=0.0005)
+    print(f"   ✓ Loaded {len(zips_gdf):,} ZIP codes from Census ({vintage})")
+except BoundaryUnavailable as e:
+    print(f"   ⚠ {str(e)[:80]}")
 
 # Step 3: If Census failed, try using Esri service via arcgis Python API
-if zips_gdf is None:
+if zips_gdf is None and not is_offline():
     print("\n3. Trying Esri Living Atlas service...")
     try:
         from arcgis.features import FeatureLayer
@@ -116,7 +85,7 @@ if zips_gdf is None:
         zip_layer = FeatureLayer(zip_service_url)
         
         # Get unique ZIPs from our data (limit to first 5000 for performance)
-        unique_zips = df['Zip'].dropna().unique()[:5000]
+        unique_zips = format_code(df['Zip'].dropna().unique()[:5000])
         zip_where = " OR ".join([f"ZCTA5CE10 = '{z}'" for z in unique_zips[:100]])  # Limit query size
         
         print(f"   Querying Esri service for {len(unique_zips)} ZIP codes...")
@@ -154,7 +123,7 @@ if zips_gdf is not None and 'ZIP_CODE' in zips_gdf.columns:
     # Join CSV data to ZIP boundaries
     print(f"   Joining {len(df):,} CSV rows to {len(zips_gdf):,} ZIP boundaries...")
     
-    zip_merged = zips_gdf.merge(
+    zip_merged = zips_gdf.assign(ZIP_CODE=to_code(zips_gdf['ZIP_CODE'])).merge(
         df,
         left_on='ZIP_CODE',
         right_on='Zip',
@@ -165,15 +134,14 @@ if zips_gdf is not None and 'ZIP_CODE' in zips_gdf.columns:
     
     # Keep all columns from CSV (including ECODE, DCODE, RCODE)
     zip_output = zip_merged[['geometry'] + [col for col in df.columns if col in zip_merged.columns]]
+    zip_output = zip_output.assign(Zip=format_code(zip_output['Zip']), FIPS=format_code(zip_output['FIPS']))
     
     # Verify CODE columns are included
     code_cols_in_output = [c for c in zip_output.columns if 'CODE' in c.upper()]
     print(f"   ✓ CODE columns in output: {code_cols_in_output}")
     
-    zip_geojson = zip_output.to_json()
     zip_file = OUTPUT_DIR / "biomed_zip_codes.geojson"
-    with open(zip_file, 'w') as f:
-        json.dump(json.loads(zip_geojson), f, indent=2)
+    write_geojson(zip_output, zip_file)
     
     print(f"\n   ✅ Created {zip_file}")
     print(f"   ✓ Features: {len(zip_output):,}")
@@ -190,22 +158,8 @@ else:
     print("   ⚠ No ZIP boundaries available - creating GeoJSON with data only")
     print("   (You can join this to ZIP boundaries in ArcGIS Online)")
     
-    zip_geojson = {
-        "type": "FeatureCollection",
-        "features": []
-    }
-    
-    for _, row in df.iterrows():
-        feature = {
-            "type": "Feature",
-            "properties": row.dropna().to_dict(),
-            "geometry": None
-        }
-        zip_geojson["features"].append(feature)
-    
     zip_file = OUTPUT_DIR / "biomed_zip_codes.geojson"
-    with open(zip_file, 'w') as f:
-        json.dump(zip_geojson, f, indent=2)
+    write_geojson_without_geometry(df.assign(Zip=format_code(df['Zip']), FIPS=format_code(df['FIPS'])), zip_file)
     
     print(f"\n   ✅ Created {zip_file} (data only, no geometry)")
     print(f"   ✓ Features: {len(df):,}")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Typed, projected CSV ingestion for the pipeline scripts
+
+Instead of reading every column with inferred types, the header and a bounded
+sample of rows are read first and run through score_columns() (header names,
+then values). Then only the columns the caller needs are read, with explicit
+dtypes:
+
+- ZIP / FIPS and the hierarchy name columns as strings (no int → str round trip)
+- year (e.g. 2022) and total (e.g. Chapter Total) columns as numbers
+
+The file is streamed through pyarrow's CSV reader in record batches
+(multithreaded, skipped columns are never materialized). If pyarrow cannot
+parse the file, it is read in chunks with the C engine instead. Either way
+memory stays bounded by the projected, typed columns.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from column_detector import SAMPLE_ROWS, score_columns, standardize_dataframe
+
+# Standard columns read as strings (see column_detector.detect_columns)
+STRING_COLUMNS = ['Zip', 'FIPS', 'County', 'State', 'Chapter', 'Region', 'Division']
+
+# Standard columns the rollup levels use (see rollup.LEVEL_ATTRIBUTES)
+ROLLUP_COLUMNS = ['Zip', 'FIPS', 'County', 'State', 'Chapter', 'ECODE', 'Region', 'RCODE', 'Division', 'DCODE']
+
+# Standard columns read as numbers, for locating rows without ZIP / FIPS (see geocode.py)
+COORDINATE_COLUMNS = ['Latitude', 'Longitude']
+
+# Bytes per pyarrow record batch, and rows per chunk when falling back to the C engine
+BLOCK_BYTES = 16 * 1024 * 1024
+CHUNK_ROWS = 500_000
+
+
+def read_sample(csv_file, rows=SAMPLE_ROWS):
+    """The CSV's header and first rows (as strings), to detect its columns from"""
+    return pd.read_csv(csv_file, nrows=rows, dtype=str)
+
+
+def numeric_columns(columns):
+    """Split column names into (year_cols, total_cols)"""
+    year_cols = [col for col in columns if str(col).isdigit()]
+    total_cols = [col for col in columns if 'Total' in str(col)]
+    return year_cols, total_cols
+
+
+def _narrow_integers(df, columns):
+    """Store whole-valued numeric columns without missing values as int64 (as pandas would infer)"""
+    for col in columns:
+        values = df[col]
+        if values.dtype.kind == 'f' and values.notna().all() and np.array_equal(values, np.floor(values)):
+            df[col] = values.astype('int64')
+
+
+def _read_typed(csv_file, usecols, dtypes, numeric):
+    # Strings are dictionary encoded as they are parsed (they arrive as categoricals)
+    column_types = {col: pa.dictionary(pa.int32(), pa.string()) for col in dtypes}
+    column_types.update({col: pa.float64() for col in numeric})
+    try:
+        # Stream record batches, so only the projected columns are ever held as Arrow data
+        reader = pacsv.open_csv(
+            csv_file,
+            read_options=pacsv.ReadOptions(block_size=BLOCK_BYTES),
+            convert_options=pacsv.ConvertOptions(include_columns=usecols, column_types=column_types,
+                                                 strings_can_be_null=True)
+        )
+        table = pa.Table.from_batches(list(reader), schema=reader.schema)
+        return table.to_pandas(self_destruct=True)
+    except (pa.ArrowInvalid, ValueError):
+        # Not parseable by pyarrow (e.g. ragged rows, or text in a numeric column)
+        pass
+
+    chunks = pd.read_csv(csv_file, usecols=usecols, dtype=dtypes, chunksize=CHUNK_ROWS, low_memory=False)
+    parts = []
+    for chunk in chunks:
+        for col in numeric:
+            chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+        parts.append(chunk[usecols])
+    if not parts:
+        return pd.read_csv(csv_file, usecols=usecols, dtype=dtypes, nrows=0)[usecols]
+    return pd.concat(parts, ignore_index=True)
+
+
+def detect_csv(csv_file):
+    """
+    Detect a CSV's columns from its header and a sample of its rows
+    Returns (header, detection, year_cols, total_cols), where detection maps each
+    standard column found to its CSV column and confidence (see score_columns()).
+    """
+    sample = read_sample(csv_file)
+    header = list(sample.columns)
+    year_cols, total_cols = numeric_columns(header)
+    return header, score_columns(sample), year_cols, total_cols
+
+
+def load_typed_csv(csv_file, all_columns=True, detected=None, columns=()):
+    """
+    Read a CSV with typed columns, detect its columns and standardize it
+
+    With all_columns=False only the columns the rollup uses (ROLLUP_COLUMNS,
+    year and total columns) and any coordinate columns are read; the rest of
+    the file is skipped, except for the CSV columns named in columns (those
+    aggregation specs use). detected, the detect_csv() of the file, saves
+    detecting its columns again.
+    Returns (df, detection, year_cols, total_cols) (see detect_csv()).
+    """
+    header, detection, year_cols, total_cols = detected or detect_csv(csv_file)
+    detected_cols = {name: match['column'] for name, match in detection.items()}
+
+    if all_columns:
+        usecols = header
+    else:
+        wanted = {detected_cols[name] for name in ROLLUP_COLUMNS + COORDINATE_COLUMNS if name in detected_cols}
+        wanted.update(year_cols + total_cols)
+        wanted.update(col for col in columns if col in header)
+        usecols = [col for col in header if col in wanted]
+
+    dtypes = {detected_cols[name]: 'str' for name in STRING_COLUMNS
+              if name in detected_cols and detected_cols[name] in usecols}
+    numeric = [col for col in year_cols + total_cols if col not in dtypes]
+    coordinates = [detected_cols[name] for name in COORDINATE_COLUMNS
+                   if name in detected_cols and detected_cols[name] in usecols]
+
+    df = _read_typed(csv_file, usecols, dtypes, numeric + coordinates)
+    _narrow_integers(df, numeric)
+
+    df, detected_cols = standardize_dataframe(df, detected_cols)
+    return df, detection, year_cols, total_cols
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Topology-based dissolve of counties into chapters, regions and divisions
+
+GeoDataFrame.dissolve() runs a polygon union per group, which is slow for
+groups of hundreds of detailed counties. Here the county topology is built
+once (see topology.py): every border is one arc, shared by the two counties
+it separates. A group's outline is then just its counties' arcs minus the
+arcs used twice within the group (its interior borders), stitched into rings.
+No polygon union is ever computed.
+
+    engine = DissolveEngine(counties_gdf, simplify=0.001)
+    chapters = engine.dissolve(membership, 'Chapter')
+    regions = engine.dissolve(region_membership, 'Region')
+
+The engine should be built from unsimplified boundaries: simplifying counties
+one by one moves each side of a shared border differently, so the borders no
+longer match. With simplify, each arc is simplified once instead, which keeps
+neighbouring groups seamless.
+
+The result matches GeoDataFrame.dissolve() on the same counties up to the
+quantization grid (DISSOLVE_QUANTIZATION steps across the data's extent).
+
+Dissolved geometries can be kept in a DissolveCache, keyed by the boundary
+vintage and the FIPS → group mapping, so repeated runs over the same
+territories skip building the topology altogether.
+"""
+
+import geopandas as gpd
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import os
+import pandas as pd
+from pathlib import Path
+
+from topology import Topology, assemble, build_topology, simplify_arcs, to_shapely
+
+# Finer than the TopoJSON default: dissolved outlines are written as GeoJSON
+# at full precision, so the grid should stay well below the simplify tolerance
+DISSOLVE_QUANTIZATION = 100_000_000
+
+# Number of tasks a parallel dissolve is split into (several per worker, for balance)
+PARALLEL_TASKS = 32
+
+# Size limit of the dissolve cache, overridden by GEOJSON_DISSOLVE_CACHE_MB
+DEFAULT_CACHE_MB = 256
+
+# Bump when dissolve output changes, so old cache entries are not served
+CACHE_VERSION = 2
+
+
+# Topology of a worker process (set once per worker by _init_worker)
+_worker_topology = None
+
+
+def _init_worker(topology):
+    global _worker_topology
+    _worker_topology = topology
+
+
+def _outline_geometries(outlines, topology=None):
+    """Build each group's geometry from its outline arc references"""
+    topology = _worker_topology if topology is None else topology
+    return [to_shapely(topology, assemble(topology, refs.tolist())) for refs in outlines]
+
+
+class DissolveEngine:
+    """
+    Dissolves groups of base polygons (counties) by dropping shared arcs
+
+    The topology and, for every base polygon, the arc references of its
+    rings are computed once, so each dissolve is a few array operations
+    plus stitching the outline arcs of each group into rings.
+    """
+
+    def __init__(self, base_gdf, key_col='FIPS', simplify=None, quantization=DISSOLVE_QUANTIZATION):
+        self.key_col = key_col
+        self.crs = base_gdf.crs
+        self.topology = build_topology(base_gdf.geometry.values, quantization)
+        simplify_arcs(self.topology, simplify)
+
+        position = pd.Series(np.arange(len(base_gdf)), index=base_gdf[key_col].values)
+        self.position = position[~position.index.duplicated()]
+
+        # Arc references of every base polygon, flattened: the refs of base
+        # polygon i are refs[offsets[i]:offsets[i + 1]]
+        refs = [[ref for polygon in polygons for ring in polygon for ref in ring]
+                for polygons in self.topology.geometries]
+        self.offsets = np.zeros(len(refs) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(r) for r in refs])
+        self.refs = np.fromiter((ref for r in refs for ref in r), dtype=np.int64, count=self.offsets[-1])
+        self.arcs = np.where(self.refs >= 0, self.refs, ~self.refs)
+
+    def executor(self, workers):
+        """
+        Process pool for dissolve(executor=...)
+        Each worker receives the arcs once, when it starts, instead of with every task.
+        """
+        arcs_only = Topology(self.topology.arcs, [], self.topology.transform)
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(arcs_only,))
+
+    def dissolve(self, membership, group_col, executor=None):
+        """
+        Dissolve the base polygons into one geometry per value of group_col
+
+        membership holds (key_col, group_col) pairs, in any order; a base
+        polygon may belong to several groups. Returns a GeoDataFrame with
+        group_col and geometry, one row per group sorted by group_col (like
+        GeoDataFrame.dissolve()), or None if no member is in the base polygons.
+        With an executor (see executor()), groups are stitched into geometries
+        across its workers; the result is the same.
+        """
+        members = membership[[self.key_col, group_col]].dropna().drop_duplicates()
+        members = members[members[self.key_col].isin(self.position.index)]
+        if len(members) == 0:
+            return None
+        # A group's rings start at its first member's arcs: taking members in
+        # key order makes the output the same whatever order they come in
+        members = members.sort_values(self.key_col, kind='stable')
+
+        group_codes, groups = pd.factorize(members[group_col], sort=True)
+        base = self.position.loc[members[self.key_col]].values
+
+        # Every (group, arc reference) occurrence of the groups' members
+        starts = self.offsets[base]
+        counts = self.offsets[base + 1] - starts
+        occurrence = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        group = np.repeat(group_codes, counts)
+        arcs = self.arcs[occurrence]
+
+        # Arcs used once within a group form its outline; arcs used twice are interior borders
+        _, inverse, uses = np.unique(arcs * len(groups) + group, return_inverse=True, return_counts=True)
+        outline = uses[inverse.ravel()] == 1
+
+        refs = self.refs[occurrence][outline]
+        group = group[outline]
+        order = np.argsort(group, kind='stable')
+        bounds = np.searchsorted(group[order], np.arange(len(groups) + 1))
+        refs = refs[order]
+
+        outlines = [refs[bounds[i]:bounds[i + 1]] for i in range(len(groups))]
+
+        if executor is None:
+            geometries = _outline_geometries(outlines, self.topology)
+        else:
+            # Largest groups first so one big group doesn't finish last; map keeps chunk order
+            order = sorted(range(len(outlines)), key=lambda i: -len(outlines[i]))
+            chunk_size = max(1, -(-len(order) // PARALLEL_TASKS))
+            chunks = [order[i:i + chunk_size] for i in range(0, len(order), chunk_size)]
+            results = executor.map(_outline_geometries, [[outlines[i] for i in chunk] for chunk in chunks])
+            geometries = [None] * len(outlines)
+            for chunk, chunk_geometries in zip(chunks, results):
+                for i, geometry in zip(chunk, chunk_geometries):
+                    geometries[i] = geometry
+
+        return gpd.GeoDataFrame({group_col: groups}, geometry=geometries, crs=self.crs)
+
+
+class DissolveCache:
+    """
+    On-disk cache of dissolved geometries, evicting least recently used entries
+
+    A dissolve only depends on the base boundaries and on which base polygon
+    belongs to which group, so an upload with new numbers but the same
+    territories finds its geometries here and needs no dissolving at all.
+    Entries are GeoParquet files named by their key; reading an entry marks it
+    as recently used (its mtime), and the oldest entries are removed once the
+    cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('GEOJSON_DISSOLVE_CACHE_MB', DEFAULT_CACHE_MB)) * 1024 * 1024)
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(membership, group_col, boundary_id, simplify=None, key_col='FIPS'):
+        """
+        Hash of everything a dissolve depends on
+        boundary_id identifies the base boundaries (vintage and stored version).
+        The order of the pairs doesn't count, as dissolve() doesn't depend on it.
+        """
+        pairs = membership[[key_col, group_col]].dropna().drop_duplicates().astype(str)
+        pairs = sorted(zip(pairs[key_col], pairs[group_col]))
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_VERSION}\n{boundary_id}\n{simplify!r}\n{DISSOLVE_QUANTIZATION}\n{group_col}\n".encode())
+        for key, group in pairs:
+            digest.update(f"{key}\t{group}\n".encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.parquet"
+
+    def get(self, key):
+        """Cached GeoDataFrame for a key, or None"""
+        path = self._path(key)
+        try:
+            gdf = gpd.read_parquet(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return gdf
+
+    def put(self, key, gdf):
+        """Store a GeoDataFrame under a key, then evict down to the size limit"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix('.parquet.tmp')
+        gdf.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for path in self.cache_dir.glob('*.parquet'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Enrich a CSV with County / FIPS and the chapter hierarchy
+
+The web app used to do this in the browser, scanning the lookup tables once
+per row (O(rows × lookup entries)). Here lookup_database.json is loaded once
+into hash indexes:
+
+- chapters by ECODE and by chapter name → Chapter, ECODE, Region, RCODE,
+  Division, DCODE
+- counties by FIPS → County, State, and by normalized county name + state
+  ("Worcester County", "Massachusetts" → worcester|ma) → FIPS
+
+and the whole CSV is joined against them at once. Each distinct key is
+normalized and looked up a single time (a national file repeats a few
+thousand counties), then the positions are expanded to the rows. ZIPs
+without a FIPS code are filled from the ZIP index (zip_index.py).
+
+Values already in the CSV are kept; only missing ones are filled.
+lookup_database.json has no county → chapter link, so the chapter hierarchy
+comes from an ECODE or chapter name column, or, if the ZIP hierarchy
+crosswalk the web page uses (zip_to_redcross_comprehensive.csv) is present,
+from the ZIP or county FIPS code.
+
+    python3 scripts/enrich.py your_data.csv --output enriched.csv
+"""
+
+import argparse
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+from column_detector import DATA_DIR, LOOKUP_DATABASE, format_code, to_code
+from csv_ingest import load_typed_csv
+from zip_index import fill_fips
+
+# ZIP_CODE, COUNTY_FIPS, ..., ECODE per ZIP (optional, not in the repository)
+HIERARCHY_CROSSWALK = DATA_DIR / "zip_to_redcross_comprehensive.csv"
+
+# Columns added (or filled) by enrich_dataframe(), in output order
+ENRICH_COLUMNS = ['County', 'State', 'FIPS', 'ECODE', 'Chapter', 'RCODE', 'Region', 'DCODE', 'Division']
+CHAPTER_COLUMNS = ['Chapter', 'ECODE', 'Region', 'RCODE', 'Division', 'DCODE']
+
+# Same suffixes the browser stripped ("Orleans Parish" → "orleans")
+COUNTY_SUFFIX = re.compile(r'\s+(county|parish|borough|municipality|city|census area)$')
+
+STATE_ABBREVIATIONS = {
+    'alabama': 'al', 'alaska': 'ak', 'arizona': 'az', 'arkansas': 'ar', 'california': 'ca',
+    'colorado': 'co', 'connecticut': 'ct', 'delaware': 'de', 'florida': 'fl', 'georgia': 'ga',
+    'hawaii': 'hi', 'idaho': 'id', 'illinois': 'il', 'indiana': 'in', 'iowa': 'ia',
+    'kansas': 'ks', 'kentucky': 'ky', 'louisiana': 'la', 'maine': 'me', 'maryland': 'md',
+    'massachusetts': 'ma', 'michigan': 'mi', 'minnesota': 'mn', 'mississippi': 'ms', 'missouri': 'mo',
+    'montana': 'mt', 'nebraska': 'ne', 'nevada': 'nv', 'new hampshire': 'nh', 'new jersey': 'nj',
+    'new mexico': 'nm', 'new york': 'ny', 'north carolina': 'nc', 'north dakota': 'nd', 'ohio': 'oh',
+    'oklahoma': 'ok', 'oregon': 'or', 'pennsylvania': 'pa', 'rhode island': 'ri', 'south carolina': 'sc',
+    'south dakota': 'sd', 'tennessee': 'tn', 'texas': 'tx', 'utah': 'ut', 'vermont': 'vt',
+    'virginia': 'va', 'washington': 'wa', 'west virginia': 'wv', 'wisconsin': 'wi', 'wyoming': 'wy',
+    'district of columbia': 'dc', 'puerto rico': 'pr', 'guam': 'gu', 'virgin islands': 'vi',
+    'american samoa': 'as', 'northern mariana islands': 'mp'
+}
+
+
+def normalize_county(names):
+    """County names for matching: lowercase, without a County / Parish / ... suffix"""
+    names = pd.Series(names, dtype=object).astype(str).str.strip().str.lower()
+    return names.str.replace(COUNTY_SUFFIX, '', regex=True)
+
+
+def normalize_state(names):
+    """State names or abbreviations for matching, as lowercase abbreviations"""
+    names = pd.Series(names, dtype=object).astype(str).str.strip().str.lower()
+    return names.map(STATE_ABBREVIATIONS).fillna(names)
+
+
+def _distinct(values):
+    """(positions, uniques) of a column's distinct non-missing values (-1 = missing)"""
+    positions, uniques = pd.factorize(pd.Series(values))
+    return positions, pd.Series(np.asarray(uniques, dtype=object))
+
+
+def _code_keys(codes):
+    """UInt32 codes as int64 index keys, -1 (never a key) where missing"""
+    return pd.Series(codes).to_numpy(dtype='int64', na_value=-1)
+
+
+def _text(value):
+    # A code column with gaps is read as floats: 38116.0 → '38116'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _as_category(values):
+    """A column (any mix of numbers and strings) as a categorical of strings"""
+    rows, uniques = _distinct(values)
+    codes, categories = pd.factorize(uniques.map(_text))
+    values = pd.Series(pd.Categorical.from_codes(np.append(codes, -1)[rows], categories), index=values.index)
+    # Sorted categories, as in column_detector.standardize_dataframe()
+    return values.cat.reorder_categories(values.cat.categories.sort_values())
+
+
+def _take(column, positions):
+    """column's values at positions, NA where the position is -1 (not found)"""
+    values = np.append(np.asarray(column, dtype=object), None)
+    return pd.Series(values[positions], dtype=object)
+
+
+class HierarchyLookup:
+    """Hash indexes over lookup_database.json (see the module docstring)"""
+
+    def __init__(self, path=LOOKUP_DATABASE, crosswalk=HIERARCHY_CROSSWALK):
+        self.path = Path(path)
+        with open(path) as f:
+            database = json.load(f)
+
+        chapters = pd.DataFrame(database.get('chapters', []), columns=CHAPTER_COLUMNS)
+        counties = pd.DataFrame(database.get('counties', []), columns=['FIPS', 'County', 'State'])
+        counties = counties.replace('', None)
+
+        # Indexes must be unique to look up positions; the first entry wins
+        self.chapters = chapters.reset_index(drop=True)
+        self.by_ecode = self._index(to_code(chapters['ECODE']))
+        self.by_chapter = self._index(chapters['Chapter'].str.strip().str.lower())
+
+        self.counties = counties.reset_index(drop=True)
+        self.counties['FIPS'] = to_code(counties['FIPS'])
+        self.by_fips = self._index(self.counties['FIPS'])
+        county_state = normalize_county(counties['County']) + '|' + normalize_state(counties['State'])
+        self.by_county_state = self._index(county_state.where(counties['State'].notna()))
+
+        # ECODE by ZIP, and by county (its first ZIP's), from the crosswalk if there is one
+        self.crosswalk_ecodes = pd.Series(dtype='UInt32')
+        self.by_zip = self.by_county = self._index([])
+        if crosswalk is not None and Path(crosswalk).exists():
+            table = pd.read_csv(crosswalk, dtype=str, usecols=['ZIP_CODE', 'COUNTY_FIPS', 'ECODE'])
+            self.crosswalk_ecodes = to_code(table['ECODE'])
+            self.by_zip = self._index(to_code(table['ZIP_CODE']))
+            self.by_county = self._index(to_code(table['COUNTY_FIPS']))
+
+    @staticmethod
+    def _index(keys):
+        """Hash index of keys → row position (missing and repeated keys are left out)"""
+        keys = pd.Series(keys, dtype=object if len(keys) == 0 else None)
+        keep = keys.notna() & ~keys.duplicated()
+        return pd.Series(np.flatnonzero(keep.to_numpy()), index=pd.Index(keys[keep].tolist()))
+
+    @staticmethod
+    def _positions(index, keys):
+        """Row position of each key (-1 if not found or missing)"""
+        if len(index) == 0:
+            return np.full(len(keys), -1)
+        found = index.index.get_indexer(keys)
+        return np.where(found >= 0, index.to_numpy()[found], -1)
+
+    def chapter_positions(self, ecodes=None, names=None, zips=None, fips=None):
+        """
+        Chapter row of each row (-1 if none): by ECODE, then by chapter name,
+        then by ZIP and by county FIPS through the crosswalk, each only where
+        the ones before didn't match
+        """
+        matches = []
+        if ecodes is not None:
+            matches.append(self._positions(self.by_ecode, _code_keys(to_code(ecodes))))
+        if names is not None:
+            matches.append(self._name_positions(names))
+        for codes, index in [(zips, self.by_zip), (fips, self.by_county)]:
+            if codes is not None and len(index):
+                matches.append(self._crosswalk_positions(codes, index))
+
+        positions = matches[0]
+        for found in matches[1:]:
+            positions = np.where(positions >= 0, positions, found)
+        return positions
+
+    def _name_positions(self, names):
+        rows, uniques = _distinct(names)
+        return np.append(self._positions(self.by_chapter, uniques.astype(str).str.strip().str.lower()), -1)[rows]
+
+    def _crosswalk_positions(self, codes, index):
+        ecodes = _take(self.crosswalk_ecodes, self._positions(index, _code_keys(codes)))
+        return self._positions(self.by_ecode, _code_keys(to_code(ecodes)))
+
+    def county_positions(self, fips):
+        """County row of each FIPS code (UInt32)"""
+        return self._positions(self.by_fips, _code_keys(fips))
+
+    def fips_by_name(self, counties, states):
+        """FIPS codes (UInt32) of county names + states, NA where not found"""
+        county_rows, county_names = _distinct(counties)
+        state_rows, state_names = _distinct(states)
+        counties = np.append(normalize_county(county_names).to_numpy(dtype=object), '')
+        states = np.append(normalize_state(state_names).to_numpy(dtype=object), '')
+        # Look up each distinct (county, state) pair once
+        pairs = np.where((county_rows < 0) | (state_rows < 0), -1,
+                         county_rows.astype(np.int64) * (len(state_names) + 1) + state_rows)
+        rows, uniques = pd.factorize(pairs, use_na_sentinel=False)
+        county_of, state_of = np.divmod(uniques, len(state_names) + 1)
+        keys = pd.Series(counties[county_of], dtype=object) + '|' + pd.Series(states[state_of], dtype=object)
+        keys = keys.where(uniques >= 0)
+        positions = self._positions(self.by_county_state, keys)[rows]
+        return to_code(_take(self.counties['FIPS'], positions))
+
+
+_lookup = None
+
+
+def load_lookup(path=LOOKUP_DATABASE):
+    """The hierarchy lookup (built once per process)"""
+    global _lookup
+    if _lookup is None or _lookup.path != Path(path):
+        _lookup = HierarchyLookup(path)
+    return _lookup
+
+
+def _fill(df, column, values):
+    """Fill a column's missing values from values (keeping the ones it has)"""
+    values = pd.Series(values, index=df.index, dtype=object)
+    if column not in df.columns:
+        df[column] = _as_category(values)
+        return int(values.notna().sum())
+    current = df[column].astype(object)
+    missing = current.isna() & values.notna()
+    if missing.any():
+        df[column] = _as_category(current.where(~missing, values))
+    return int(missing.sum())
+
+
+def enrich_dataframe(df, lookup=None):
+    """
+    Fill County, State, FIPS and the chapter hierarchy of a standardized frame, in place
+
+    Works on frames from csv_ingest.load_typed_csv() (Zip / FIPS as UInt32
+    codes); missing columns are added at the end. Returns {column: number of
+    values filled}.
+    """
+    lookup = load_lookup() if lookup is None else lookup
+    filled = {}
+
+    # FIPS: from the county name + state, then from the ZIP index
+    filled['FIPS'] = 0
+    if 'State' in df.columns:
+        missing = df['FIPS'].isna() & df['County'].notna() & df['State'].notna()
+        if missing.any():
+            fips = lookup.fips_by_name(df.loc[missing, 'County'], df.loc[missing, 'State'])
+            df.loc[missing, 'FIPS'] = fips.to_numpy()
+            filled['FIPS'] = int(fips.notna().sum())
+    filled['FIPS'] += fill_fips(df)
+
+    # County / State from the FIPS code
+    counties = lookup.county_positions(df['FIPS'])
+    for column in ['County', 'State']:
+        filled[column] = _fill(df, column, _take(lookup.counties[column], counties))
+
+    # Chapter hierarchy from the ECODE, the chapter name, or the ZIP / county (crosswalk)
+    ecodes = df['ECODE'] if 'ECODE' in df.columns else None
+    chapters = lookup.chapter_positions(ecodes, df['Chapter'], df['Zip'], df['FIPS'])
+    for column in CHAPTER_COLUMNS:
+        filled[column] = _fill(df, column, _take(lookup.chapters[column], chapters))
+
+    return filled
+
+
+def write_enriched_csv(df, output, detection=None):
+    """
+    Write an enriched frame as CSV (ZIP / FIPS as zero-padded strings)
+
+    With the detection from load_typed_csv(), the CSV's own columns come first
+    and the enriched columns it didn't have are appended in ENRICH_COLUMNS
+    order. Written with pyarrow's CSV writer (categoricals as their strings).
+    """
+    columns = list(df.columns)
+    if detection is not None:
+        own = [col for col in columns if col in detection or col not in ENRICH_COLUMNS + ['Zip']]
+        columns = own + [col for col in ENRICH_COLUMNS if col not in own]
+    df = df[columns].copy(deep=False)
+    for col in ['Zip', 'FIPS']:
+        if col in df.columns:
+            df[col] = format_code(df[col])
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.string()))
+    pacsv.write_csv(table, output, pacsv.WriteOptions(quoting_header='none'))
+    return Path(output)
+
+
+def enrich_csv(csv_file, output, lookup=None):
+    """Read, enrich and write a CSV; returns {column: number of values filled}"""
+    df, detection, _, _ = load_typed_csv(csv_file, all_columns=True)
+    filled = enrich_dataframe(df, lookup)
+    write_enriched_csv(df, output, detection)
+    return filled
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add County / FIPS and the chapter hierarchy to a CSV")
+    parser.add_argument('csv_file', help="CSV to enrich")
+    parser.add_argument('--output', help="Enriched CSV to write (default: <name>_enriched.csv)")
+    args = parser.parse_args()
+
+    output = args.output or Path(args.csv_file).with_name(f"{Path(args.csv_file).stem}_enriched.csv")
+    filled = enrich_csv(args.csv_file, output)
+    print(f"✓ Wrote {output}")
+    for column, count in filled.items():
+        print(f"   {column}: {count:,} values filled")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+GeoParquet and FlatGeobuf copies of the level files
+
+A GeoJSON file has to be parsed whole, even to show one county. The level
+builders can also write each level with geometry in two formats that
+readers query by bounding box:
+
+- GeoParquet (1.1): features in Hilbert order, in row groups of
+  ROW_GROUP_SIZE, with a bbox covering column. Its per-row-group min/max
+  statistics let readers (geopandas read_parquet(bbox=...), GDAL, DuckDB)
+  skip the row groups outside their box.
+- FlatGeobuf: a packed Hilbert R-tree ahead of the features, which QGIS,
+  ArcGIS Pro and GDAL use for bbox reads (also over HTTP range requests)
+
+Both keep full coordinates and every property; the output profiles only
+apply to GeoJSON. Levels written without geometry have no copies.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+# Format name → file suffix (the level's GeoJSON file name with this suffix)
+FORMATS = {'geoparquet': '.parquet', 'flatgeobuf': '.fgb'}
+
+# Features per Parquet row group: the granularity of bbox reads
+ROW_GROUP_SIZE = 5000
+
+
+def check_formats(formats):
+    """Raise ValueError for unknown format names, returns them as a list"""
+    formats = list(formats or [])
+    unknown = [name for name in formats if name not in FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown format(s): {', '.join(unknown)} (choose from {', '.join(FORMATS)})")
+    return formats
+
+
+def format_path(level_file, name):
+    """Where a level file's copy in a format is written"""
+    return Path(level_file).with_suffix(FORMATS[name])
+
+
+def hilbert_order(gdf):
+    """Rows sorted along a Hilbert curve (features near each other end up in the same row groups)"""
+    missing = (gdf.geometry.isna() | gdf.geometry.is_empty).to_numpy()
+    located = np.flatnonzero(~missing)
+    distance = gdf.geometry.iloc[located].hilbert_distance().to_numpy() if len(located) else located
+    order = np.r_[located[np.argsort(distance, kind='stable')], np.flatnonzero(missing)]
+    return gdf.iloc[order]
+
+
+def write_geoparquet(gdf, path, row_group_size=ROW_GROUP_SIZE):
+    """Write a GeoDataFrame as GeoParquet with bbox statistics per row group"""
+    hilbert_order(gdf).to_parquet(path, index=False, compression='zstd', schema_version='1.1.0',
+                                  write_covering_bbox=True, row_group_size=row_group_size)
+
+
+def write_flatgeobuf(gdf, path):
+    """
+    Write a GeoDataFrame as FlatGeobuf with its packed R-tree, returns the
+    number of features left out (the index can't hold missing geometries)
+    """
+    located = gdf.geometry.notna() & ~gdf.geometry.is_empty
+    gdf[located].to_file(path, driver='FlatGeobuf', engine='pyogrio', SPATIAL_INDEX='YES')
+    return int((~located).sum())
+
+
+def write_formats(gdf, level_file, formats):
+    """
+    Write a level's copies in formats next to its GeoJSON file
+    gdf is the level output; without geometry (a plain DataFrame) any copies
+    left from an earlier build are removed instead. Returns {name: path}.
+    """
+    import geopandas as gpd
+
+    written = {}
+    for name in formats:
+        path = format_path(level_file, name)
+        if not isinstance(gdf, gpd.GeoDataFrame):
+            path.unlink(missing_ok=True)
+            continue
+        if name == 'geoparquet':
+            write_geoparquet(gdf, path)
+        else:
+            skipped = write_flatgeobuf(gdf, path)
+            if skipped:
+                print(f"   ⚠ {path.name}: {skipped:,} features without geometry left out")
+        written[name] = path
+    return written
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Point-in-polygon geocoding of latitude / longitude rows
+
+Donor and event exports often have only coordinates, no ZIP or FIPS column.
+Each point is located in the boundaries of the boundary store: the ZCTA it
+falls in becomes its ZIP code, the county its FIPS code, and the levels are
+then built from those as from any other CSV.
+
+A PolygonIndex holds a layer's polygons in an STRtree and prepared for
+point tests. Points are located in batches, each with two vectorized calls:
+
+- one STRtree query for the polygons whose bounding box holds each point
+- one shapely.intersects_xy over all (point, candidate) pairs
+
+so no Python runs per point. Identical coordinates (many rows at the same
+address) are located once. A point on a shared border belongs to the polygon
+that comes first in the layer.
+
+    python3 scripts/geocode.py points.csv
+    python3 scripts/geocode.py points.csv --lat Y --lon X --output located.csv
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+
+SCRIPTS_DIR = Path(__file__).parent
+sys.path.insert(0, str(SCRIPTS_DIR))
+
+from column_detector import detect_columns, format_code, to_code
+
+# Points per vectorized query; bounds the (point, candidate) pair arrays
+BATCH_POINTS = 250_000
+
+
+class PolygonIndex:
+    """A boundary layer's polygons, indexed to locate points in (keys are UInt32 codes)"""
+
+    def __init__(self, gdf, key_col):
+        gdf = gdf[gdf.geometry.notna()]
+        self.geometries = np.asarray(gdf.geometry.values, dtype=object)
+        # Polygon keys as int64, -1 where a polygon's key isn't a valid code
+        self.keys = to_code(gdf[key_col]).astype('Int64').fillna(-1).to_numpy(dtype='int64')
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def locate(self, lon, lat, batch_size=BATCH_POINTS):
+        """
+        Position of the polygon each point falls in (-1 if none), for arrays of
+        longitudes and latitudes (EPSG:4326)
+        """
+        lon = np.asarray(lon, dtype='float64')
+        lat = np.asarray(lat, dtype='float64')
+        found = np.full(len(lon), -1, dtype=np.int64)
+        for start in range(0, len(lon), batch_size):
+            x, y = lon[start:start + batch_size], lat[start:start + batch_size]
+            points, candidates = self.tree.query(shapely.points(x, y))
+            hit = shapely.intersects_xy(self.geometries[candidates], x[points], y[points])
+            points, candidates = points[hit], candidates[hit]
+            # Keep the first polygon of each point (candidates are not in layer order)
+            order = np.lexsort((candidates, points))
+            points, candidates = points[order], candidates[order]
+            first = np.r_[True, points[1:] != points[:-1]]
+            found[start + points[first]] = candidates[first]
+        return found
+
+    def lookup(self, lon, lat, batch_size=BATCH_POINTS):
+        """Key of the polygon each point falls in, as int64 codes (-1 if none)"""
+        found = self.locate(lon, lat, batch_size)
+        return np.where(found >= 0, self.keys[found], -1)
+
+
+def coordinate_pairs(df, lat_col='Latitude', lon_col='Longitude'):
+    """
+    Rows with usable coordinates, and their distinct (lon, lat) pairs
+    Returns (rows, lon, lat, inverse) where inverse maps each of those rows to
+    its pair.
+    """
+    lat = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    lon = pd.to_numeric(df[lon_col], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    rows = np.flatnonzero((np.abs(lat) <= 90) & (np.abs(lon) <= 180))
+    # One complex number per point, so pairs are hashed rather than sorted
+    inverse, pairs = pd.factorize(lon[rows] + 1j * lat[rows])
+    return rows, pairs.real, pairs.imag, inverse
+
+
+def geocode_points(df, counties_gdf=None, zips_gdf=None, lat_col='Latitude', lon_col='Longitude'):
+    """
+    Fill missing Zip / FIPS codes from coordinates, in place
+
+    Works on standardized frames (Zip / FIPS as UInt32 codes); rows that
+    already have a code keep it. counties_gdf / zips_gdf are boundary layers
+    with FIPS / ZIP_CODE columns in EPSG:4326 (either may be None).
+    Returns {'points': rows with coordinates, 'FIPS': filled, 'Zip': filled}.
+    """
+    counts = {'points': 0, 'FIPS': 0, 'Zip': 0}
+    if lat_col not in df.columns or lon_col not in df.columns:
+        return counts
+    rows, lon, lat, inverse = coordinate_pairs(df, lat_col, lon_col)
+    counts['points'] = len(rows)
+
+    for column, gdf, key_col in [('FIPS', counties_gdf, 'FIPS'), ('Zip', zips_gdf, 'ZIP_CODE')]:
+        if gdf is None or len(rows) == 0:
+            continue
+        missing = df[column].isna().to_numpy()[rows]
+        if not missing.any():
+            continue
+        # Locate only the pairs some row still needs
+        needed = np.zeros(len(lon), dtype=bool)
+        needed[inverse[missing]] = True
+        needed = np.flatnonzero(needed)
+        codes = np.full(len(lon), -1, dtype=np.int64)
+        codes[needed] = PolygonIndex(gdf, key_col).lookup(lon[needed], lat[needed])
+
+        targets = rows[missing]
+        values = codes[inverse[missing]]
+        located = values >= 0
+        column_values = df[column].array.copy()
+        column_values[targets[located]] = values[located].astype(np.uint32)
+        df[column] = column_values
+        counts[column] = int(located.sum())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign the ZCTA and county of each latitude / longitude row")
+    parser.add_argument('csv', help="CSV with latitude and longitude columns")
+    parser.add_argument('--lat', default=None, help="Latitude column (default: detected from the header)")
+    parser.add_argument('--lon', default=None, help="Longitude column (default: detected from the header)")
+    parser.add_argument('--output', default=None, help="CSV to write (default: <csv>_geocoded.csv)")
+    parser.add_argument('--cache-dir', default=None, help="Boundary store directory (see boundary_store.py)")
+    parser.add_argument('--offline', action='store_true', default=None, help="Only use boundaries already in the store")
+    args = parser.parse_args()
+
+    from create_geojson_levels import load_point_boundaries
+
+    df = pd.read_csv(args.csv, dtype=str)
+    detected = detect_columns(df.head(0))
+    lat_col = args.lat or detected.get('Latitude')
+    lon_col = args.lon or detected.get('Longitude')
+    if lat_col is None or lon_col is None:
+        parser.error("No latitude / longitude columns found (use --lat / --lon)")
+    df['Zip'] = to_code(df['Zip']) if 'Zip' in df.columns else pd.Series(pd.NA, index=df.index, dtype='UInt32')
+    df['FIPS'] = to_code(df['FIPS']) if 'FIPS' in df.columns else pd.Series(pd.NA, index=df.index, dtype='UInt32')
+
+    counties_gdf, zips_gdf = load_point_boundaries(args.cache_dir, args.offline, zips=True)
+    start = time.perf_counter()
+    counts = geocode_points(df, counties_gdf, zips_gdf, lat_col, lon_col)
+    seconds = time.perf_counter() - start
+
+    output = Path(args.output) if args.output else Path(args.csv).with_name(f"{Path(args.csv).stem}_geocoded.csv")
+    df.assign(Zip=format_code(df['Zip']), FIPS=format_code(df['FIPS'])).to_csv(output, index=False)
+    print(f"✓ {counts['points']:,} points: {counts['FIPS']:,} counties, {counts['Zip']:,} ZIP codes "
+          f"in {seconds:.2f}s")
+    print(f"✓ Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
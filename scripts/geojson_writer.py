@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Streaming GeoJSON writer shared by the pipeline scripts
+
+Features are written in chunks straight from the (Geo)DataFrame, so only one
+chunk is ever held as JSON in memory, instead of building the whole
+FeatureCollection as a string, then as dicts, then as indented text.
+
+Output profiles trade fidelity for size:
+- archival: full float64 coordinates, indented, null properties kept, bbox
+- web:      6 decimal places (~0.1 m), compact, null properties kept, bbox
+- compact:  5 decimal places (~1 m), compact, null properties dropped, no bbox
+
+The boundaries are simplified to 0.0005-0.001 degrees (~50-100 m), so even
+the compact profile's rounding is far below what simplification already removed.
+"""
+
+import json
+import math
+import os
+import re
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import shapely
+
+CHUNK_SIZE = 2000
+
+# Rows per block of geometry-less features (their text is built a column at a time)
+ATTRIBUTE_CHUNK_SIZE = 50_000
+
+# precision: decimal places kept in coordinates (None = full precision)
+# pretty: indented output, drop_nulls: leave null properties out,
+# bbox: write RFC 7946 bbox members on each feature and the collection
+PROFILES = {
+    'archival': {'precision': None, 'pretty': True, 'drop_nulls': False, 'bbox': True},
+    'web': {'precision': 6, 'pretty': False, 'drop_nulls': False, 'bbox': True},
+    'compact': {'precision': 5, 'pretty': False, 'drop_nulls': True, 'bbox': False}
+}
+DEFAULT_PROFILE = 'archival'
+
+# What comes between two features, and how each feature's id starts (string
+# values can't contain either: JSON escapes their quotes and newlines)
+FEATURE_SEPARATOR = b',\n'
+FEATURE_ID_PRETTY = re.compile(rb'(\n      "type": "Feature",\n      "id": ")(\d+)"')
+FEATURE_ID_COMPACT = re.compile(rb'(\{"type":"Feature","id":")(\d+)"')
+
+
+def get_profile(profile):
+    """Look up a profile by name (a settings dict is passed through)"""
+    if isinstance(profile, dict):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown output profile: {profile} (choose from {', '.join(PROFILES)})")
+    return PROFILES[profile]
+
+
+def clean_value(value):
+    """Map values JSON can't hold (NaN, NA, numpy scalars) to plain Python"""
+    if value is None or value is pd.NA or value is pd.NaT:
+        return None
+    if hasattr(value, 'item'):
+        # numpy scalar
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _json_default(value):
+    """Fallback for values json can't serialize (timestamps, decimals, ...)"""
+    return str(value)
+
+
+class FeatureStreamWriter:
+    """
+    Writes a FeatureCollection one feature at a time
+
+        with FeatureStreamWriter(path, pretty=True) as writer:
+            writer.write_feature(properties, geometry_json)
+
+    With bbox=True, the collection bbox is grown from the feature bboxes
+    and written after the features. spans, if a list, receives the
+    (byte offset, byte length, bbox) of every feature written, so a later run
+    can copy unchanged features from the file (see write_feature_text()).
+    """
+
+    def __init__(self, path, pretty=False, bbox=False, spans=None):
+        self.path = path
+        self.pretty = pretty
+        self.bbox = bbox
+        self.spans = spans
+        self.count = 0
+        self._bounds = None
+        self._file = None
+        self._offset = 0
+
+    def _write(self, text):
+        data = text.encode('utf-8') if isinstance(text, str) else text
+        self._file.write(data)
+        self._offset += len(data)
+
+    def __enter__(self):
+        self._file = open(self.path, 'wb')
+        if self.pretty:
+            self._write('{\n  "type": "FeatureCollection",\n  "features": [')
+        else:
+            self._write('{"type":"FeatureCollection","features":[')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        bbox_text = ''
+        if self.bbox and self._bounds is not None:
+            bbox_text = json.dumps(self._bounds) if self.pretty else json.dumps(self._bounds, separators=(',', ':'))
+
+        if self.pretty:
+            self._write('\n  ]' if self.count else ']')
+            self._write(f',\n  "bbox": {bbox_text}\n}}\n' if bbox_text else '\n}\n')
+        else:
+            self._write(f'],"bbox":{bbox_text}}}\n' if bbox_text else ']}\n')
+        self._file.close()
+        return False
+
+    def _grow_bounds(self, bbox):
+        if self._bounds is None:
+            self._bounds = list(bbox)
+        else:
+            self._bounds = [min(self._bounds[0], bbox[0]), min(self._bounds[1], bbox[1]),
+                            max(self._bounds[2], bbox[2]), max(self._bounds[3], bbox[3])]
+
+    def _write_separator(self):
+        if self.pretty:
+            self._write(b'\n' if self.count == 0 else FEATURE_SEPARATOR)
+        elif self.count:
+            self._write(FEATURE_SEPARATOR)
+
+    def write_feature_text(self, text, bbox=None):
+        """Write one feature already encoded (bytes, as written by write_feature()), with its bbox"""
+        if self.bbox and bbox is not None:
+            self._grow_bounds(bbox)
+        self._write_separator()
+        if self.spans is not None:
+            self.spans.append((self._offset, len(text), bbox if self.bbox else None))
+        self._write(text)
+        self.count += 1
+
+    def write_features_text(self, text, lengths, bboxes=None):
+        """
+        Write a run of features already encoded, as one block of bytes: features
+        of the given byte lengths, separated as this writer separates them.
+        bboxes is an (n, 4) array of their bboxes (NaN rows where none).
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if not len(lengths):
+            return
+        if self.bbox and bboxes is not None:
+            known = bboxes[~np.isnan(bboxes[:, 0])]
+            if len(known):
+                self._grow_bounds(known[:, :2].min(axis=0).tolist() + known[:, 2:].max(axis=0).tolist())
+        self._write_separator()
+        if self.spans is not None:
+            starts = self._offset + np.r_[0, np.cumsum(lengths[:-1] + len(FEATURE_SEPARATOR))]
+            boxes = bboxes.tolist() if self.bbox and bboxes is not None else [None] * len(lengths)
+            self.spans.extend(zip(starts.tolist(), lengths.tolist(), boxes))
+        self._write(text)
+        self.count += len(lengths)
+
+    def write_feature(self, properties, geometry_json=None, feature_id=None, bbox=None):
+        """
+        Write one feature
+        geometry_json is the geometry already encoded as a GeoJSON string (or None),
+        bbox is [minx, miny, maxx, maxy] (only written if the writer has bbox=True)
+        """
+        geometry_text = geometry_json if geometry_json else 'null'
+
+        bbox = bbox if self.bbox else None
+
+        if self.pretty:
+            # Indent the feature and its properties, but keep the geometry on
+            # one line: indenting every coordinate is slow and mostly whitespace
+            properties_text = json.dumps(properties, indent=2, default=_json_default).replace('\n', '\n      ')
+            lines = ['    {', '      "type": "Feature",']
+            if feature_id is not None:
+                lines.append(f'      "id": {json.dumps(feature_id)},')
+            if bbox is not None:
+                lines.append(f'      "bbox": {json.dumps(bbox)},')
+            lines.append(f'      "properties": {properties_text},')
+            lines.append(f'      "geometry": {geometry_text}')
+            lines.append('    }')
+            text = '\n'.join(lines)
+        else:
+            # Splice the geometry string in rather than re-encoding it
+            feature = {"type": "Feature"}
+            if feature_id is not None:
+                feature["id"] = feature_id
+            if bbox is not None:
+                feature["bbox"] = bbox
+            feature["properties"] = properties
+            text = json.dumps(feature, separators=(',', ':'), default=_json_default)
+            text = text[:-1] + ',"geometry":' + geometry_text + '}'
+
+        self.write_feature_text(text.encode('utf-8'), bbox)
+
+
+def feature_geometry_text(text, pretty=False):
+    """The geometry JSON of a feature written by FeatureStreamWriter (bytes in, str out)"""
+    marker = b'"geometry": ' if pretty else b'"geometry":'
+    start = text.rindex(marker) + len(marker)
+    end = len(text) - (len(b'\n    }') if pretty else 1)
+    return text[start:end].decode('utf-8')
+
+
+def relabel_features(text, shift, pretty=False):
+    """
+    Features written by FeatureStreamWriter (bytes, one or a run of them) with
+    their numeric ids lowered by shift. Returns (text, byte length change of
+    each feature).
+    """
+    pattern = FEATURE_ID_PRETTY if pretty else FEATURE_ID_COMPACT
+    ids = []
+
+    def shifted(match):
+        ids.append(int(match.group(2)))
+        return match.group(1) + str(ids[-1] - shift).encode('ascii') + b'"'
+
+    text = pattern.sub(shifted, text)
+    ids = np.array(ids, dtype=np.int64)
+    return text, _digits(ids - shift) - _digits(ids)
+
+
+def _digits(values):
+    """Number of decimal digits of non-negative integers"""
+    return np.searchsorted(10 ** np.arange(1, 19, dtype=np.int64), values, side='right') + 1
+
+
+def round_coordinates(geometries, precision):
+    """Round coordinates to a number of decimal places, dropping repeated points"""
+    rounded = shapely.transform(geometries, lambda coords: np.round(coords, precision))
+    return shapely.remove_repeated_points(rounded)
+
+
+def encode_geometries(geometries, settings):
+    """
+    GeoJSON text of each geometry (rounded per the profile settings), and
+    each one's bbox (None where empty, or all None if the profile has no bbox)
+    """
+    if settings['precision'] is not None:
+        geometries = round_coordinates(geometries, settings['precision'])
+    geometry_json = shapely.to_geojson(geometries)
+    if not settings['bbox']:
+        return geometry_json, [None] * len(geometry_json)
+    bounds = shapely.bounds(geometries)
+    return geometry_json, [None if np.isnan(b[0]) else b.tolist() for b in bounds]
+
+
+def clean_properties(properties, settings):
+    """A feature's properties as written: JSON-safe values, nulls dropped if the profile says so"""
+    properties = {key: clean_value(value) for key, value in properties.items()}
+    if settings['drop_nulls']:
+        properties = {key: value for key, value in properties.items() if value is not None}
+    return properties
+
+
+def write_geojson(gdf, path, profile=DEFAULT_PROFILE, chunk_size=CHUNK_SIZE, spans=None):
+    """
+    Stream a GeoDataFrame to a GeoJSON file using an output profile
+    Null property values are written as null (like GeoDataFrame.to_json())
+    unless the profile drops them. spans, if a list, receives each feature's
+    (byte offset, byte length, bbox). Returns the number of features written.
+    """
+    settings = get_profile(profile)
+
+    geometry_name = gdf.geometry.name
+    property_cols = [col for col in gdf.columns if col != geometry_name]
+
+    with FeatureStreamWriter(path, pretty=settings['pretty'], bbox=settings['bbox'], spans=spans) as writer:
+        for start in range(0, len(gdf), chunk_size):
+            chunk = gdf.iloc[start:start + chunk_size]
+            geometry_json, bboxes = encode_geometries(chunk.geometry.values.to_numpy(), settings)
+            records = chunk[property_cols].to_dict('records')
+
+            for index, properties, geometry, bbox in zip(chunk.index, records, geometry_json, bboxes):
+                writer.write_feature(clean_properties(properties, settings), geometry,
+                                     feature_id=str(index), bbox=bbox)
+
+    return writer.count
+
+
+def _json_column(values):
+    """
+    The JSON text of every value of a column (object array, as json.dumps would
+    write it), and a mask of its nulls. Columns are encoded a whole array at a
+    time: floats by repr, anything else once per distinct value.
+    """
+    if values.dtype.kind == 'f':
+        array = values.to_numpy(dtype='float64', na_value=np.nan)
+        text = np.array(list(map(float.__repr__, array.tolist())), dtype=object)
+        text[np.isposinf(array)] = 'Infinity'
+        text[np.isneginf(array)] = '-Infinity'
+        return text, np.isnan(array)
+    codes, uniques = pd.factorize(values)
+    distinct = [json.dumps(clean_value(value), default=_json_default) for value in np.asarray(uniques, dtype=object)]
+    return np.array(distinct + [''], dtype=object)[codes], codes < 0
+
+
+def attribute_features(df, pretty=False):
+    """
+    The text of a geometry-less feature for every row of a DataFrame, null
+    values left out of its properties: the same text FeatureStreamWriter
+    writes for each row's dict, built column by column instead of row by row
+    """
+    # Key text as json.dumps writes dict keys (non-string keys are quoted)
+    parts = []
+    for col in df.columns:
+        key = json.dumps(col if isinstance(col, str) else json.dumps(col))
+        text, null = _json_column(df[col])
+        prefix = f',\n        {key}: ' if pretty else f',{key}:'
+        parts.append(np.where(null, '', prefix + text))
+    rows = [''.join(row) for row in zip(*parts)] if parts else [''] * len(df)
+
+    # Each row's text starts with a separator, dropped here
+    if pretty:
+        head = '    {\n      "type": "Feature",\n      "properties": '
+        tail = ',\n      "geometry": null\n    }'
+        return [head + ('{' + row[1:] + '\n      }' if row else '{}') + tail for row in rows]
+    return ['{"type":"Feature","properties":{' + row[1:] + '},"geometry":null}' for row in rows]
+
+
+def write_geojson_without_geometry(df, path, profile=DEFAULT_PROFILE, chunk_size=ATTRIBUTE_CHUNK_SIZE):
+    """
+    Stream a DataFrame as a GeoJSON FeatureCollection with null geometries
+    Null values are left out of each feature's properties. Features are built
+    a chunk of rows at a time (see attribute_features()) and written as one
+    block per chunk. Returns the number of features written.
+    """
+    settings = get_profile(profile)
+    with FeatureStreamWriter(path, pretty=settings['pretty']) as writer:
+        for start in range(0, len(df), chunk_size):
+            features = attribute_features(df.iloc[start:start + chunk_size], settings['pretty'])
+            # JSON text is ASCII (json.dumps escapes the rest), so lengths are byte lengths
+            writer.write_features_text(FEATURE_SEPARATOR.decode('ascii').join(features).encode('ascii'),
+                                       list(map(len, features)))
+
+    return writer.count
+
+
+def compare_profiles(gdf, profiles=None):
+    """
+    Write a GeoDataFrame with each profile and measure the result
+    Returns a list of {'profile', 'size', 'seconds'} dicts (size in bytes).
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in profiles or list(PROFILES):
+            path = os.path.join(temp_dir, f"{name}.geojson")
+            start = time.perf_counter()
+            write_geojson(gdf, path, profile=name)
+            seconds = time.perf_counter() - start
+            results.append({'profile': name, 'size': os.path.getsize(path), 'seconds': seconds})
+            os.remove(path)
+    return results
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Incremental rebuilds: patch the previous run's outputs instead of rebuilding them
+
+The Biomed CSV is re-uploaded often with only a few ZIPs' numbers changed.
+A build with incremental=True (see create_geojson_levels.build_levels) keeps
+what it computed in <output_dir>/.incremental/:
+
+- each level's aggregates, and a signature of each group's rows
+- each dissolved group's geometry, and a hash of the counties it is made of
+- where every feature of each level file sits (byte offset and length), a
+  hash of its properties and its bbox
+
+The next incremental build into the same directory diffs the new CSV against
+that state:
+
+1. every row is hashed; a group's signature is a hash of its rows in order,
+   so only groups whose signature changed can have a different aggregate
+2. only the rows of those groups are aggregated again, and spliced into the
+   previous aggregates
+3. only groups whose counties changed are dissolved again
+4. each level file is rewritten from the previous one: unchanged features
+   are copied as bytes, features with new properties keep their geometry
+   text, and only new geometries are encoded (a file with no change at all is
+   left as it is)
+
+so a small update costs about a CSV read plus a copy of each changed file,
+and the files are the same as a full build would write. The state is only
+used when everything else is unchanged (levels, profile, CSV columns and
+types, stored boundaries); otherwise the build runs in full and writes a
+new state.
+"""
+
+import json
+import mmap
+import os
+import shutil
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from column_detector import CODE_COLUMNS, format_code
+from geojson_writer import (FeatureStreamWriter, clean_properties, encode_geometries, feature_geometry_text,
+                            get_profile, relabel_features)
+
+STATE_DIR = '.incremental'
+STATE_VERSION = 2
+
+# Mixes a row's position within its group into its hash (any odd 64-bit constant)
+RANK_SALT = np.uint64(0x9E3779B97F4A7C15)
+
+
+def key_text(values):
+    """Group keys as text (ZIP / FIPS codes zero-padded), the form they are compared and stored in"""
+    values = pd.Series(values)
+    if values.name in CODE_COLUMNS:
+        return format_code(values).astype('string')
+    return values.astype('string')
+
+
+def row_hashes(df):
+    """One 64-bit hash of every row's values"""
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+def _factorize(values):
+    """Codes of a key column (-1 where missing), and its distinct keys as text"""
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    return codes, key_text(pd.Series(uniques, name=values.name)).to_numpy(dtype=object)
+
+
+def key_mask(values, keys):
+    """True for the rows of a key column whose key (as key_text()) is in keys"""
+    codes, uniques = _factorize(values)
+    return np.r_[pd.Index(uniques).isin(list(keys)), False][codes]
+
+
+def group_hashes(values, hashes, ordered=True):
+    """
+    Combine the hashes of each group's rows into one (uint64 Series by key)
+    values is the key column. With ordered, a row's position within its
+    group counts too, so rows swapping places change the group's hash;
+    otherwise it is a hash of the set of rows. Rows without a key belong to
+    no group.
+    """
+    codes, uniques = _factorize(values)
+    keyed = codes >= 0
+    codes, values = codes[keyed], hashes[keyed]
+    if ordered:
+        rank = pd.Series(codes).groupby(codes).cumcount().to_numpy()
+        values = values ^ (rank.astype(np.uint64) * RANK_SALT)
+    combined = np.zeros(len(uniques), dtype=np.uint64)
+    np.bitwise_xor.at(combined, codes, pd.util.hash_array(values))
+    return pd.Series(combined, index=pd.Index(uniques), dtype='uint64')
+
+
+def changed_keys(previous, current):
+    """Keys whose hash differs between two group_hashes() Series, or that only one of them has"""
+    positions = previous.index.get_indexer(current.index)
+    same = positions >= 0
+    same[same] = previous.to_numpy()[positions[same]] == current.to_numpy()[same]
+    return set(current.index[~same]) | set(previous.index.difference(current.index))
+
+
+def patch_frame(previous, fresh, key_col, replaced, dtypes):
+    """
+    previous with the rows of the replaced keys swapped for fresh's rows
+
+    Categorical columns are cast to dtypes (the new CSV's), so the result
+    sorts by key and holds values as a build from scratch would.
+    """
+    keep = previous[~key_mask(previous[key_col], replaced)]
+    frames = [frame.astype({col: dtypes[col] for col in frame.columns
+                            if col in dtypes and isinstance(dtypes[col], pd.CategoricalDtype)})
+              for frame in [keep, fresh] if frame is not None and len(frame)]
+    if not frames:
+        return previous.iloc[:0]
+    patched = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    return patched.sort_values(key_col, kind='stable').reset_index(drop=True)
+
+
+def feature_table(keys, properties, geometry, spans):
+    """A level file's features for the state: key, property hash, geometry token, span and bbox"""
+    table = pd.DataFrame({
+        'key': pd.Series(keys, dtype='string').to_numpy(),
+        'properties': pd.util.hash_pandas_object(properties, index=False).to_numpy(),
+        'geometry': np.asarray(geometry, dtype=np.uint64),
+        'offset': np.array([span[0] for span in spans], dtype=np.int64),
+        'length': np.array([span[1] for span in spans], dtype=np.int64)
+    })
+    bboxes = np.array([span[2] if span[2] is not None else [np.nan] * 4 for span in spans],
+                      dtype='float64').reshape(len(spans), 4)
+    for i, col in enumerate(['minx', 'miny', 'maxx', 'maxy']):
+        table[col] = bboxes[:, i]
+    return table
+
+
+def occurrence_keys(keys):
+    """Keys made unique by their occurrence ('02134', '02134#1', ...) for levels with one feature per row"""
+    keys = pd.Series(keys, dtype='string').reset_index(drop=True)
+    occurrence = keys.groupby(keys, dropna=False).cumcount()
+    return keys.where(occurrence == 0, keys + '#' + occurrence.astype('string'))
+
+
+def patch_geojson(path, previous, keys, properties, geometry, encode, profile):
+    """
+    Rewrite a level file from its previous version
+
+    previous is the file's feature table (see feature_table()), or None if
+    there is none to reuse. keys / properties / geometry (tokens) describe the
+    new features in order; a feature whose key and geometry token match a
+    previous one reuses its geometry text, and its whole text if the
+    properties match too. encode(positions) returns the geometries of the
+    other features. Returns (feature table, counts): counts of features
+    'copied', written with new 'properties' and 'encoded', or None if the
+    file was left as it is.
+    """
+    settings = get_profile(profile)
+    keys = pd.Series(keys, dtype='string').to_numpy()
+    geometry = np.asarray(geometry, dtype=np.uint64)
+    property_hashes = pd.util.hash_pandas_object(properties, index=False).to_numpy()
+
+    if previous is not None:
+        matched = pd.Index(previous['key']).get_indexer(keys)
+        found = matched >= 0
+        same_geometry = found & (previous['geometry'].to_numpy()[np.maximum(matched, 0)] == geometry)
+        same = same_geometry & (previous['properties'].to_numpy()[np.maximum(matched, 0)] == property_hashes)
+    else:
+        matched = np.full(len(keys), -1)
+        same_geometry = same = np.zeros(len(keys), dtype=bool)
+
+    if previous is not None and len(previous) == len(keys) and same.all() and (matched == np.arange(len(keys))).all():
+        # Nothing changed: the previous file stands
+        return previous, None
+
+    fresh = np.flatnonzero(~same_geometry)
+    fresh_geometry = dict(zip(fresh, zip(*encode_geometries(encode(fresh), settings)))) if len(fresh) else {}
+    rewritten = np.flatnonzero(~same)
+    records = dict(zip(rewritten, properties.iloc[rewritten].to_dict('records')))
+
+    # Runs of unchanged features, consecutive in the previous file too, are
+    # copied as one block (ids shifted if the run moved)
+    shift = matched - np.arange(len(keys))
+    continues = np.r_[same[1:] & same[:-1] & (shift[1:] == shift[:-1]), False]
+    run_ends = np.flatnonzero(same & ~continues) + 1
+    run_starts = np.flatnonzero(same & ~np.r_[False, continues[:-1]])
+
+    if previous is not None:
+        offsets = previous['offset'].to_numpy()
+        lengths = previous['length'].to_numpy()
+        bboxes = previous[['minx', 'miny', 'maxx', 'maxy']].to_numpy()
+
+    spans = []
+    tmp_path = Path(path).with_suffix('.geojson.tmp')
+    with open(path, 'rb') if previous is not None else nullcontext() as source:
+        old = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) if source is not None else None
+        with FeatureStreamWriter(tmp_path, pretty=settings['pretty'], bbox=settings['bbox'], spans=spans) as writer:
+            position = 0
+            for run_start, run_end in zip([*run_starts, len(keys)], [*run_ends, len(keys)]):
+                for i in range(position, run_start):
+                    if same_geometry[i]:
+                        j = matched[i]
+                        text = old[offsets[j]:offsets[j] + lengths[j]]
+                        bbox = None if np.isnan(bboxes[j][0]) else bboxes[j].tolist()
+                        writer.write_feature(clean_properties(records[i], settings),
+                                             feature_geometry_text(text, settings['pretty']),
+                                             feature_id=str(i), bbox=bbox)
+                    else:
+                        geometry_json, bbox = fresh_geometry[i]
+                        writer.write_feature(clean_properties(records[i], settings), geometry_json,
+                                             feature_id=str(i), bbox=bbox)
+                if run_start < run_end:
+                    first, last = matched[run_start], matched[run_end - 1]
+                    text = old[offsets[first]:offsets[last] + lengths[last]]
+                    run_lengths = lengths[first:last + 1]
+                    if shift[run_start]:
+                        text, growth = relabel_features(text, shift[run_start], settings['pretty'])
+                        run_lengths = run_lengths + growth
+                    writer.write_features_text(text, run_lengths, bboxes[first:last + 1])
+                position = run_end
+        if old is not None:
+            old.close()
+    os.replace(tmp_path, path)
+    counts = {'copied': int(same.sum()), 'properties': int((same_geometry & ~same).sum()), 'encoded': len(fresh)}
+    return feature_table(keys, properties, geometry, spans), counts
+
+
+def file_id(path):
+    """Size and mtime of a file, [] if it doesn't exist (state compares them as JSON)"""
+    try:
+        stat = Path(path).stat()
+    except OSError:
+        return []
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class IncrementalState:
+    """
+    The state a build left in <output_dir>/.incremental/
+
+    state.json holds the build settings and the level files as written;
+    every table (aggregates, signatures, dissolved geometries, feature
+    tables) is a Parquet file next to it.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = Path(output_dir)
+        self.path = self.output_dir / STATE_DIR
+        try:
+            self.info = json.loads((self.path / 'state.json').read_text())
+        except (OSError, ValueError):
+            self.info = None
+        if self.info is not None and self.info.get('version') != STATE_VERSION:
+            self.info = None
+
+    def matches(self, settings):
+        """True if there is a state, from a build with the same settings"""
+        return self.info is not None and self.info['settings'] == settings
+
+    def table(self, name):
+        """A stored table (GeoDataFrame for dissolved geometry), None if missing"""
+        path = self.path / f"{name}.parquet"
+        if not path.exists():
+            return None
+        if name.startswith('dissolved_'):
+            import geopandas as gpd
+            return gpd.read_parquet(path)
+        return pd.read_parquet(path)
+
+    def hashes(self, name):
+        """A stored group_hashes() Series, None if missing"""
+        table = self.table(name)
+        if table is None:
+            return None
+        return pd.Series(table['hash'].to_numpy(), index=pd.Index(table['key'].astype(object)), dtype='uint64')
+
+    def features(self, level):
+        """The feature table of a level file, None if the file isn't the one the state describes"""
+        written = (self.info or {}).get('files', {}).get(level)
+        if written is None or file_id(self.output_dir / written['file']) != written['id']:
+            return None
+        return self.table(f"features_{level}")
+
+    def save(self, settings, tables, files, extra=None):
+        """
+        Replace the state: tables maps names to (Geo)DataFrames or group_hashes()
+        Series, files maps levels to the files their feature tables describe
+        """
+        new_path = self.path.with_name(STATE_DIR + '.new')
+        shutil.rmtree(new_path, ignore_errors=True)
+        new_path.mkdir(parents=True)
+        for name, table in tables.items():
+            if isinstance(table, pd.Series):
+                table = pd.DataFrame({'key': pd.Series(table.index, dtype='string'), 'hash': table.to_numpy()})
+            table.to_parquet(new_path / f"{name}.parquet", index=False)
+        info = {'version': STATE_VERSION, 'settings': settings, **(extra or {}),
+                'files': {level: {'file': Path(path).name, 'id': file_id(path)} for level, path in files.items()}}
+        (new_path / 'state.json').write_text(json.dumps(info, indent=2))
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(new_path, self.path)
+        self.info = info
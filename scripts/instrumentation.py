@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Per-stage timing and memory records for pipeline runs
+
+A StageTimer times the consecutive stages of one run (build_levels() starts
+one per build): wall time, CPU time of the thread running the stage, the
+process's RSS when the stage ends and its change over the stage, and any
+counts the stage notes (rows, features, groups). Other builds running in the
+same process (the web app's job workers) share the RSS, so rss_delta_mb is
+only the stage's own memory when it runs alone; peak_rss_mb is the
+process-wide high-water mark so far. CPU time spent in worker processes
+(--workers) is not counted. As each stage ends a record is emitted:
+
+- as a JSON log line on the 'geojson_pipeline.stages' logger
+  (see log_to_stream() / --log-stages)
+- to every function registered with add_sink() (the web app aggregates
+  them for /api/metrics)
+
+    {"event": "stage", "run": "3f2a...", "stage": "level_county", "level": "county",
+     "wall_seconds": 0.41, "cpu_seconds": 0.39, "rss_mb": 298.1, "rss_delta_mb": 12.4,
+     "peak_rss_mb": 312.5, "features": 3143}
+
+With a cProfile directory, each stage is also profiled and its stats written
+to <dir>/<run>-<stage>.prof (open with python -m pstats, or snakeviz).
+"""
+
+import cProfile
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger('geojson_pipeline.stages')
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+
+def add_sink(sink):
+    """Call sink(record) with every stage record emitted in this process"""
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def emit(record):
+    """Log a record as one JSON line and pass it to the sinks"""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(record, default=str))
+    with _sinks_lock:
+        sinks = list(_sinks)
+    for sink in sinks:
+        sink(record)
+
+
+def log_to_stream(stream=None):
+    """Write the JSON records to stream (default stderr), one per line"""
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return handler
+
+
+def rss_mb():
+    """Current resident set size of this process, in MB (None where unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (None where unavailable)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class StageTimer:
+    """Times the consecutive stages of one run, emitting a record as each one ends"""
+
+    def __init__(self, run=None, cprofile_dir=None, **fields):
+        self.run = run or uuid.uuid4().hex[:12]
+        self.fields = fields
+        self.cprofile_dir = Path(cprofile_dir) if cprofile_dir is not None else None
+        self.records = []
+        self._stage = None
+
+    def start(self, stage, **fields):
+        """End the current stage (if any) and start the next one"""
+        self.end()
+        self._stage = {
+            'name': stage,
+            'fields': dict(fields),
+            'wall': time.perf_counter(),
+            'cpu': time.thread_time(),
+            'rss': rss_mb(),
+            'profiler': cProfile.Profile() if self.cprofile_dir is not None else None
+        }
+        if self._stage['profiler'] is not None:
+            self._stage['profiler'].enable()
+
+    def note(self, **counts):
+        """Add counts (rows, features, ...) to the current stage's record"""
+        if self._stage is not None:
+            self._stage['fields'].update(counts)
+
+    def end(self):
+        """End the current stage and emit its record (returns it, or None)"""
+        stage, self._stage = self._stage, None
+        if stage is None:
+            return None
+        wall = time.perf_counter() - stage['wall']
+        cpu = time.thread_time() - stage['cpu']
+        rss = rss_mb()
+        rss_delta = round(rss - stage['rss'], 1) if rss is not None and stage['rss'] is not None else None
+
+        record = {'event': 'stage', 'run': self.run, 'stage': stage['name'], **self.fields,
+                  'wall_seconds': round(wall, 4), 'cpu_seconds': round(cpu, 4),
+                  'rss_mb': rss, 'rss_delta_mb': rss_delta, 'peak_rss_mb': peak_rss_mb(),
+                  **stage['fields']}
+        profiler = stage['profiler']
+        if profiler is not None:
+            profiler.disable()
+            self.cprofile_dir.mkdir(parents=True, exist_ok=True)
+            record['cprofile'] = str(self.cprofile_dir / f"{self.run}-{stage['name']}.prof")
+            profiler.dump_stats(record['cprofile'])
+
+        self.records.append(record)
+        emit(record)
+        return record
+
+    def summary(self, **fields):
+        """Emit and return a record of the whole run: total times, process peak RSS and every stage's wall time"""
+        self.end()
+        record = {'event': 'run', 'run': self.run, **self.fields, **fields,
+                  'wall_seconds': round(sum(r['wall_seconds'] for r in self.records), 4),
+                  'cpu_seconds': round(sum(r['cpu_seconds'] for r in self.records), 4),
+                  'peak_rss_mb': peak_rss_mb(),
+                  'stages': {r['stage']: r['wall_seconds'] for r in self.records}}
+        emit(record)
+        return record
+
+
+class LatencyHistograms:
+    """
+    Aggregates records into latency histograms (thread-safe), one per stage
+    name (so level_<level> and write_<level> are the latencies of each level)
+    and one for whole runs, with the largest RSS change of a stage and the
+    process's peak RSS
+    """
+
+    BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+    def __init__(self, buckets=None):
+        self.buckets = list(buckets or self.BUCKETS)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self.runs = 0
+        self.started = time.time()
+
+    def _observe(self, key, seconds, peak_rss, rss_delta=None):
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = {
+                'count': 0, 'sum_seconds': 0.0, 'max_seconds': 0.0, 'max_rss_delta_mb': None, 'peak_rss_mb': None,
+                'buckets': [0] * (len(self.buckets) + 1)
+            }
+        histogram['count'] += 1
+        histogram['sum_seconds'] += seconds
+        histogram['max_seconds'] = max(histogram['max_seconds'], seconds)
+        if rss_delta is not None:
+            largest = histogram['max_rss_delta_mb']
+            histogram['max_rss_delta_mb'] = rss_delta if largest is None else max(largest, rss_delta)
+        if peak_rss is not None:
+            histogram['peak_rss_mb'] = max(histogram['peak_rss_mb'] or 0, peak_rss)
+        # First bucket whose upper bound the latency fits under (the last one is +Inf)
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        histogram['buckets'][index] += 1
+
+    def __call__(self, record):
+        """Sink for add_sink()"""
+        with self._lock:
+            if record.get('event') == 'run':
+                self.runs += 1
+                self._observe('run', record['wall_seconds'], record.get('peak_rss_mb'))
+            elif record.get('event') == 'stage':
+                self._observe(record['stage'], record['wall_seconds'], record.get('peak_rss_mb'),
+                              record.get('rss_delta_mb'))
+
+    def to_dict(self):
+        """Histograms as cumulative bucket counts ({'le': bound, 'count': n}), with mean latency"""
+        with self._lock:
+            histograms = {}
+            for key, histogram in sorted(self._histograms.items()):
+                cumulative, total = [], 0
+                for bound, count in zip(self.buckets + ['+Inf'], histogram['buckets']):
+                    total += count
+                    cumulative.append({'le': bound, 'count': total})
+                histograms[key] = {
+                    'count': histogram['count'],
+                    'mean_seconds': round(histogram['sum_seconds'] / histogram['count'], 4),
+                    'max_seconds': round(histogram['max_seconds'], 4),
+                    'sum_seconds': round(histogram['sum_seconds'], 4),
+                    'max_rss_delta_mb': histogram['max_rss_delta_mb'],
+                    'peak_rss_mb': histogram['peak_rss_mb'],
+                    'buckets': cumulative
+                }
+            return {'since': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    'runs': self.runs, 'stages': histograms}
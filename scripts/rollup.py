@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Hierarchical rollup: ZIP rows → county → chapter → region → division
+
+The raw ZIP-level rows are grouped only once, into "cells" keyed by the full
+hierarchy path (FIPS, Chapter, Region, Division). Every level after that is
+aggregated from the previous level's cells, which are much smaller:
+
+    rows ─► county cells (FIPS, Chapter, Region, Division) ─► county output
+                 │
+                 └► chapter cells (Chapter, Region, Division) ─► chapter output
+                         │
+                         └► region cells (Region, Division) ─► region output
+                                 │
+                                 └► division cells (Division) = division output
+
+Keeping the ancestor keys in each level's cells keeps sums exact even when a
+county is split between chapters. The FIPS → group memberships used to
+dissolve boundaries come from the county cells too.
+
+Aggregation specs are declared per column:
+    'sum'                    total of the values
+    'first'                  first non-null value
+    'mean'                   mean of the non-null values (carried as sum + count)
+    ('weighted', weight_col) weighted mean (carried as sum(x*w) + sum(w))
+"""
+
+import pandas as pd
+
+# Level, its key column, and the hierarchy keys that level's cells carry
+HIERARCHY = [
+    ('county', 'FIPS', ['FIPS', 'Chapter', 'Region', 'Division']),
+    ('chapter', 'Chapter', ['Chapter', 'Region', 'Division']),
+    ('region', 'Region', ['Region', 'Division']),
+    ('division', 'Division', ['Division'])
+]
+
+# Descriptive ('first') columns each level keeps
+LEVEL_ATTRIBUTES = {
+    'county': ['County', 'State', 'Chapter', 'Region', 'Division', 'ECODE', 'RCODE', 'DCODE'],
+    'chapter': ['Region', 'Division', 'RCODE', 'DCODE'],
+    'region': ['Division', 'RCODE', 'DCODE'],
+    'division': ['DCODE']
+}
+
+# Pre-aggregated total columns each level keeps (by name), None = all of them
+LEVEL_TOTAL_KEYWORDS = {
+    'county': None,
+    'chapter': ['Chapter', 'Region', 'Division'],
+    'region': ['Region', 'Division'],
+    'division': ['Division']
+}
+
+AGGREGATIONS = ('sum', 'first', 'mean', 'weighted')
+
+
+def default_specs(year_cols, total_cols):
+    """Specs matching the pipeline: sum the year columns, keep totals as-is"""
+    specs = {col: 'first' for col in LEVEL_ATTRIBUTES['county']}
+    specs.update({col: 'sum' for col in year_cols})
+    specs.update({col: 'first' for col in total_cols})  # Totals are already aggregated
+    return specs
+
+
+def _kind(spec):
+    kind = spec[0] if isinstance(spec, tuple) else spec
+    if kind not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation: {spec} (choose from {', '.join(AGGREGATIONS)})")
+    return kind
+
+
+def parse_spec(text):
+    """A 'COLUMN=HOW' option as (column, spec); HOW is sum, first, mean or weighted:WEIGHT_COLUMN"""
+    column, sep, how = text.rpartition('=')
+    if not sep or not column:
+        raise ValueError(f"Aggregation must be COLUMN=HOW: {text}")
+    kind, _, weight = how.partition(':')
+    spec = (kind, weight) if kind == 'weighted' else how
+    if kind == 'weighted' and not weight:
+        raise ValueError(f"Weighted aggregation needs a weight column (COLUMN=weighted:WEIGHT): {text}")
+    _kind(spec)
+    return column, spec
+
+
+def spec_columns(specs):
+    """The columns specs read: every aggregated column and weight column"""
+    columns = []
+    for col, spec in specs.items():
+        columns += [col, spec[1]] if _kind(spec) == 'weighted' else [col]
+    return list(dict.fromkeys(columns))
+
+
+def _prepare_rows(df, specs, keys):
+    """
+    Turn each spec into carried columns (summed or 'first'-ed at every step)
+    Returns (rows, carried) where carried maps carried column → 'sum' or 'first'.
+    """
+    rows = pd.DataFrame({key: df[key] for key in keys}, index=df.index)
+    carried = {}
+    for col, spec in specs.items():
+        kind = _kind(spec)
+        if kind in ('sum', 'first'):
+            if col not in keys:
+                rows[col] = df[col]
+            carried[col] = kind
+        elif kind == 'mean':
+            values = pd.to_numeric(df[col], errors='coerce')
+            rows[f"{col}__sum"] = values
+            rows[f"{col}__count"] = values.notna().astype('int64')
+            carried[f"{col}__sum"] = 'sum'
+            carried[f"{col}__count"] = 'sum'
+        else:
+            weights = pd.to_numeric(df[spec[1]], errors='coerce')
+            values = pd.to_numeric(df[col], errors='coerce')
+            rows[f"{col}__wsum"] = values * weights
+            rows[f"{col}__weight"] = weights.where(values.notna())
+            carried[f"{col}__wsum"] = 'sum'
+            carried[f"{col}__weight"] = 'sum'
+    return rows, carried
+
+
+def _aggregate(table, by, carried, sort=False, dropna=False):
+    """
+    One rollup step: group table by the given keys, summing / first-ing carried columns
+    Cells keep rows with missing keys (dropna=False) so lower levels still count them.
+    Categorical keys only form groups for the categories actually present (observed=True).
+    """
+    by = [by] if isinstance(by, str) else by
+    agg = {col: how for col, how in carried.items() if col in table.columns and col not in by}
+    grouped = table.groupby(by[0] if len(by) == 1 else by, sort=sort, dropna=dropna, observed=True)
+    return grouped.agg(agg).reset_index()
+
+
+def _finalize(cells, level, key, specs, carried):
+    """Build a level's output from its cells: one row per key, columns in spec order"""
+    keywords = LEVEL_TOTAL_KEYWORDS[level]
+    columns = []
+    for col, spec in specs.items():
+        kind = _kind(spec)
+        if col == key:
+            continue
+        if kind == 'first' and col not in LEVEL_ATTRIBUTES[level]:
+            # Totals are kept by name; other descriptive columns only if listed for the level
+            is_total = 'Total' in col
+            if not is_total or (keywords is not None and not any(k in col for k in keywords)):
+                continue
+        columns.append((col, kind))
+
+    output = _aggregate(cells, key, carried, sort=True, dropna=True)
+    result = pd.DataFrame({key: output[key]})
+    for col, kind in columns:
+        if kind in ('sum', 'first'):
+            if col in output.columns:
+                result[col] = output[col]
+        elif kind == 'mean':
+            result[col] = output[f"{col}__sum"] / output[f"{col}__count"].where(output[f"{col}__count"] > 0)
+        else:
+            result[col] = output[f"{col}__wsum"] / output[f"{col}__weight"].where(output[f"{col}__weight"] != 0)
+    return result
+
+
+def rollup_levels(df, specs, levels=None):
+    """
+    Aggregate the hierarchy levels from the ZIP-level rows
+
+    Returns (aggregates, memberships):
+    - aggregates: level → DataFrame with one row per group
+    - memberships: level → DataFrame of (FIPS, group key) pairs, for the
+      levels above county (which counties make up each group)
+    """
+    levels = [level for level, _, _ in HIERARCHY] if levels is None else levels
+    # Columns (or weight columns) missing from this CSV are left out
+    specs = {col: spec for col, spec in specs.items()
+             if col in df.columns and (_kind(spec) != 'weighted' or spec[1] in df.columns)}
+    keys = [key for key in HIERARCHY[0][2] if key in df.columns]
+    rows, carried = _prepare_rows(df, specs, keys)
+
+    # Key columns are also carried so each level can report e.g. its first Chapter
+    carried_with_keys = {**carried, **{key: 'first' for key in keys}}
+
+    aggregates = {}
+    memberships = {}
+    county_cells = cells = _aggregate(rows, keys, carried)
+    wanted = [i for i, (level, _, _) in enumerate(HIERARCHY) if level in levels]
+
+    for i, (level, key, cell_keys) in enumerate(HIERARCHY[:max(wanted, default=-1) + 1]):
+        if i > 0:
+            # Roll the previous level's cells up to this level's (fewer) keys
+            cell_keys = [k for k in cell_keys if k in cells.columns]
+            if not cell_keys:
+                break
+            cells = _aggregate(cells, cell_keys, carried)
+        if level not in levels or key not in cells.columns:
+            continue
+        aggregates[level] = _finalize(cells, level, key, specs, carried_with_keys)
+        if level != 'county' and 'FIPS' in county_cells.columns:
+            memberships[level] = county_cells[['FIPS', key]].dropna().drop_duplicates()
+
+    return aggregates, memberships
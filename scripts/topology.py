@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Shared-arc polygon topology and TopoJSON export
+
+County, chapter, region and division boundaries are all made of the same
+county borders. Here each border is stored once as an arc: polygons are cut
+into arcs at junctions (points where the neighbouring polygons change) and
+identical arcs are shared, so a border between two counties is one arc used by
+both, in opposite directions.
+
+Groups of counties (chapters, regions, divisions) are then built by merging
+their members' rings and dropping every arc used twice inside the group (an
+interior border), which is what makes all levels fit in one topology.
+
+Coordinates are quantized to an integer grid (TopoJSON "transform"), and arcs
+are simplified once per arc, so neighbours never get different versions of a
+shared border.
+"""
+
+import json
+from collections import Counter, defaultdict
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry.polygon import orient
+
+from geojson_writer import clean_value
+
+DEFAULT_QUANTIZATION = 1_000_000
+
+
+class Topology:
+    """
+    Arcs and the polygons built from them
+
+    arcs:       list of (n, 2) int64 arrays of quantized coordinates
+    geometries: for each input geometry, a list of polygons, each a list of
+                rings, each a list of arc references (i, or ~i for arc i reversed)
+    transform:  (kx, ky, x0, y0), real = quantized * k + x0
+    """
+
+    def __init__(self, arcs, geometries, transform):
+        self.arcs = arcs
+        self.geometries = geometries
+        self.transform = transform
+
+
+def _ref_index(ref):
+    return ref if ref >= 0 else ~ref
+
+
+def _oriented_parts(geometries):
+    """Polygon parts with exterior rings counter-clockwise and holes clockwise"""
+    parts, part_geometry = shapely.get_parts(np.asarray(geometries, dtype=object), return_index=True)
+    keep = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)
+    parts = np.array([orient(part, 1.0) for part in parts[keep]], dtype=object)
+    return parts, part_geometry[keep]
+
+
+def build_topology(geometries, quantization=DEFAULT_QUANTIZATION):
+    """
+    Build a shared-arc topology from (Multi)Polygon geometries
+    Non-polygon and empty geometries get an empty polygon list.
+    """
+    geometries = list(geometries)
+    parts, part_geometry = _oriented_parts(geometries)
+    result = [[] for _ in geometries]
+    if len(parts) == 0:
+        return Topology([], result, (1.0, 1.0, 0.0, 0.0))
+
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+
+    # Quantize to an integer grid
+    x0, y0 = coords.min(axis=0)
+    x1, y1 = coords.max(axis=0)
+    kx = (x1 - x0) / (quantization - 1) if x1 > x0 else 1.0
+    ky = (y1 - y0) / (quantization - 1) if y1 > y0 else 1.0
+    quantized = np.empty(coords.shape, dtype=np.int64)
+    quantized[:, 0] = np.round((coords[:, 0] - x0) / kx)
+    quantized[:, 1] = np.round((coords[:, 1] - y0) / ky)
+
+    # Drop each ring's closing point and points that collapsed onto the previous one
+    keep = np.ones(len(coords), dtype=bool)
+    keep[:-1] = coord_ring[:-1] == coord_ring[1:]
+    keep[-1] = False
+    same_as_previous = np.zeros(len(coords), dtype=bool)
+    same_as_previous[1:] = (coord_ring[1:] == coord_ring[:-1]) & np.all(quantized[1:] == quantized[:-1], axis=1)
+    keep &= ~same_as_previous
+    quantized = quantized[keep]
+    coord_ring = coord_ring[keep]
+
+    # One id per distinct point (packed into one int64 key: a 1-d unique is much faster)
+    height = int(quantized[:, 1].max()) + 1
+    point_keys, point_id = np.unique(quantized[:, 0] * height + quantized[:, 1], return_inverse=True)
+    points = np.stack([point_keys // height, point_keys % height], axis=1)
+    point_id = point_id.ravel()
+
+    # Ring bounds, and each vertex's neighbours along its ring
+    ring_ids = np.arange(len(rings))
+    starts = np.searchsorted(coord_ring, ring_ids)
+    ends = np.searchsorted(coord_ring, ring_ids, side='right')
+    index = np.arange(len(point_id))
+    previous_index = index - 1
+    next_index = index + 1
+    vertex_start = starts[coord_ring]
+    vertex_end = ends[coord_ring]
+    previous_index[index == vertex_start] = vertex_end[index == vertex_start] - 1
+    next_index[index == vertex_end - 1] = vertex_start[index == vertex_end - 1]
+
+    # A point is a junction if rings pass through it with different neighbours
+    a = point_id[previous_index]
+    b = point_id[next_index]
+    neighbour_pair = np.minimum(a, b) * len(points) + np.maximum(a, b)
+    visits = pd.DataFrame({'point': point_id, 'pair': neighbour_pair}).drop_duplicates()
+    is_junction = np.bincount(visits['point'].values, minlength=len(points)) > 1
+
+    # Cut rings into arcs at junctions, sharing identical arcs
+    arcs = []
+    arc_lookup = {}
+
+    def add_arc(ids):
+        key = ids.tobytes()
+        if key in arc_lookup:
+            return arc_lookup[key]
+        reverse_key = ids[::-1].tobytes()
+        if reverse_key in arc_lookup:
+            return ~arc_lookup[reverse_key]
+        arc_lookup[key] = len(arcs)
+        arcs.append(ids)
+        return len(arcs) - 1
+
+    ring_refs = []
+    for ring in ring_ids:
+        ids = point_id[starts[ring]:ends[ring]]
+        if len(np.unique(ids)) < 3:
+            ring_refs.append(None)
+            continue
+        junctions = np.flatnonzero(is_junction[ids])
+        if len(junctions) == 0:
+            # No junctions: the whole ring is one closed arc, starting at its lowest point id
+            first = int(np.argmin(ids))
+            ids = np.roll(ids, -first)
+            ring_refs.append([add_arc(np.append(ids, ids[0]))])
+            continue
+
+        ids = np.roll(ids, -junctions[0])
+        junctions = junctions - junctions[0]
+        cuts = list(junctions) + [len(ids)]
+        closed = np.append(ids, ids[0])
+        ring_refs.append([add_arc(closed[cuts[i]:cuts[i + 1] + 1]) for i in range(len(cuts) - 1)])
+
+    # Group rings back into polygons and polygons into geometries
+    first_ring_of_part = np.r_[True, ring_part[1:] != ring_part[:-1]]
+    polygons = {}
+    for ring, refs in enumerate(ring_refs):
+        part = ring_part[ring]
+        if first_ring_of_part[ring]:
+            polygons[part] = [refs] if refs is not None else None
+        elif refs is not None and polygons.get(part) is not None:
+            polygons[part].append(refs)
+
+    for part, polygon in polygons.items():
+        if polygon is not None:
+            result[part_geometry[part]].append(polygon)
+
+    return Topology([points[ids] for ids in arcs], result, (kx, ky, x0, y0))
+
+
+def simplify_arcs(topology, tolerance):
+    """
+    Douglas-Peucker simplify every arc once (in real coordinate units)
+    Arc endpoints are junctions and are always kept, so neighbours stay joined.
+    """
+    if tolerance is None or not topology.arcs:
+        return topology
+    kx, ky, x0, y0 = topology.transform
+
+    lines = [shapely.linestrings(arc * [kx, ky] + [x0, y0]) for arc in topology.arcs]
+    simplified = shapely.simplify(np.array(lines, dtype=object), tolerance, preserve_topology=False)
+
+    arcs = []
+    for arc, line in zip(topology.arcs, simplified):
+        coords = shapely.get_coordinates(line)
+        new_arc = np.empty(coords.shape, dtype=np.int64)
+        new_arc[:, 0] = np.round((coords[:, 0] - x0) / kx)
+        new_arc[:, 1] = np.round((coords[:, 1] - y0) / ky)
+        is_closed = len(arc) > 1 and np.array_equal(arc[0], arc[-1])
+        if len(new_arc) < (4 if is_closed else 2):
+            new_arc = arc
+        arcs.append(new_arc)
+
+    topology.arcs = arcs
+    return topology
+
+
+def _arc_points(topology, ref):
+    arc = topology.arcs[_ref_index(ref)]
+    return arc if ref >= 0 else arc[::-1]
+
+
+def ring_coordinates(topology, refs):
+    """Quantized coordinates of a ring given as arc references"""
+    pieces = [_arc_points(topology, ref) for ref in refs]
+    return np.concatenate([pieces[0]] + [piece[1:] for piece in pieces[1:]])
+
+
+def _signed_area(coords):
+    x = coords[:, 0].astype(float)
+    y = coords[:, 1].astype(float)
+    return 0.5 * float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1]))
+
+
+def merge(topology, geometry_indices):
+    """
+    Merge geometries into one polygon list by dropping shared interior arcs
+    Returns polygons in the same form as Topology.geometries entries.
+    """
+    refs = [ref for g in geometry_indices for polygon in topology.geometries[g]
+            for ring in polygon for ref in ring]
+    uses = Counter(_ref_index(ref) for ref in refs)
+    return assemble(topology, [ref for ref in refs if uses[_ref_index(ref)] == 1])
+
+
+def assemble(topology, boundary):
+    """
+    Stitch outline arcs (arc references, each used once) into polygons
+    Returns polygons in the same form as Topology.geometries entries.
+    """
+    def start(ref):
+        return tuple(_arc_points(topology, ref)[0])
+
+    def end(ref):
+        return tuple(_arc_points(topology, ref)[-1])
+
+    # Stitch the boundary arcs into closed rings
+    by_start = defaultdict(list)
+    for ref in boundary:
+        by_start[start(ref)].append(ref)
+
+    rings = []
+    for ref in boundary:
+        if ref not in by_start[start(ref)]:
+            continue
+        by_start[start(ref)].remove(ref)
+        ring = [ref]
+        ring_start = start(ref)
+        point = end(ref)
+        while point != ring_start and by_start.get(point):
+            next_ref = by_start[point].pop()
+            ring.append(next_ref)
+            point = end(next_ref)
+        if point == ring_start:
+            rings.append(ring)
+
+    # Counter-clockwise rings are exteriors, clockwise rings are holes
+    exteriors = []
+    holes = []
+    for ring in rings:
+        area = _signed_area(ring_coordinates(topology, ring))
+        if area > 0:
+            exteriors.append(ring)
+        elif area < 0:
+            holes.append(ring)
+
+    polygons = [[ring] for ring in exteriors]
+    if holes and polygons:
+        shells = [shapely.Polygon(ring_coordinates(topology, ring)) for ring in exteriors]
+        for hole in holes:
+            inside = shapely.Polygon(ring_coordinates(topology, hole)).point_on_surface()
+            owner = next((i for i, shell in enumerate(shells) if shell.contains(inside)),
+                         int(np.argmax([shell.area for shell in shells])))
+            polygons[owner].append(hole)
+
+    return polygons
+
+
+def to_shapely(topology, polygons):
+    """
+    Build a shapely (Multi)Polygon in real coordinates from topology polygons
+    Rings that simplification collapsed are left out. Returns None if nothing is left.
+    """
+    kx, ky, x0, y0 = topology.transform
+    shapes = []
+    for polygon in _drop_collapsed(topology, polygons):
+        rings = [ring_coordinates(topology, ring) * [kx, ky] + [x0, y0] for ring in polygon]
+        shapes.append(shapely.Polygon(rings[0], rings[1:]))
+    if not shapes:
+        return None
+    return shapes[0] if len(shapes) == 1 else shapely.MultiPolygon(shapes)
+
+
+def _drop_collapsed(topology, polygons):
+    """Drop rings that simplification collapsed to no area (and polygons that lost their exterior)"""
+    kept = []
+    for polygon in polygons:
+        rings = [ring for ring in polygon if _signed_area(ring_coordinates(topology, ring)) != 0]
+        if rings and rings[0] is polygon[0]:
+            kept.append(rings)
+    return kept
+
+
+def to_topojson(topology, objects):
+    """
+    Encode objects as a TopoJSON dict
+    objects maps object name to a list of (polygons, properties) pairs.
+    Only arcs that are used are written, delta-encoded.
+    """
+    used = {}
+    encoded_objects = {}
+    for name, features in objects.items():
+        geometries = []
+        for polygons, properties in features:
+            polygons = _drop_collapsed(topology, polygons)
+            arc_rings = [[[_remap(ref, used) for ref in ring] for ring in polygon] for polygon in polygons]
+            if not arc_rings:
+                geometry = {"type": None}
+            elif len(arc_rings) == 1:
+                geometry = {"type": "Polygon", "arcs": arc_rings[0]}
+            else:
+                geometry = {"type": "MultiPolygon", "arcs": arc_rings}
+            geometry["properties"] = properties
+            geometries.append(geometry)
+        encoded_objects[name] = {"type": "GeometryCollection", "geometries": geometries}
+
+    arcs = [None] * len(used)
+    for old, new in used.items():
+        arc = topology.arcs[old]
+        deltas = np.vstack([arc[:1], np.diff(arc, axis=0)])
+        arcs[new] = deltas.tolist()
+
+    kx, ky, x0, y0 = topology.transform
+    return {
+        "type": "Topology",
+        "transform": {"scale": [kx, ky], "translate": [x0, y0]},
+        "objects": encoded_objects,
+        "arcs": arcs
+    }
+
+
+def _remap(ref, used):
+    index = _ref_index(ref)
+    if index not in used:
+        used[index] = len(used)
+    new = used[index]
+    return new if ref >= 0 else ~new
+
+
+def write_topojson(path, base_gdf, key_col, layers, simplify=None, quantization=DEFAULT_QUANTIZATION):
+    """
+    Write several levels built from one set of base polygons as one TopoJSON file
+
+    base_gdf holds the base polygons (e.g. counties) with a key column (FIPS).
+    layers maps object name to (properties, group_col, membership):
+    - properties: DataFrame with one row per feature, keyed by group_col
+    - membership: DataFrame of (key_col, group_col) pairs saying which base
+      polygons make up each group, or None when group_col is key_col itself
+    Returns the number of arcs written.
+    """
+    topology = build_topology(base_gdf.geometry.values, quantization)
+    simplify_arcs(topology, simplify)
+    position = pd.Series(np.arange(len(base_gdf)), index=base_gdf[key_col].values)
+    position = position[~position.index.duplicated()]
+
+    objects = {}
+    for name, (properties, group_col, membership) in layers.items():
+        if membership is None:
+            members = {key: [key] for key in properties[group_col]}
+        else:
+            # In key order, so a group's rings start in the same place whatever order its members come in
+            members = membership.sort_values(key_col, kind='stable').groupby(group_col)[key_col].apply(list).to_dict()
+
+        features = []
+        property_cols = [col for col in properties.columns if col != 'geometry']
+        for record in properties[property_cols].to_dict('records'):
+            indices = [position[key] for key in members.get(record[group_col], []) if key in position.index]
+            if membership is None:
+                polygons = [p for i in indices for p in topology.geometries[i]]
+            else:
+                polygons = merge(topology, indices)
+            record = {key: clean_value(value) for key, value in record.items()}
+            features.append((polygons, record))
+        objects[name] = features
+
+    topojson = to_topojson(topology, objects)
+    with open(path, 'w') as f:
+        json.dump(topojson, f, separators=(',', ':'))
+    return len(topojson["arcs"])
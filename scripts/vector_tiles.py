@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Mapbox Vector Tiles cut from generated level files
+
+The preview map used to load a whole level into the browser (the national
+ZIP layer is hundreds of MB). A TileSource loads a level file once,
+projects it to Web Mercator and indexes it with an STRtree; a tile is then
+only the features that touch it:
+
+- simplified for its zoom (half a screen pixel, computed once per zoom for
+  the whole level and kept in memory)
+- features smaller than a pixel dropped
+- clipped to the tile plus a small buffer, scaled to the tile's 4096 grid
+
+so rendering a tile costs the same at any dataset size. Tiles are written to
+a cache directory the first time they are asked for (see TileCache).
+
+mapbox-vector-tile is an optional dependency, only needed for tiles:
+
+    pip install mapbox-vector-tile
+"""
+
+import math
+import os
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import shapely
+
+# Tile grid (MVT default) and the clip buffer around each tile, in grid units
+EXTENT = 4096
+BUFFER = 64
+
+# Web Mercator half-width, in metres
+ORIGIN = math.pi * 6378137
+
+MAX_ZOOM = 22
+
+# Simplification tolerance, in 256-pixel screen pixels; from this zoom on
+# the level's own geometry is used unsimplified
+SIMPLIFY_PIXELS = 0.5
+FULL_DETAIL_ZOOM = 14
+
+# TileSources kept in memory (one per level file)
+SOURCES_CACHED = 8
+
+
+class TilesUnavailable(Exception):
+    """Raised when tiles cannot be made (no mapbox-vector-tile, or a level without geometry)"""
+
+
+def tile_bounds(z, x, y):
+    """(minx, miny, maxx, maxy) of tile z/x/y in Web Mercator metres"""
+    size = 2 * ORIGIN / 2 ** z
+    minx = -ORIGIN + x * size
+    maxy = ORIGIN - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _properties(frame):
+    """Feature properties as plain Python values, without missing ones"""
+    records = frame.to_dict('records')
+    return [{key: value for key, value in record.items()
+             if value is not None and not (isinstance(value, float) and math.isnan(value))}
+            for record in records]
+
+
+class TileSource:
+    """One level file, projected and indexed for cutting tiles"""
+
+    def __init__(self, path, layer=None):
+        import geopandas as gpd
+
+        self.path = Path(path)
+        self.layer = layer or self.path.stem
+        gdf = gpd.read_file(self.path)
+        if gdf.geometry.isna().all():
+            raise TilesUnavailable(f"{self.path.name} has no geometry (written without boundaries)")
+        gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty].to_crs('EPSG:3857')
+
+        self.geometries = np.asarray(gdf.geometry.values, dtype=object)
+        self.properties = _properties(gdf.drop(columns='geometry'))
+        self.tree = shapely.STRtree(self.geometries)
+        self._simplified = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def _geometries_at(self, z):
+        """The level's geometries simplified for zoom z (computed once per zoom)"""
+        if z >= FULL_DETAIL_ZOOM:
+            return self.geometries
+        with self._lock:
+            if z not in self._simplified:
+                pixel = 2 * ORIGIN / 2 ** z / 256
+                self._simplified[z] = shapely.simplify(self.geometries, pixel * SIMPLIFY_PIXELS,
+                                                       preserve_topology=True)
+            return self._simplified[z]
+
+    def render(self, z, x, y):
+        """The tile's MVT bytes (b'' if no feature touches it)"""
+        try:
+            import mapbox_vector_tile
+        except ImportError as e:
+            raise TilesUnavailable("Vector tiles need mapbox-vector-tile (pip install mapbox-vector-tile)") from e
+
+        minx, miny, maxx, maxy = tile_bounds(z, x, y)
+        size = maxx - minx
+        margin = size * BUFFER / EXTENT
+        clip = (minx - margin, miny - margin, maxx + margin, maxy + margin)
+
+        candidates = self.tree.query(shapely.box(*clip))
+        if len(candidates) == 0:
+            return b''
+        candidates.sort()
+        # Features under a pixel can't be seen at this zoom
+        pixel = size / 256
+        geometries = self._geometries_at(z)[candidates]
+        visible = (shapely.area(geometries) >= pixel * pixel) | (shapely.get_dimensions(geometries) < 2)
+        candidates, geometries = candidates[visible], geometries[visible]
+
+        clipped = shapely.clip_by_rect(geometries, *clip)
+        # Scale to the tile grid (y up; the encoder flips it)
+        scale = EXTENT / size
+        clipped = shapely.transform(clipped, lambda coords: (coords - [minx, miny]) * scale)
+
+        features = [{'geometry': geometry, 'properties': self.properties[i]}
+                    for i, geometry in zip(candidates, clipped) if not geometry.is_empty]
+        if not features:
+            return b''
+        return mapbox_vector_tile.encode([{'name': self.layer, 'features': features}],
+                                         default_options={'extents': EXTENT})
+
+
+@lru_cache(maxsize=SOURCES_CACHED)
+def _load_source(path, layer, mtime):
+    return TileSource(path, layer)
+
+
+def load_source(path, layer=None):
+    """The TileSource of a level file (kept in memory, reloaded if the file changes)"""
+    path = Path(path)
+    return _load_source(path, layer, path.stat().st_mtime_ns)
+
+
+class TileCache:
+    """Rendered tiles on disk: <folder>/<z>/<x>/<y>.pbf (an empty file for an empty tile)"""
+
+    def __init__(self, folder, source_path, layer=None):
+        self.folder = Path(folder)
+        self.source_path = Path(source_path)
+        self.layer = layer
+
+    def get(self, z, x, y):
+        """The tile's bytes, rendered and stored the first time it is asked for"""
+        path = self.folder / str(z) / str(x) / f"{y}.pbf"
+        if path.exists():
+            return path.read_bytes()
+
+        tile = load_source(self.source_path, self.layer).render(z, x, y)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(tile)
+        os.replace(tmp_path, path)
+        return tile
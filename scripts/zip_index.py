@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Compact ZIP → FIPS index, compiled from zip_to_fips.json
+
+zip_to_fips.json is ~85k lines of pretty-printed JSON (with junk entries
+like "(blank)" and "00nan"). The build step turns it into a small binary
+file of two sorted arrays, which is memory-mapped instead of parsed:
+
+    header  8 bytes magic, uint32 version, uint32 count (little-endian)
+    zips    uint32[count], sorted ascending
+    fips    uint32[count], the county FIPS of each ZIP (0 = not known)
+
+Lookups are a binary search over the ZIP array (O(log n)), vectorized over
+whole columns. Build it (the loader also builds it on first use):
+
+    python3 scripts/zip_index.py build
+    python3 scripts/zip_index.py lookup 01420 33101
+"""
+
+import argparse
+import json
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from column_detector import format_code, to_code
+
+DATA_DIR = Path(__file__).parent.parent
+SOURCE_FILE = DATA_DIR / "zip_to_fips.json"
+INDEX_FILE = DATA_DIR / "zip_to_fips.idx"
+
+MAGIC = b'ZIPFIPS\0'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+
+
+def build_index(source=SOURCE_FILE, output=INDEX_FILE):
+    """
+    Compile the JSON crosswalk into the binary index
+    Entries whose ZIP isn't a 5-digit code are dropped; a FIPS that isn't
+    one (e.g. "00nan") is stored as 0. Returns the number of ZIPs indexed.
+    """
+    with open(source) as f:
+        entries = json.load(f)['zipCodes']
+
+    zips = to_code(pd.Series([str(entry.get('Zip', '')) for entry in entries]))
+    fips = to_code(pd.Series([str(entry.get('FIPS', '')) for entry in entries]))
+    five_digits = pd.Series([len(str(entry.get('Zip', ''))) == 5 for entry in entries])
+    valid = zips.notna() & five_digits
+
+    table = pd.DataFrame({'zip': zips[valid], 'fips': fips[valid].fillna(0)})
+    # The first entry wins if a ZIP is listed twice
+    table = table.drop_duplicates('zip').sort_values('zip')
+
+    output = Path(output)
+    tmp_path = output.with_suffix('.idx.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(table)))
+        f.write(table['zip'].to_numpy(dtype='<u4').tobytes())
+        f.write(table['fips'].to_numpy(dtype='<u4').tobytes())
+    os.replace(tmp_path, output)
+    return len(table)
+
+
+class ZipIndex:
+    """Memory-mapped ZIP → FIPS index (see build_index())"""
+
+    def __init__(self, path=INDEX_FILE):
+        with open(path, 'rb') as f:
+            magic, version, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a ZIP index (version {VERSION}), rebuild it")
+        self.path = Path(path)
+        if count == 0:
+            self.zips = self.fips = np.zeros(0, dtype='<u4')
+            return
+        self.zips = np.memmap(path, dtype='<u4', mode='r', offset=HEADER.size, shape=(count,))
+        self.fips = np.memmap(path, dtype='<u4', mode='r', offset=HEADER.size + 4 * count, shape=(count,))
+
+    def __len__(self):
+        return len(self.zips)
+
+    def _positions(self, codes):
+        """Index position of each ZIP code, and whether it was found"""
+        codes = np.asarray(codes, dtype=np.uint32)
+        if len(self.zips) == 0:
+            return np.zeros(len(codes), dtype=np.int64), np.zeros(len(codes), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.zips, codes), len(self.zips) - 1)
+        return positions, self.zips[positions] == codes
+
+    def contains(self, zip_codes):
+        """Which ZIP codes (as UInt32 codes, see column_detector.to_code) are in the index"""
+        zip_codes = pd.Series(zip_codes)
+        present = zip_codes.notna().to_numpy()
+        _, found = self._positions(zip_codes.to_numpy(dtype='uint32', na_value=0))
+        return pd.Series(found & present, index=zip_codes.index)
+
+    def lookup(self, zip_codes):
+        """FIPS codes (UInt32) of ZIP codes (UInt32), NA where the ZIP or its county is unknown"""
+        zip_codes = pd.Series(zip_codes)
+        present = zip_codes.notna().to_numpy()
+        positions, found = self._positions(zip_codes.to_numpy(dtype='uint32', na_value=0))
+        fips = np.where(found, self.fips[positions], 0).astype(np.uint32)
+        known = found & present & (fips != 0)
+        return pd.Series(pd.arrays.IntegerArray(fips, ~known), index=zip_codes.index)
+
+
+_index = None
+
+
+def load_index(path=INDEX_FILE):
+    """The ZIP index (memory-mapped once per process), built from the JSON first if missing"""
+    global _index
+    if _index is None or _index.path != Path(path):
+        if not Path(path).exists():
+            print(f"   Building ZIP index {Path(path).name} from {SOURCE_FILE.name}...")
+            build_index(output=path)
+        _index = ZipIndex(path)
+    return _index
+
+
+def fill_fips(df, index=None):
+    """
+    Fill missing FIPS codes from the ZIP codes, in place
+    Works on standardized frames (Zip / FIPS as UInt32 codes). Returns the
+    number of rows filled.
+    """
+    missing = df['FIPS'].isna() & df['Zip'].notna()
+    if not missing.any():
+        return 0
+    index = load_index() if index is None else index
+    fips = index.lookup(df.loc[missing, 'Zip'])
+    df.loc[missing, 'FIPS'] = fips
+    return int(fips.notna().sum())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile and query the ZIP → FIPS index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Compile zip_to_fips.json into the binary index")
+    build.add_argument('--source', default=SOURCE_FILE, help="ZIP crosswalk JSON")
+    build.add_argument('--output', default=INDEX_FILE, help="Index file to write")
+    lookup = subparsers.add_parser('lookup', help="Look up the FIPS code of ZIP codes")
+    lookup.add_argument('zips', nargs='+', help="ZIP codes")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        count = build_index(args.source, args.output)
+        print(f"✓ Indexed {count:,} ZIP codes in {args.output} ({Path(args.output).stat().st_size / 1024:.0f} KB)")
+    else:
+        fips = format_code(load_index().lookup(to_code(pd.Series(args.zips))))
+        for zip_code, county in zip(args.zips, fips):
+            print(f"{zip_code}\t{county or 'not found'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Incremental builds write the same files as full builds (see scripts/incremental.py)
+
+Runs the pipeline offline on a small synthetic CSV and fixture boundaries
+(see scripts/benchmark_pipeline.py).
+"""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'scripts'))
+
+from benchmark_pipeline import generate_csv, synthetic_universe, write_fixture_boundaries
+from create_geojson_levels import LEVELS, build_levels
+
+# Divisions the fixture universe is limited to (keeps the boundaries small)
+DIVISIONS = 2
+ROWS = 3000
+
+
+@pytest.fixture(scope='module')
+def fixture(tmp_path_factory):
+    """Fixture boundary store and the base CSV's rows (all values as text)"""
+    path = tmp_path_factory.mktemp('incremental')
+    universe = synthetic_universe()
+    universe = universe[universe['Division'].isin(universe['Division'].dropna().unique()[:DIVISIONS])]
+    cache_dir = path / 'boundaries'
+    write_fixture_boundaries(cache_dir, universe)
+    rows = pd.read_csv(generate_csv(path / 'generated.csv', ROWS, universe), dtype=str, keep_default_na=False)
+    return cache_dir, rows
+
+
+def changed_rows(rows):
+    """New numbers for a few ZIPs' rows"""
+    rows = rows.copy()
+    picked = rows['Zip'].isin(rows['Zip'].unique()[:5])
+    rows.loc[picked, '2023'] = (rows.loc[picked, '2023'].astype(int) + 7).astype(str)
+    return rows
+
+
+def added_rows(rows):
+    """Rows of a few ZIPs appended, with new numbers"""
+    extra = changed_rows(rows)[rows['Zip'].isin(rows['Zip'].unique()[-3:])]
+    return pd.concat([rows, extra], ignore_index=True)
+
+
+def reordered_rows(rows):
+    """The same rows shuffled (every group keeps its counties, in another order)"""
+    return rows.sample(frac=1, random_state=0).reset_index(drop=True)
+
+
+def dropped_rows(rows):
+    """Every row of a few counties removed (their groups lose counties, some groups vanish)"""
+    counties = rows['FIPS'].unique()
+    return rows[~rows['FIPS'].isin(counties[::7])].reset_index(drop=True)
+
+
+def build(csv_file, output_dir, cache_dir, incremental, dissolve_cache):
+    return build_levels(csv_file, levels=LEVELS, output_dir=output_dir, cache_dir=cache_dir, offline=True,
+                        topojson=True, incremental=incremental, dissolve_cache=dissolve_cache)
+
+
+def copy_store(cache_dir, store):
+    """A copy of the fixture boundaries, with an empty dissolve cache"""
+    store.mkdir()
+    for path in cache_dir.glob('*.parquet'):
+        (store / path.name).write_bytes(path.read_bytes())
+    return store
+
+
+@pytest.mark.parametrize('dissolve_cache', [False, True])
+@pytest.mark.parametrize('change', [changed_rows, added_rows, reordered_rows, dropped_rows])
+def test_incremental_matches_full_build(fixture, tmp_path, change, dissolve_cache):
+    cache_dir, rows = fixture
+    base_csv, new_csv = tmp_path / 'base.csv', tmp_path / 'new.csv'
+    rows.to_csv(base_csv, index=False)
+    change(rows).to_csv(new_csv, index=False)
+
+    # What a build from scratch writes: nothing cached, nothing reused
+    expected = build(new_csv, tmp_path / 'expected', copy_store(cache_dir, tmp_path / 'clean'), False, False)
+
+    # The incremental run starts from the base CSV's build; with the dissolve
+    # cache, that build also fills the cache the other builds read from
+    store = copy_store(cache_dir, tmp_path / 'boundaries')
+    build(base_csv, tmp_path / 'incremental', store, True, dissolve_cache)
+    builds = {'incremental': build(new_csv, tmp_path / 'incremental', store, True, dissolve_cache)}
+    if dissolve_cache:
+        builds['full'] = build(new_csv, tmp_path / 'full', store, False, True)
+
+    for name, files in builds.items():
+        assert sorted(files) == sorted(expected), name
+        for key, path in expected.items():
+            assert Path(files[key]).read_bytes() == Path(path).read_bytes(), f"{name} build: {key} differs"
@@ -0,0 +1,75 @@
+"""
+Aggregation specs passed to build_levels() roll up through every level (see scripts/rollup.py)
+
+Runs the pipeline offline on a small synthetic CSV and fixture boundaries
+(see scripts/benchmark_pipeline.py).
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'scripts'))
+
+from benchmark_pipeline import generate_csv, synthetic_universe, write_fixture_boundaries
+from create_geojson_levels import OUTPUT_FILENAMES, build_levels
+
+DIVISIONS = 2
+ROWS = 2000
+LEVELS = ['county', 'chapter', 'region', 'division']
+KEYS = {'county': 'FIPS', 'chapter': 'Chapter', 'region': 'Region', 'division': 'Division'}
+SPECS = {'Rate': 'mean', 'Deferral': ('weighted', 'Donors')}
+
+
+@pytest.fixture(scope='module')
+def built(tmp_path_factory):
+    """A build with mean and weighted columns, and the rows it was built from"""
+    path = tmp_path_factory.mktemp('rollup')
+    universe = synthetic_universe()
+    universe = universe[universe['Division'].isin(universe['Division'].dropna().unique()[:DIVISIONS])]
+    cache_dir = path / 'boundaries'
+    write_fixture_boundaries(cache_dir, universe)
+    rows = pd.read_csv(generate_csv(path / 'generated.csv', ROWS, universe), dtype={'FIPS': str})
+
+    rng = np.random.default_rng(0)
+    rows['Rate'] = rng.uniform(0, 1, len(rows)).round(4)
+    rows.loc[rows.index[::9], 'Rate'] = np.nan
+    rows['Deferral'] = rng.uniform(0, 20, len(rows)).round(2)
+    rows['Donors'] = rng.integers(1, 50, len(rows))
+    rows.to_csv(path / 'rates.csv', index=False)
+
+    files = build_levels(path / 'rates.csv', levels=LEVELS, output_dir=path / 'output', cache_dir=cache_dir,
+                         offline=True, dissolve_cache=False, specs=SPECS)
+    return files, rows
+
+
+def level_properties(files, level):
+    with open(files[level]) as f:
+        features = json.load(f)['features']
+    return pd.DataFrame([feature['properties'] for feature in features]).set_index(KEYS[level])
+
+
+@pytest.mark.parametrize('level', LEVELS)
+def test_specs_roll_up_through_every_level(built, level):
+    files, rows = built
+    assert Path(files[level]).name == OUTPUT_FILENAMES[level]
+    properties = level_properties(files, level)
+
+    # Every level is aggregated from the one below, but must equal the same aggregation of the rows
+    groups = rows.groupby(KEYS[level])
+    rate = groups['Rate'].mean()
+    weighted = (rows['Deferral'] * rows['Donors']).groupby(rows[KEYS[level]]).sum() / groups['Donors'].sum()
+
+    assert sorted(properties.index) == sorted(rate.index)
+    np.testing.assert_allclose(properties['Rate'].astype(float), rate[properties.index], rtol=1e-9)
+    np.testing.assert_allclose(properties['Deferral'].astype(float), weighted[properties.index], rtol=1e-9)
+    assert 'Donors' not in properties.columns
+
+
+def test_unknown_aggregation_is_rejected():
+    with pytest.raises(ValueError, match='Unknown aggregation'):
+        build_levels('unused.csv', levels=['county'], specs={'Rate': 'median'})